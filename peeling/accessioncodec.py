@@ -0,0 +1,88 @@
+import numpy as np
+
+# UniProt accessions (https://www.uniprot.org/help/accession_numbers) with an optional isoform suffix, e.g. P12345-2:
+#   [OPQ][0-9][A-Z0-9]{3}[0-9]
+#   [A-NR-Z][0-9]([A-Z][A-Z0-9]{2}[0-9]){1,2}
+# An accession is read as a 10 digit base 36 number, 6 character accessions are padded with '0000'. Position 6 is a
+# letter in every 10 character accession, so the padding is unambiguous. code = number * 1000 + isoform, < 2**63
+
+INVALID_CODE = -1
+MAX_LENGTH = 14 # 10 characters, '-' and an isoform of up to 3 digits
+ISOFORM_BASE = 1000
+POWERS = 36 ** np.arange(9, -1, -1, dtype=np.int64)
+ALPHABET = np.frombuffer(b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ', dtype=np.uint8)
+
+
+def _to_matrix(ids):
+    ids = np.asarray(ids, dtype=object)
+    valid = np.array([isinstance(i, str) and 0 < len(i) <= MAX_LENGTH and i.isascii() for i in ids], dtype=bool)
+    matrix = np.zeros((len(ids), MAX_LENGTH), dtype=np.uint8)
+    if valid.any():
+        chars = np.array(ids[valid].tolist(), dtype=f'S{MAX_LENGTH}')
+        matrix[valid] = chars.view(np.uint8).reshape(-1, MAX_LENGTH)
+    return matrix, valid
+
+
+def encode_accessions(ids):
+    '''
+    ids: sequence of UniProt accessions
+    return int64 array of codes, INVALID_CODE for ids that are not UniProt accessions
+    '''
+    matrix, valid = _to_matrix(ids)
+    digit = (matrix >= ord('0')) & (matrix <= ord('9'))
+    upper = (matrix >= ord('A')) & (matrix <= ord('Z'))
+    alnum = digit | upper
+    first = matrix[:, 0]
+    opq = (first == ord('O')) | (first == ord('P')) | (first == ord('Q'))
+    other_first = upper[:, 0] & ~opq
+
+    # the accession ends at the isoform dash or the end of the id
+    ends = (matrix == ord('-')) | (matrix == 0)
+    length = np.where(ends.any(axis=1), ends.argmax(axis=1), MAX_LENGTH)
+    short = (length == 6) & digit[:, 1] & digit[:, 5] & (
+        (opq & alnum[:, 2] & alnum[:, 3] & alnum[:, 4]) |
+        (other_first & upper[:, 2] & alnum[:, 3] & alnum[:, 4]))
+    long = (length == 10) & other_first & digit[:, 1] & upper[:, 2] & alnum[:, 3] & alnum[:, 4] & digit[:, 5] & \
+        upper[:, 6] & alnum[:, 7] & alnum[:, 8] & digit[:, 9]
+
+    values = np.where(digit, matrix.astype(np.int64) - ord('0'), matrix.astype(np.int64) - ord('A') + 10)
+    values[:, :10][short[:, None] & (np.arange(10) >= 6)] = 0
+    codes = values[:, :10] @ POWERS
+
+    # isoform: '-' followed by 1 to 3 digits, the first of them not 0
+    rows = np.arange(len(matrix))
+    has_dash = matrix[rows, np.minimum(length, MAX_LENGTH - 1)] == ord('-')
+    isoform = np.zeros(len(matrix), dtype=np.int64)
+    isoform_ok = ~has_dash
+    num_digits = np.zeros(len(matrix), dtype=np.int64)
+    for offset in range(1, 4):
+        position = np.minimum(length + offset, MAX_LENGTH - 1)
+        is_digit = has_dash & (length + offset < MAX_LENGTH) & digit[rows, position] & (num_digits == offset - 1)
+        isoform = np.where(is_digit, isoform * 10 + matrix[rows, position].astype(np.int64) - ord('0'), isoform)
+        num_digits += is_digit
+    end_position = np.minimum(length + num_digits + 1, MAX_LENGTH - 1)
+    terminated = (length + num_digits + 1 >= MAX_LENGTH) | (matrix[rows, end_position] == 0)
+    leading_zero = matrix[rows, np.minimum(length + 1, MAX_LENGTH - 1)] == ord('0')
+    isoform_ok |= has_dash & (num_digits > 0) & ~leading_zero & terminated
+
+    codes = codes * ISOFORM_BASE + isoform
+    return np.where(valid & (short | long) & isoform_ok, codes, INVALID_CODE)
+
+
+def decode_accessions(codes):
+    '''
+    return object array of the accessions, None for INVALID_CODE
+    '''
+    codes = np.asarray(codes, dtype=np.int64)
+    valid = codes != INVALID_CODE
+    isoform = np.where(valid, codes % ISOFORM_BASE, 0)
+    number = np.where(valid, codes // ISOFORM_BASE, 0)
+    values = (number[:, None] // POWERS) % 36
+    chars = ALPHABET[values]
+    short = chars[:, 6] == ord('0')
+    chars[short, 6:] = 0
+    accessions = np.ascontiguousarray(chars).view('S10').ravel().astype(str).astype(object)
+    with_isoform = valid & (isoform > 0)
+    accessions[with_isoform] = accessions[with_isoform] + '-' + isoform[with_isoform].astype(str).astype(object)
+    accessions[~valid] = None
+    return accessions
@@ -0,0 +1,219 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import logging
+import pandas as pd
+import matplotlib.pyplot as plt
+from peeling.cliuniprotcommunicator import CliUniProtCommunicator
+from peeling.cliuserinputreader import CliUserInputReader
+from peeling.cliprocessor import CliProcessor
+from peeling.clipantherprocessor import CliPantherProcessor
+from peeling.cellular_compartments import cellular_compartments
+from peeling.httpclientregistry import run_with_clients
+from peeling.referencebundle import find_default_bundle
+from peeling.tablereader import read_table
+from peeling.tablewriter import OUTPUT_FORMATS, check_output_format
+
+logger = logging.getLogger('peeling')
+logger.setLevel(logging.INFO)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s | %(levelname)s: %(message)s'))
+logger.addHandler(log_handler)
+
+SHARED_DATA_DIR = 'shared_data'
+SUMMARY_FILENAME = 'batch_summary.tsv'
+MANIFEST_COLUMNS = ['mass', 'controls', 'replicates']
+
+
+def read_manifest(manifest_filename):
+    '''
+    Tab delimited manifest with a header line, one mass spec file per row
+    Columns: mass, controls, replicates, and optionally tolerance (default 0) and output (default is the name of the mass spec file)
+    Relative mass spec paths are relative to the manifest
+    return list of dict
+    '''
+    manifest = pd.read_table(manifest_filename, sep='\t', header=0, dtype={'mass': str, 'output': str})
+    missing = [col for col in MANIFEST_COLUMNS if col not in manifest.columns]
+    if len(missing) > 0:
+        raise Exception(f'{manifest_filename}: missing manifest column(s) {", ".join(missing)}')
+    base_dir = os.path.dirname(os.path.abspath(manifest_filename))
+    entries = []
+    for row in manifest.to_dict('records'):
+        mass = row['mass'] if os.path.isabs(row['mass']) else os.path.join(base_dir, row['mass'])
+        tolerance = row.get('tolerance')
+        output = row.get('output')
+        entries.append({
+            'mass': mass,
+            'controls': int(row['controls']),
+            'replicates': int(row['replicates']),
+            'tolerance': 0 if pd.isnull(tolerance) else int(tolerance),
+            'output': os.path.splitext(os.path.basename(mass))[0] if pd.isnull(output) else output,
+        })
+    names = [entry['output'] for entry in entries]
+    if len(names) != len(set(names)):
+        raise Exception(f'{manifest_filename}: output names should be unique, set the output column')
+    return entries
+
+
+async def prepare_shared_data(entries, args, shared_path):
+    '''
+    Retrieve the reference sets and the id mapping of all mass spec files once, and save them as local files
+    return (ids_filename, true_positive_filename, false_positive_filename, no_id_mapping) for the per-file analyses
+    '''
+    os.makedirs(shared_path, exist_ok=True)
+    bundle = args.bundle
+    if bundle is None and args.cc in cellular_compartments:
+        bundle = find_default_bundle(args.cc)
+    uniprot_communicator = CliUniProtCommunicator(False, args.cc, args.stream, id_cache=not args.no_id_cache, id_cache_ttl=args.id_cache_ttl, bundle=bundle)
+
+    true_positive_filename = args.tp
+    false_positive_filename = args.fp
+    no_id_mapping = args.nomap
+    if true_positive_filename is None:
+        true_positive_filename = os.path.join(shared_path, 'annotation_true_positive.tsv')
+        false_positive_filename = os.path.join(shared_path, 'annotation_false_positive.tsv')
+        for type, filename in [('true_positive', true_positive_filename), ('false_positive', false_positive_filename)]:
+            annotation = await uniprot_communicator.get_annotation(type)
+            annotation[['Entry']].dropna().to_csv(filename, sep='\t', index=False)
+        # annotations from UniProt have the latest ids already
+        no_id_mapping = True
+
+    ids_filename = args.ids
+    if ids_filename is None:
+        old_ids = set()
+        for entry in entries:
+            old_ids.update(read_table(entry['mass'], numeric=True).iloc[:, 0].dropna())
+        if not no_id_mapping:
+            for filename in [true_positive_filename, false_positive_filename]:
+                old_ids.update(pd.read_table(filename, sep='\t', header=0, usecols=[0]).iloc[:, 0].dropna())
+        logger.info(f'{len(old_ids)} unique ids in {len(entries)} mass spec files and annotations to map')
+        ids = await uniprot_communicator.get_latest_id(list(old_ids))
+        ids_filename = os.path.join(shared_path, 'latest_ids.tsv')
+        ids.to_csv(ids_filename, sep='\t', index=False)
+
+    return ids_filename, true_positive_filename, false_positive_filename, no_id_mapping
+
+
+def run_entry(entry, output_directory, shared_files, cc, plot_format, defer_plots, output_format, panther_organism):
+    '''
+    Analyze one mass spec file of the manifest with the shared data, in a worker process
+    return the path of the results
+    '''
+    ids_filename, true_positive_filename, false_positive_filename, no_id_mapping = shared_files
+    user_input_reader = CliUserInputReader(
+        entry['mass'],
+        entry['controls'],
+        entry['replicates'],
+        os.path.join(output_directory, entry['output']),
+        entry['tolerance'],
+        ids_filename,
+        true_positive_filename,
+        false_positive_filename,
+        False,
+        plot_format,
+        no_id_mapping,
+        cc,
+        1,
+        defer_plots,
+        False,
+        output_format
+    )
+    # all data are local, the communicator is not expected to query UniProt
+    uniprot_communicator = CliUniProtCommunicator(False, cc, id_cache=False)
+    processor = CliProcessor(user_input_reader, uniprot_communicator)
+    path = processor.start()
+    if panther_organism is not None:
+        CliPantherProcessor(panther_organism, path).start()
+    return path
+
+
+def _get_summary_row(entry, future, run_args=None):
+    '''
+    Run the entry unless a finished future is given, failures of single files don't stop the batch
+    '''
+    try:
+        path = future.result() if future is not None else run_entry(entry, *run_args)
+        return [entry['mass'], 'done', path]
+    except Exception as e:
+        logger.error(f'{entry["mass"]}: {e}')
+        return [entry['mass'], 'failed', str(e)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze the mass spec files listed in a manifest, the reference sets and the id mapping are retrieved once for all files')
+    parser.add_argument("manifest", help="tab delimited manifest with the columns mass, controls, replicates, and optionally tolerance and output, one mass spec file per row")
+    parser.add_argument("-o", "--output", help="directory to store output results, one subdirectory per mass spec file")
+    parser.add_argument("-j", "--jobs", type=int, help="number of mass spec files analyzed in parallel worker processes, default is 1")
+    parser.add_argument("-i", "--ids", help="latest_ids file directory, e.g. data/id_mapping.tsv")
+    parser.add_argument(
+        "--cc",
+        "--cellular_compartment",
+        choices=['cs', 'nu', 'mt', 'ot'],
+        help="Choose between: cs - cell surface [default], mt - mitochondria, nu - nucleus or ot - other. If other is chosen, the true positive (--tp) and false positive (--fp) files must be specified.",
+        default="cs"
+    )
+    parser.add_argument("--tp", "--true-positive", help="true positive annotation file, e.g. data/annotation_true_positive.tsv")
+    parser.add_argument("--fp", "--false-positive", help="false positive annotation file, e.g. data/annotation_false_positive.tsv")
+    parser.add_argument("-n", "--nomap", action="store_true", help="no id mapping for local annotation files, true if specified")
+    parser.add_argument("-b", "--bundle", help="reference bundle built by peeling-bundle to read the true positive and false positive annotations from instead of UniProt, by default the bundle of the cellular compartment in the peeling cache directory is used if it exists, its path and age are logged")
+    parser.add_argument("--stream", action="store_true", help="download each UniProt result set in one request from the /stream endpoints, falls back to pagination on error, true if specified")
+    parser.add_argument("--no-id-cache", action="store_true", help="don't keep id mapping results in the local cache (~/.cache/peeling or $PEELING_CACHE_DIR) across runs, true if specified")
+    parser.add_argument("--id-cache-ttl", type=int, default=30, help="days before an id in the local id mapping cache is mapped again, default is 30")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output")
+    parser.add_argument("-f", "--format", choices=list(plt.gcf().canvas.get_supported_filetypes().keys()), help="the output format of plots, default is png")
+    parser.add_argument("-d", "--defer-plots", action="store_true", help="save the TPR/FPR and ROC curve data of each ratio to curves.npz instead of rendering their plots, true if specified")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default='tsv', help="also save the results as parquet or feather files with typed columns, including the include flags of each ratio and the TPR/FPR curves, requires pyarrow, default is tsv only")
+    parser.add_argument("-p", "--panther", help="the organism from which the mass spec data is made, a required input for Panther enrichment analysis, e.g. 'Homo sapiens'")
+
+    args = parser.parse_args()
+
+    if args.cc not in cellular_compartments :
+        if not args.tp or not args.fp:
+            parser.error("The 'true positive' and 'false positive' arguments are required when 'cellular compartment' is set to 'other'.")
+    if (args.tp is None) != (args.fp is None):
+        parser.error("The 'true positive' and 'false positive' arguments must be given together.")
+
+    try:
+        check_output_format(args.output_format)
+    except ImportError as e:
+        parser.error(str(e))
+
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    start_time = datetime.now()
+    entries = read_manifest(args.manifest)
+    output_directory = args.output if args.output is not None else os.getcwd()
+    jobs = args.jobs if args.jobs is not None else 1
+    plot_format = args.format if args.format is not None else 'png'
+    logger.info(f'{start_time} Batch analysis of {len(entries)} mass spec files starts...')
+
+    shared_files = run_with_clients(prepare_shared_data(entries, args, os.path.join(output_directory, SHARED_DATA_DIR)))
+    run_args = (output_directory, shared_files, args.cc, plot_format, args.defer_plots, args.output_format, args.panther)
+
+    if jobs > 1:
+        # rows are collected as the entries finish, the summary keeps the manifest order
+        rows = {}
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(run_entry, entry, *run_args): i for i, entry in enumerate(entries)}
+            for future in as_completed(futures):
+                i = futures[future]
+                rows[i] = _get_summary_row(entries[i], future)
+        summary = [rows[i] for i in range(len(entries))]
+    else:
+        summary = [_get_summary_row(entry, None, run_args) for entry in entries]
+
+    summary = pd.DataFrame(summary, columns=['mass', 'status', 'result'])
+    summary_path = os.path.join(output_directory, SUMMARY_FILENAME)
+    summary.to_csv(summary_path, sep='\t', index=False)
+    failed = int((summary['status'] != 'done').sum())
+    end_time = datetime.now()
+    logger.info(f'{len(entries) - failed} of {len(entries)} mass spec files analyzed, summary saved at {summary_path}')
+    logger.info(f'{end_time} Batch analysis finished! Time: {end_time - start_time}')
+    if failed > 0:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import logging
+import pandas as pd
+from peeling.cliuniprotcommunicator import CliUniProtCommunicator
+from peeling.referencebundle import save_bundle, get_default_bundle_path
+from peeling.cellular_compartments import cellular_compartments
+from peeling.httpclientregistry import run_with_clients
+
+logger = logging.getLogger('peeling')
+logger.setLevel(logging.INFO)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s | %(levelname)s: %(message)s'))
+logger.addHandler(log_handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build an offline reference bundle of the true positive and false positive proteins of a cellular compartment')
+    parser.add_argument(
+        "cc",
+        choices=list(cellular_compartments.keys()),
+        help="Choose between: cs - cell surface, mt - mitochondria or nu - nucleus"
+    )
+    parser.add_argument("-o", "--output", help="bundle file to write, default is <cc>_reference.npz in the peeling cache directory (~/.cache/peeling/bundles or $PEELING_CACHE_DIR/bundles), where peeling picks it up")
+    parser.add_argument("--tp", "--true-positive", help="build from a local true positive annotation file instead of UniProt, e.g. data/annotation_true_positive.tsv")
+    parser.add_argument("--fp", "--false-positive", help="build from a local false positive annotation file instead of UniProt, e.g. data/annotation_false_positive.tsv")
+    parser.add_argument("--stream", action="store_true", help="download each UniProt result set in one request from the /stream endpoints, falls back to pagination on error, true if specified")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output")
+
+    args = parser.parse_args()
+
+    if (args.tp is None) != (args.fp is None):
+        parser.error("The 'true positive' and 'false positive' arguments must be given together.")
+
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    output = args.output if args.output is not None else get_default_bundle_path(args.cc, create=True)
+
+    if args.tp is not None:
+        annotation_true_positive = pd.read_table(args.tp, sep='\t', header=0)
+        annotation_false_positive = pd.read_table(args.fp, sep='\t', header=0)
+        annotation_true_positive.columns = ['Entry'] + list(annotation_true_positive.columns[1:])
+        annotation_false_positive.columns = ['Entry'] + list(annotation_false_positive.columns[1:])
+        source = f'{args.tp}, {args.fp}'
+    else:
+        uniprot_communicator = CliUniProtCommunicator(False, args.cc, args.stream, id_cache=False)
+        annotation_true_positive = run_with_clients(uniprot_communicator.get_annotation('true_positive'))
+        annotation_false_positive = run_with_clients(uniprot_communicator.get_annotation('false_positive'))
+        compartment = cellular_compartments.get(args.cc)
+        source = f'{compartment.get("true_positive")}, {compartment.get("false_positive")}'
+
+    save_bundle(output, args.cc, annotation_true_positive, annotation_false_positive, source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import os
+
+CACHE_DIR_ENV = 'PEELING_CACHE_DIR'
+
+
+def get_cache_dir(*subdirs, create=True):
+    '''
+    Local cache directory of peeling, $PEELING_CACHE_DIR or ~/.cache/peeling by default
+    create: create the directory if missing, off for paths that are only read
+    '''
+    base = os.environ.get(CACHE_DIR_ENV)
+    if not base:
+        base = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'peeling')
+    path = os.path.join(base, *subdirs)
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
@@ -1,14 +1,14 @@
 import logging
-import asyncio
-from peeling.pantherprocessor import PantherProcessor
+from peeling.pantherprocessor import PantherProcessor, API_URL
+from peeling.httpclientregistry import run_with_clients
 
 logger = logging.getLogger('peeling')
 
 
 class CliPantherProcessor(PantherProcessor):
-    def __init__(self, organism, path):
+    def __init__(self, organism, path, panther_cache=None, api_url=API_URL):
         self.__organism = organism
-        super().__init__(path)
+        super().__init__(path, panther_cache, api_url)
 
 
     def __check_organism(self, organism_dict):
@@ -42,4 +42,4 @@ class CliPantherProcessor(PantherProcessor):
 
     # implement abstract method
     def start(self):
-        asyncio.run(self._start())
+        run_with_clients(self._start())
@@ -2,17 +2,18 @@ import os
 from datetime import datetime
 import pandas as pd
 import logging
-import asyncio
-import matplotlib.pyplot as plt
 from peeling.processor import Processor
+from peeling.tablewriter import write_table
+from peeling.referenceindex import ReferenceIndex
+from peeling.httpclientregistry import run_with_clients
 
 
 logger = logging.getLogger('peeling')
 
 
 class CliProcessor(Processor):
-    def __init__(self, user_input_reader, uniprot_communicator):
-        super().__init__(user_input_reader, uniprot_communicator)
+    def __init__(self, user_input_reader, uniprot_communicator, compartment_communicators=None):
+        super().__init__(user_input_reader, uniprot_communicator, compartment_communicators)
         self.__ids = None
         self.__path = None
 
@@ -44,10 +45,12 @@ class CliProcessor(Processor):
 
 
     # implement abstract method
-    async def _get_annotation_data(self, type):
+    async def _get_annotation_data(self, type, cellular_compartment=None):
         '''
         type: 'true_positive' or 'false_positive'
         '''
+        # with several compartments, the saved annotations are prefixed by the compartment
+        prefix = f'{cellular_compartment}_' if len(self._get_user_input_reader().get_cellular_compartments()) > 1 else ''
         if type == 'true_positive':
             if self._get_user_input_reader().get_true_positive_filename() is not None:
                 annotation = self._get_user_input_reader().get_annotation_true_positive()
@@ -60,10 +63,10 @@ class CliProcessor(Processor):
                     annotation = pd.DataFrame(annotation.iloc[:, 0])
                 annotation.columns = ['Entry']
             else: # retrieve annotation file from UniProt
-                annotation = await self._get_uniprot_communicator().get_annotation('true_positive')
+                annotation = await self._get_uniprot_communicator(cellular_compartment).get_annotation('true_positive')
                 annotation.dropna(subset=['Entry'], axis=0, how='any', inplace=True)
                 if self._get_user_input_reader().get_save():
-                    annotation.to_csv(f'{self.__path}/annotation_true_positive.tsv', sep='\t', index=False)
+                    write_table(annotation, f'{self.__path}/{prefix}annotation_true_positive.tsv', self._get_user_input_reader().get_output_format())
                 annotation = annotation[['Entry']]
         else:
             if self._get_user_input_reader().get_false_positive_filename() is not None:
@@ -77,18 +80,31 @@ class CliProcessor(Processor):
                     annotation = pd.DataFrame(annotation.iloc[:, 0])
                 annotation.columns = ['Entry']
             else: # retrieve annotation file from UniProt
-                annotation = await self._get_uniprot_communicator().get_annotation('false_positive')
+                annotation = await self._get_uniprot_communicator(cellular_compartment).get_annotation('false_positive')
                 annotation.dropna(subset=['Entry'], axis=0, how='any', inplace=True)
                 if self._get_user_input_reader().get_save():
-                    annotation.to_csv(f'{self.__path}/annotation_false_positive.tsv', sep='\t', index=False)
+                    write_table(annotation, f'{self.__path}/{prefix}annotation_false_positive.tsv', self._get_user_input_reader().get_output_format())
                 annotation = annotation[['Entry']]
 
         return annotation
 
 
+    #override superclass method
+    async def _get_reference_index(self, type, cellular_compartment=None):
+        reader = self._get_user_input_reader()
+        filename = reader.get_true_positive_filename() if type == 'true_positive' else reader.get_false_positive_filename()
+        if filename is not None:
+            # a local annotation file belongs to this run only
+            return ReferenceIndex(await self._get_annotation_data(type, cellular_compartment))
+        if reader.get_save():
+            # saves the retrieved annotation with the results, the communicator keeps it for the index
+            await self._get_annotation_data(type, cellular_compartment)
+        return await super()._get_reference_index(type, cellular_compartment)
+
+
     # implement abstract method
-    def _plot_supplemental(self, fig_name):
-        plt.close()
+    def _get_supplemental_outputs(self, fig_name):
+        return []
 
 
     # implement abstract method
@@ -131,9 +147,9 @@ class CliProcessor(Processor):
         data = self._get_user_input_reader().get_mass_data()
         parent_path = self._construct_path()
         data = self._mass_data_clean(data)
-        asyncio.run(self._analyze(data, parent_path))
+        run_with_clients(self._analyze(data, parent_path))
         if self._get_user_input_reader().get_save() and self._get_user_input_reader().get_latest_ids_filename() is None:
-            self.__ids.to_csv(self.__path+'/latest_ids.tsv', sep='\t', index=False)
+            write_table(self.__ids, self.__path+'/latest_ids.tsv', self._get_user_input_reader().get_output_format())
         self._write_args(parent_path)
         return parent_path
 
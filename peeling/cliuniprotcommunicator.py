@@ -1,9 +1,47 @@
-from peeling.uniprotcommunicator import UniProtCommunicator
+import os
+import logging
+from peeling.uniprotcommunicator import UniProtCommunicator, API_URL
+from peeling.referencestore import ReferenceStore
+from peeling.cachedir import get_cache_dir
+
+logger = logging.getLogger('peeling')
+
+ID_CACHE_FILENAME = 'id_mapping.sqlite'
+ID_CACHE_TTL_DAYS = 30
+ID_CACHE_SIZE = 1000000
 
 
 class CliUniProtCommunicator(UniProtCommunicator):
+    def __init__(self, cache=False, cellular_compartment='cs', stream=False, api_url=API_URL, id_cache=True, id_cache_ttl=ID_CACHE_TTL_DAYS, id_cache_size=ID_CACHE_SIZE, bundle=None):
+        '''
+        id_cache: keep id mapping results in a local store across runs, True for the default location in the
+        peeling cache directory, a path for another location, or False to disable
+        id_cache_ttl: days before a cached id is mapped again
+        id_cache_size: maximal number of cached ids, the least recently used ones are evicted
+        '''
+        super().__init__(cache, cellular_compartment, stream, api_url, bundle)
+        if id_cache is True:
+            id_cache = os.path.join(get_cache_dir(), ID_CACHE_FILENAME)
+        self.__id_cache = ReferenceStore(id_cache) if id_cache else None
+        self.__id_cache_max_age = id_cache_ttl * 24 * 3600
+        self.__id_cache_size = id_cache_size
+
 
     # implement abstract method
     async def get_latest_id(self, old_ids):
         meta={}
-        return await self._retrieve_latest_id(old_ids, meta)
+        if self.__id_cache is None:
+            return await self._retrieve_latest_id(old_ids, meta)
+
+        to_retrieve = self.__id_cache.get_missing_ids(old_ids, self.__id_cache_max_age)
+        logger.info(f'{len(set(old_ids)) - len(to_retrieve)} ids found in id mapping cache, to retrieve: {len(to_retrieve)}')
+        if len(to_retrieve) > 0:
+            retrieved_data = await self._retrieve_latest_id(to_retrieve, meta)
+            # ids without mapping data are cached too, so that they are not queried again until they expire
+            self.__id_cache.upsert_ids(self._add_no_mapping_ids(retrieved_data, meta))
+            evicted = self.__id_cache.evict_ids(self.__id_cache_size)
+            if evicted > 0:
+                logger.debug(f'{evicted} ids evicted from id mapping cache')
+
+        ids = self.__id_cache.lookup_ids(old_ids, self.__id_cache_max_age)
+        return ids[ids['Entry'].notnull()]
@@ -1,13 +1,13 @@
-import pandas as pd
 import logging
 from peeling.userinputreader import UserInputReader
+from peeling.tablereader import read_table
 
 logger = logging.getLogger('peeling')
 
 
 class CliUserInputReader(UserInputReader):
-    def __init__(self, mass_filename, num_controls, num_replicates, output_directory, tolerance, ids_filename, true_positive_filename, false_positive_filename, cache, plot_format, no_id_mapping, cellular_compartment):
-        super().__init__(num_controls, num_replicates, tolerance, plot_format, cellular_compartment)
+    def __init__(self, mass_filename, num_controls, num_replicates, output_directory, tolerance, ids_filename, true_positive_filename, false_positive_filename, cache, plot_format, no_id_mapping, cellular_compartment, jobs=1, defer_plots=False, tolerance_sweep=False, output_format='tsv'):
+        super().__init__(num_controls, num_replicates, tolerance, plot_format, cellular_compartment, jobs, defer_plots, tolerance_sweep, output_format)
         self.__mass_filename = mass_filename
         self.__output_directory = output_directory
         self.__ids_filename = ids_filename
@@ -17,9 +17,9 @@ class CliUserInputReader(UserInputReader):
         self.__no_id_mapping = no_id_mapping
 
 
-    def __read_file(self, filename):
+    def __read_file(self, filename, numeric=False):
         try:
-            df = pd.read_table(filename, sep='\t', header=0)
+            df = read_table(filename, numeric=numeric)
         except UnicodeDecodeError as e1:
             logger.error(e1)
             logger.error('Check the input file is tab delimited (.tsv)')
@@ -34,7 +34,7 @@ class CliUserInputReader(UserInputReader):
 
     # implement abstract method
     def get_mass_data(self):
-        data = self.__read_file(self.__mass_filename)
+        data = self.__read_file(self.__mass_filename, numeric=True)
         self._check_mass_spec_file(data)
         logger.info('Read in %d rows and %d columns from mass spec data' % data.shape)
         return data
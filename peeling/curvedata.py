@@ -0,0 +1,83 @@
+import numpy as np
+import logging
+from sklearn.metrics import auc
+
+logger = logging.getLogger('peeling')
+
+CURVES_FILENAME = 'curves.npz'
+
+
+def save_curves(path, columns, result, cutoff_protein_ids):
+    '''
+    Save TPR/FPR curves, cut-off points and AUC of every ratio column to one compressed .npz file
+    columns: ratio column names, in the column order of the CutoffResult
+    result: CutoffResult
+    cutoff_protein_ids: protein id at the cut-off point of each column
+    '''
+    tpr = np.column_stack([result.get_tpr(i) for i in range(len(columns))])
+    fpr = np.column_stack([result.get_fpr(i) for i in range(len(columns))])
+    cut_off_pos = np.array([result.get_cut_off_pos(i) for i in range(len(columns))])
+    auc_values = np.array([auc(fpr[:, i], tpr[:, i]) for i in range(len(columns))])
+    np.savez_compressed(path, columns=np.array(columns, dtype=str), tpr=tpr, fpr=fpr, cut_off_pos=cut_off_pos,
+                        cutoff_protein_id=np.array(cutoff_protein_ids, dtype=str), auc=auc_values)
+    logger.debug(f'Curve data saved at {path}')
+
+
+class CurveData:
+    '''
+    Read-only access to a curves file written by save_curves
+    '''
+    def __init__(self, path):
+        with np.load(path) as curves:
+            self.__columns = list(curves['columns'])
+            self.__tpr = curves['tpr']
+            self.__fpr = curves['fpr']
+            self.__cut_off_pos = curves['cut_off_pos']
+            self.__cutoff_protein_id = curves['cutoff_protein_id']
+            self.__auc = curves['auc']
+
+
+    def get_columns(self):
+        return self.__columns
+
+
+    def __get_col_index(self, column):
+        try:
+            return self.__columns.index(column)
+        except ValueError:
+            raise KeyError(f'No curve data for column {column}')
+
+
+    def get_curve(self, column):
+        '''
+        return dict with the TPR and FPR arrays, cut-off point and AUC of a column
+        '''
+        i = self.__get_col_index(column)
+        return {
+            'tpr': self.__tpr[:, i],
+            'fpr': self.__fpr[:, i],
+            'cut_off_pos': int(self.__cut_off_pos[i]),
+            'cutoff_protein_id': str(self.__cutoff_protein_id[i]),
+            'auc': float(self.__auc[i])
+        }
+
+
+    def to_dict(self, column, max_points=None):
+        '''
+        JSON serializable curve of a column for client-side charts. If max_points is given,
+        the curve is down-sampled evenly over the ranks, the cut-off point is always kept
+        '''
+        curve = self.get_curve(column)
+        num_rows = len(curve['tpr'])
+        ranks = np.arange(num_rows)
+        if max_points is not None and num_rows > max_points:
+            ranks = np.union1d(np.linspace(0, num_rows - 1, max_points).astype(int), [curve['cut_off_pos']])
+        return {
+            'column': column,
+            'rank': ranks.tolist(),
+            'tpr': curve['tpr'][ranks].tolist(),
+            'fpr': curve['fpr'][ranks].tolist(),
+            'cut_off_pos': curve['cut_off_pos'],
+            'cutoff_protein_id': curve['cutoff_protein_id'],
+            'auc': curve['auc']
+        }
@@ -0,0 +1,91 @@
+import numpy as np
+import logging
+
+logger = logging.getLogger('peeling')
+
+
+class CutoffEngine:
+    '''
+    Rank every ratio column of the mass spec data at once, so that the sort orders can be shared
+    by all cut-off calculations and plots instead of re-sorting the whole data frame per column
+    '''
+    def __init__(self, ratios):
+        '''
+        ratios: 2d array-like, one row per protein and one column per replicate-to-control ratio
+        '''
+        ratios = np.asarray(ratios, dtype=float)
+        if ratios.ndim != 2:
+            raise ValueError('CutoffEngine expects a 2d ratio matrix')
+        # descending order; stable so that ties keep the row order of the input data
+        self.__order = np.argsort(-ratios, axis=0, kind='stable')
+        self.__ranks = np.empty_like(self.__order)
+        np.put_along_axis(self.__ranks, self.__order, np.arange(ratios.shape[0])[:, np.newaxis], axis=0)
+
+
+    def evaluate(self, true_positive, false_positive):
+        '''
+        Calculate accumulative TPR, FPR and TPR-FPR of all columns in one pass, and set the cut-off
+        point of each column to the rank with the maximal TPR-FPR
+        Input
+        true_positive, false_positive: 1d boolean arrays, one value per row of the ratio matrix
+        return CutoffResult
+        '''
+        true_positive = np.asarray(true_positive, dtype=bool)
+        false_positive = np.asarray(false_positive, dtype=bool)
+        tp_cumsum = np.cumsum(true_positive[self.__order], axis=0)
+        fp_cumsum = np.cumsum(false_positive[self.__order], axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tpr = tp_cumsum / true_positive.sum()
+            fpr = fp_cumsum / false_positive.sum()
+        diff = tpr - fpr
+        # argmax returns the first maximum, same as the previous per-column implementation
+        cut_off_pos = np.where(np.isnan(diff), -np.inf, diff).argmax(axis=0)
+        include = self.__ranks <= cut_off_pos
+        return CutoffResult(tpr, fpr, cut_off_pos, include)
+
+
+    def get_order(self):
+        '''
+        Row indices of each column sorted in descending order, shape (rows, columns)
+        '''
+        return self.__order
+
+
+    def get_ranks(self):
+        '''
+        Rank of each row in each column, 0 is the largest ratio, shape (rows, columns)
+        '''
+        return self.__ranks
+
+
+class CutoffResult:
+    def __init__(self, tpr, fpr, cut_off_pos, include):
+        self.__tpr = tpr
+        self.__fpr = fpr
+        self.__cut_off_pos = cut_off_pos
+        self.__include = include
+
+
+    def get_tpr(self, col_index):
+        '''
+        Accumulative TPR of a column, in the sorted order of that column
+        '''
+        return self.__tpr[:, col_index]
+
+
+    def get_fpr(self, col_index):
+        '''
+        Accumulative FPR of a column, in the sorted order of that column
+        '''
+        return self.__fpr[:, col_index]
+
+
+    def get_cut_off_pos(self, col_index):
+        return int(self.__cut_off_pos[col_index])
+
+
+    def get_include(self):
+        '''
+        Boolean matrix in the row order of the input data, True if the row is before or at the cut-off point of the column
+        '''
+        return self.__include
@@ -0,0 +1,73 @@
+import asyncio
+import weakref
+import logging
+
+logger = logging.getLogger('peeling')
+
+UNIPROT_CLIENT = 'uniprot'
+PANTHER_CLIENT = 'panther'
+
+# an AsyncClient and its connection pool belong to the event loop it is used in,
+# so each loop has its own registry: the cli runs one loop per stage, the web service one for its lifetime
+_registries = weakref.WeakKeyDictionary()
+
+
+class HttpClientRegistry:
+    '''
+    Long-lived httpx.AsyncClients of one event loop, one per remote service, shared by all communicators and
+    processors so that connections (TLS and HTTP/2 setup) are reused across stages and requests
+    '''
+    def __init__(self):
+        self.__clients = {}
+
+
+    def get_client(self, name, create_client):
+        '''
+        name: the remote service, e.g. UNIPROT_CLIENT
+        create_client: function returning a new httpx.AsyncClient, called only if the service has no open client
+        '''
+        client = self.__clients.get(name)
+        if client is None or client.is_closed:
+            client = create_client()
+            self.__clients[name] = client
+            logger.debug(f'Created http client for {name}')
+        return client
+
+
+    async def aclose(self):
+        clients = list(self.__clients.values())
+        self.__clients = {}
+        await asyncio.gather(*(client.aclose() for client in clients if not client.is_closed))
+
+
+def get_client_registry():
+    '''
+    return HttpClientRegistry of the running event loop
+    '''
+    loop = asyncio.get_running_loop()
+    registry = _registries.get(loop)
+    if registry is None:
+        registry = HttpClientRegistry()
+        _registries[loop] = registry
+    return registry
+
+
+async def close_clients():
+    '''
+    Close the clients of the running event loop, to be called before the loop ends, e.g. on web service shutdown
+    '''
+    registry = _registries.pop(asyncio.get_running_loop(), None)
+    if registry is not None:
+        await registry.aclose()
+
+
+def run_with_clients(coroutine):
+    '''
+    asyncio.run that closes the http clients of the loop before it ends
+    '''
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await close_clients()
+    return asyncio.run(run())
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger('peeling')
+
+MAX_CONCURRENT_JOBS = 4
+INITIAL_CHUNK_SIZE = 2000
+MIN_CHUNK_SIZE = 100
+MAX_CHUNK_SIZE = 20000
+TARGET_JOB_SECONDS = 30 # grow chunks while jobs finish well below this, shrink them above it
+ERROR_WINDOW = 10
+MAX_ERROR_RATE = 0.3
+MAX_CONSECUTIVE_FAILURES = 8
+
+
+class IdMappingScheduler:
+    '''
+    Run id mapping jobs with a bounded number of concurrent jobs. The chunk size adapts to the observed
+    job latency and error rate, and a failed chunk is split in half and retried instead of being lost
+    '''
+    def __init__(self, map_chunk, max_concurrent_jobs=MAX_CONCURRENT_JOBS, initial_chunk_size=INITIAL_CHUNK_SIZE,
+                 min_chunk_size=MIN_CHUNK_SIZE, max_chunk_size=MAX_CHUNK_SIZE, target_job_seconds=TARGET_JOB_SECONDS):
+        '''
+        map_chunk: coroutine function taking a list of ids, returns df or raises if the job failed
+        '''
+        self.__map_chunk = map_chunk
+        self.__max_concurrent_jobs = max_concurrent_jobs
+        self.__chunk_size = initial_chunk_size
+        self.__min_chunk_size = min_chunk_size
+        self.__max_chunk_size = max_chunk_size
+        self.__target_job_seconds = target_job_seconds
+
+
+    async def run(self, ids):
+        '''
+        return (list of (chunk, df) for succeeded jobs, list of ids that failed for id mapping)
+        '''
+        self.__ids = list(ids)
+        self.__next = 0
+        self.__retry = deque()
+        self.__in_flight = 0
+        self.__outcomes = deque(maxlen=ERROR_WINDOW)
+        self.__consecutive_failures = 0
+        self.__results = []
+        self.__failed_ids = []
+        self.__num_jobs = 0
+        self.__condition = asyncio.Condition()
+
+        workers = [self.__worker() for _ in range(self.__max_concurrent_jobs)]
+        await asyncio.gather(*workers)
+        logger.info(f'{len(self.__ids)} ids are mapped in {self.__num_jobs} jobs, final chunk size {self.__chunk_size}')
+        return self.__results, self.__failed_ids
+
+
+    def get_chunk_size(self):
+        return self.__chunk_size
+
+
+    def __next_chunk(self):
+        if self.__consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+            # the service is likely down, don't keep splitting
+            self.__fail(list(self.__retry) + [self.__ids[self.__next:]])
+            self.__retry.clear()
+            self.__next = len(self.__ids)
+            return None
+        if len(self.__retry) > 0:
+            return self.__retry.popleft()
+        if self.__next < len(self.__ids):
+            chunk = self.__ids[self.__next:self.__next + self.__chunk_size]
+            self.__next += len(chunk)
+            return chunk
+        return None
+
+
+    def __fail(self, chunks):
+        for chunk in chunks:
+            self.__failed_ids += chunk
+
+
+    async def __worker(self):
+        while True:
+            async with self.__condition:
+                while True:
+                    chunk = self.__next_chunk()
+                    if chunk is not None or self.__in_flight == 0:
+                        break
+                    await self.__condition.wait()
+                if chunk is None:
+                    self.__condition.notify_all()
+                    return
+                self.__in_flight += 1
+                self.__num_jobs += 1
+
+            start_time = datetime.now()
+            try:
+                result = await self.__map_chunk(chunk)
+                error = None
+            except Exception as e:
+                error = e
+            seconds = (datetime.now() - start_time).total_seconds()
+
+            async with self.__condition:
+                self.__in_flight -= 1
+                if error is None:
+                    self.__results.append((chunk, result))
+                    self.__on_success(seconds)
+                else:
+                    self.__on_failure(chunk, error)
+                self.__condition.notify_all()
+
+
+    def __on_success(self, seconds):
+        self.__outcomes.append(True)
+        self.__consecutive_failures = 0
+        if seconds > self.__target_job_seconds:
+            self.__resize(self.__chunk_size // 2)
+        elif seconds < self.__target_job_seconds / 2 and self.__get_error_rate() <= MAX_ERROR_RATE:
+            self.__resize(self.__chunk_size * 3 // 2)
+
+
+    def __on_failure(self, chunk, error):
+        self.__outcomes.append(False)
+        self.__consecutive_failures += 1
+        if self.__get_error_rate() > MAX_ERROR_RATE:
+            self.__resize(self.__chunk_size // 2)
+        if len(chunk) > self.__min_chunk_size:
+            half = len(chunk) // 2
+            logger.debug(f'Id mapping of {len(chunk)} ids failed ({error}), retrying in two halves')
+            self.__retry.append(chunk[:half])
+            self.__retry.append(chunk[half:])
+        else:
+            logger.debug(f'Id mapping of {len(chunk)} ids failed ({error})')
+            self.__fail([chunk])
+
+
+    def __get_error_rate(self):
+        if len(self.__outcomes) == 0:
+            return 0
+        return self.__outcomes.count(False) / len(self.__outcomes)
+
+
+    def __resize(self, chunk_size):
+        chunk_size = max(self.__min_chunk_size, min(self.__max_chunk_size, chunk_size))
+        if chunk_size != self.__chunk_size:
+            logger.debug(f'Chunk size for id mapping: {self.__chunk_size} -> {chunk_size}')
+            self.__chunk_size = chunk_size
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger('peeling')
+
+
+class IdResolver:
+    '''
+    Resolve submitted ids to their latest UniProt entries with one hash lookup
+
+    Policy:
+        secondary accession: replaced by the entry it maps to
+        demerged (one id maps to several entries): the first entry in the id mapping data
+        merged (several ids map to one entry): rows are kept and share the entry
+        no mapping data: the submitted id is kept
+    '''
+    def __init__(self, id_mapping_data):
+        '''
+        id_mapping_data: df with 'From' and 'Entry' columns, and optionally annotation columns. It is not modified
+        '''
+        from_ids = id_mapping_data['From']
+        first = ~from_ids.duplicated(keep='first').to_numpy()
+        self.__id_mapping_data = id_mapping_data
+        self.__rows = np.flatnonzero(first)
+        self.__index = pd.Index(from_ids.to_numpy()[first])
+        pairs = id_mapping_data[['From', 'Entry']].dropna().drop_duplicates()
+        self.__one_to_many = pd.Index(pairs['From'][pairs['From'].duplicated()].unique())
+        self.__counts = {}
+
+
+    def get_counts(self):
+        '''
+        return dict of the number of rows of the last resolve: updated, unchanged, no_mapping, one_to_many, merged
+        '''
+        return dict(self.__counts)
+
+
+    def resolve(self, mass_data):
+        '''
+        mass_data: df with the submitted ids in the first column
+        return df indexed by 'Entry', the id column replaced by the annotation columns of the id mapping data
+        '''
+        ids = mass_data.iloc[:, 0].to_numpy()
+        positions = self.__index.get_indexer(ids)
+        # index only the found positions, the mapping may be empty when no id maps
+        found = positions >= 0
+        rows = np.full(len(ids), -1, dtype=np.intp)
+        rows[found] = self.__rows[positions[found]]
+
+        entries = self.__id_mapping_data['Entry'].array.take(rows, allow_fill=True).to_numpy(dtype=object)
+        no_entry = pd.isna(entries)
+        entries[no_entry] = ids[no_entry]
+
+        data = mass_data.iloc[:, 1:].copy()
+        for col in self.__id_mapping_data.columns:
+            if col not in ('From', 'Entry'):
+                data[col] = self.__id_mapping_data[col].array.take(rows, allow_fill=True)
+        data.index = pd.Index(entries, name='Entry')
+
+        updated = ~no_entry & (entries != ids)
+        pairs = pd.DataFrame({'From': ids, 'Entry': entries}).drop_duplicates()
+        shared_entries = pairs['Entry'][pairs['Entry'].duplicated()].unique()
+        self.__counts = {
+            'updated': int(updated.sum()),
+            'unchanged': int((~no_entry & ~updated).sum()),
+            'no_mapping': int(no_entry.sum()),
+            'one_to_many': int((self.__one_to_many.get_indexer(ids) >= 0).sum()),
+            'merged': int(pd.Index(entries).isin(shared_entries).sum()),
+        }
+        return data
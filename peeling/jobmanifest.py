@@ -0,0 +1,82 @@
+import os
+import json
+import logging
+from datetime import datetime
+import numpy as np
+
+logger = logging.getLogger('peeling')
+
+MANIFEST_FILENAME = 'manifest.json'
+MATRIX_FILENAME = 'mass_spec_data.npy'
+MANIFEST_VERSION = 1
+
+
+def save_matrix(job_path, data):
+    '''
+    Save the ratio columns of the cleaned mass spec data as a column-major .npy file,
+    so that a single column is one contiguous block when memory-mapped
+    data: df with the ids in the first column
+    '''
+    path = os.path.join(job_path, MATRIX_FILENAME)
+    np.save(path, np.asfortranarray(data.iloc[:, 1:].to_numpy(dtype=float)))
+    logger.debug(f'Saved {path}')
+
+
+def save_manifest(job_path, job_id, user_input_reader, columns, reference_versions=None):
+    '''
+    Save the settings and the data files of a web job as JSON
+    columns: names of the ratio columns, in the column order of the matrix
+    '''
+    manifest = {
+        'manifest_version': MANIFEST_VERSION,
+        'job_id': job_id,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'mass_spec_file': str(user_input_reader.get_mass_spec_filename()),
+        'cellular_compartments': user_input_reader.get_cellular_compartments(),
+        'num_controls': user_input_reader.get_num_controls(),
+        'num_replicates': user_input_reader.get_num_replicates(),
+        'tolerance': user_input_reader.get_tolerance(),
+        'plot_format': user_input_reader.get_plot_format(),
+        'defer_plots': user_input_reader.get_defer_plots(),
+        'output_format': user_input_reader.get_output_format(),
+        'columns': list(columns),
+        'matrix': MATRIX_FILENAME,
+        'reference_versions': reference_versions if reference_versions is not None else {},
+    }
+    with open(os.path.join(job_path, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+class JobManifest:
+    '''
+    Read-only access to the manifest of a web job and its memory-mapped ratio matrix
+    '''
+    def __init__(self, job_path):
+        self.__job_path = job_path
+        with open(os.path.join(job_path, MANIFEST_FILENAME)) as f:
+            self.__manifest = json.load(f)
+        self.__matrix = None
+
+
+    def get(self, key):
+        return self.__manifest[key]
+
+
+    def get_columns(self):
+        return self.__manifest['columns']
+
+
+    def get_plot_format(self):
+        return self.__manifest['plot_format']
+
+
+    def get_column(self, column):
+        '''
+        return the values of a ratio column, read from the memory-mapped matrix
+        '''
+        if self.__matrix is None:
+            self.__matrix = np.load(os.path.join(self.__job_path, self.__manifest['matrix']), mmap_mode='r')
+        try:
+            return self.__matrix[:, self.get_columns().index(column)]
+        except ValueError:
+            raise KeyError(f'No column {column} in the mass spec data')
@@ -0,0 +1,102 @@
+import asyncio
+import random
+import logging
+
+logger = logging.getLogger('peeling')
+
+INITIAL_INTERVAL = 0.25
+MAX_INTERVAL = 10
+BACKOFF_FACTOR = 2
+JITTER = 0.25 # +/- fraction of the interval
+DEADLINE = 600 # seconds a job may take before it is given up
+
+
+class JobPoller:
+    '''
+    One polling loop shared by all jobs waited on in the same event loop. Each job is first checked right
+    away, then with exponentially growing, jittered intervals until it finishes or its deadline passes
+    '''
+    def __init__(self, check_job, initial_interval=INITIAL_INTERVAL, max_interval=MAX_INTERVAL, deadline=DEADLINE):
+        '''
+        check_job: coroutine function taking a job id, returns the result of a finished job, None if the job
+        is still running, and raises if the job failed
+        '''
+        self.__check_job = check_job
+        self.__initial_interval = initial_interval
+        self.__max_interval = max_interval
+        self.__deadline = deadline
+        self.__loop = None
+
+
+    def __bind(self, loop):
+        # jobs, task and event belong to one event loop, e.g. the cli runs a new loop per stage
+        self.__loop = loop
+        self.__jobs = {}
+        self.__task = None
+        self.__wakeup = asyncio.Event()
+
+
+    async def wait(self, job_id):
+        loop = asyncio.get_running_loop()
+        if loop is not self.__loop:
+            self.__bind(loop)
+        now = loop.time()
+        future = loop.create_future()
+        self.__jobs[job_id] = {'future': future, 'next': now, 'interval': self.__initial_interval, 'deadline': now + self.__deadline}
+        if self.__task is None or self.__task.done():
+            self.__task = asyncio.create_task(self.__run())
+        self.__wakeup.set()
+        try:
+            return await future
+        finally:
+            self.__jobs.pop(job_id, None)
+
+
+    async def __run(self):
+        while len(self.__jobs) > 0:
+            now = self.__loop.time()
+            due = [job_id for job_id, job in self.__jobs.items() if job['next'] <= now]
+            if len(due) > 0:
+                await asyncio.gather(*map(self.__poll, due))
+            if len(self.__jobs) == 0:
+                break
+            delay = min(job['next'] for job in self.__jobs.values()) - self.__loop.time()
+            if delay > 0:
+                self.__wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.__wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+
+    async def __poll(self, job_id):
+        job = self.__jobs.get(job_id)
+        if job is None or job['future'].done():
+            return
+        try:
+            result = await self.__check_job(job_id)
+        except Exception as e:
+            self.__finish(job_id, exception=e)
+            return
+        if result is not None:
+            self.__finish(job_id, result=result)
+            return
+
+        now = self.__loop.time()
+        if now >= job['deadline']:
+            self.__finish(job_id, exception=Exception(f'{job_id}: job is not finished in {self.__deadline}s'))
+            return
+        delay = job['interval'] * random.uniform(1 - JITTER, 1 + JITTER)
+        job['interval'] = min(self.__max_interval, job['interval'] * BACKOFF_FACTOR)
+        job['next'] = min(now + delay, job['deadline'])
+        logger.debug(f'{job_id}: Retrying in {delay:.2f}s')
+
+
+    def __finish(self, job_id, result=None, exception=None):
+        job = self.__jobs.pop(job_id, None)
+        if job is None or job['future'].done():
+            return
+        if exception is not None:
+            job['future'].set_exception(exception)
+        else:
+            job['future'].set_result(result)
@@ -0,0 +1,185 @@
+import asyncio
+import uuid
+import logging
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threadpoolctl import threadpool_limits
+
+logger = logging.getLogger('peeling')
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_DEPTH = 20
+BLAS_THREADS = 1 # while jobs run, so that concurrent jobs don't oversubscribe the cores
+MAX_FINISHED_JOBS = 1000 # finished jobs kept for status polling
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobQueue:
+    '''
+    Bounded queue of web analyses, run by a fixed number of workers in the event loop of the web service.
+    Queued jobs are started round-robin over the clients that submitted them, so that a client submitting
+    many jobs doesn't hold back the others. The CPU-bound steps of a job run in a pool of worker threads
+    via run_blocking, so the event loop keeps serving other requests.
+    BLAS/OpenMP limits are global to the process, not per thread, so the limit is shared by the worker threads:
+    the first blocking step to start sets it and the last one to finish restores the original limits
+    '''
+    def __init__(self, workers=DEFAULT_WORKERS, max_depth=DEFAULT_MAX_DEPTH, blas_threads=BLAS_THREADS):
+        '''
+        workers: number of jobs running at the same time, also the number of worker threads
+        max_depth: number of jobs that may wait in the queue, further submissions raise QueueFullError
+        blas_threads: limit of the BLAS/OpenMP threads while blocking steps run, None to keep the current limits
+        '''
+        self.__workers = workers
+        self.__max_depth = max_depth
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='peeling-job')
+        self.__pending = OrderedDict() # client id -> deque of job ids, in the order clients are served
+        self.__jobs = {}
+        self.__finished = deque()
+        self.__depth = 0
+        self.__tasks = []
+        self.__available = None
+        self.__blas_threads = blas_threads
+        self.__limits_lock = threading.Lock()
+        self.__limited = 0 # blocking steps running under the limit
+        self.__limits = None
+
+
+    def __start_workers(self):
+        if self.__available is None:
+            self.__available = asyncio.Event()
+        self.__tasks = [task for task in self.__tasks if not task.done()]
+        while len(self.__tasks) < self.__workers:
+            self.__tasks.append(asyncio.create_task(self.__work()))
+
+
+    def submit(self, client_id, job_function, *args):
+        '''
+        Queue a job, called from the event loop of the web service
+        client_id: e.g. the client address, jobs are started round-robin over clients
+        job_function: coroutine function running the job, its return value is the result of the job
+        return job id
+        '''
+        if self.__depth >= self.__max_depth:
+            raise QueueFullError(f'The job queue is full ({self.__max_depth} jobs waiting), please try again later')
+        job_id = str(uuid.uuid4())
+        self.__jobs[job_id] = {'client': client_id, 'function': job_function, 'args': args, 'status': QUEUED,
+                               'submitted': datetime.now(), 'started': None, 'finished': None, 'result': None, 'error': None}
+        self.__pending.setdefault(client_id, deque()).append(job_id)
+        self.__depth += 1
+        self.__start_workers()
+        self.__available.set()
+        logger.info(f'Job {job_id} queued for {client_id}, {self.__depth} jobs waiting')
+        return job_id
+
+
+    def __next_job(self):
+        # take the oldest job of the first client, then move the client to the end
+        client_id, job_ids = next(iter(self.__pending.items()))
+        job_id = job_ids.popleft()
+        del self.__pending[client_id]
+        if len(job_ids) > 0:
+            self.__pending[client_id] = job_ids
+        self.__depth -= 1
+        return job_id
+
+
+    async def __work(self):
+        while True:
+            if self.__depth == 0:
+                self.__available.clear()
+                await self.__available.wait()
+                continue
+            job_id = self.__next_job()
+            job = self.__jobs[job_id]
+            job['status'] = RUNNING
+            job['started'] = datetime.now()
+            try:
+                job['result'] = await job['function'](*job['args'])
+                job['status'] = DONE
+            except Exception as e:
+                logger.error(f'Job {job_id} failed: {e}')
+                job['error'] = str(e)
+                job['status'] = FAILED
+            job['finished'] = datetime.now()
+            job['function'], job['args'] = None, None
+            self.__finish(job_id)
+
+
+    def __finish(self, job_id):
+        self.__finished.append(job_id)
+        while len(self.__finished) > MAX_FINISHED_JOBS:
+            self.__jobs.pop(self.__finished.popleft(), None)
+
+
+    async def run_blocking(self, function, *args):
+        '''
+        Run a CPU-bound function in a worker thread, with the BLAS/OpenMP threads limited
+        '''
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, self.__run_limited, function, *args)
+
+
+    def __run_limited(self, function, *args):
+        if self.__blas_threads is None:
+            return function(*args)
+        with self.__limits_lock:
+            if self.__limited == 0:
+                self.__limits = threadpool_limits(limits=self.__blas_threads)
+            self.__limited += 1
+        try:
+            return function(*args)
+        finally:
+            with self.__limits_lock:
+                self.__limited -= 1
+                if self.__limited == 0:
+                    self.__limits.restore_original_limits()
+                    self.__limits = None
+
+
+    def get_status(self, job_id):
+        '''
+        return dict with the status of the job ('queued', 'running', 'done' or 'failed'), its position in the queue,
+        its result and error, None if the job is unknown
+        '''
+        job = self.__jobs.get(job_id)
+        if job is None:
+            return None
+        status = {key: job[key] for key in ('status', 'submitted', 'started', 'finished', 'result', 'error')}
+        status['position'] = self.__get_position(job_id) if job['status'] == QUEUED else 0
+        return status
+
+
+    def __get_position(self, job_id):
+        '''
+        Position of a queued job in round-robin order, counting from 1
+        '''
+        position = 0
+        job_ids = [list(ids) for ids in self.__pending.values()]
+        for turn in range(max(len(ids) for ids in job_ids)):
+            for ids in job_ids:
+                if turn < len(ids):
+                    position += 1
+                    if ids[turn] == job_id:
+                        return position
+        return position
+
+
+    def get_depth(self):
+        return self.__depth
+
+
+    async def shutdown(self):
+        for task in self.__tasks:
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__tasks = []
+        self.__executor.shutdown(wait=True)
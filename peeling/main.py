@@ -8,6 +8,8 @@ from peeling.cliuserinputreader import CliUserInputReader
 from peeling.cliprocessor import CliProcessor
 from peeling.clipantherprocessor import CliPantherProcessor
 from peeling.cellular_compartments import cellular_compartments
+from peeling.referencebundle import find_default_bundle
+from peeling.tablewriter import OUTPUT_FORMATS, check_output_format
 
 logger = logging.getLogger('peeling')
 logger.setLevel(logging.INFO)
@@ -16,36 +18,64 @@ log_handler.setFormatter(logging.Formatter('%(asctime)s | %(levelname)s: %(messa
 logger.addHandler(log_handler)
 
 
+def get_bundle(bundle, cellular_compartment):
+    '''
+    return the given bundle, or the bundle of the cellular compartment in the peeling cache directory if it exists
+    '''
+    if bundle is None and cellular_compartment in cellular_compartments:
+        bundle = find_default_bundle(cellular_compartment)
+    return bundle
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("mass", help="mass spec data file, e.g. data/mass_spec_data.tsv")
     parser.add_argument("controls", type=int, help="number of controls")
     parser.add_argument("replicates", type=int, help="number of replicates for each control")
     parser.add_argument("-t", "--tolerance", type=int, help="tolerance of non-included, default is 0")
+    parser.add_argument("--tolerance-sweep", action="store_true", help="also save the post-cutoff proteome of every tolerance from 0 to controls * replicates, with a summary of their sizes and TP/FP counts, true if specified")
     parser.add_argument("-o", "--output", help=" directory to store output results")
     parser.add_argument("-i", "--ids", help="latest_ids file directory, e.g. data/id_mapping.tsv")
     parser.add_argument(
         "--cc",
         "--cellular_compartment",
         choices=['cs', 'nu', 'mt', 'ot'],
-        help="Choose between: cs - cell surface [default], mt - mitochondria, nu - nucleus or ot - other. If other is chosen, the true positive (--tp) and false positive (--fp) files must be specified.",
-        default="cs"
+        nargs='+',
+        help="Choose between: cs - cell surface [default], mt - mitochondria, nu - nucleus or ot - other. If other is chosen, the true positive (--tp) and false positive (--fp) files must be specified. Several of cs, mt and nu can be given to analyze them in one run, with the results of each compartment in its own subdirectory",
+        default=["cs"]
     )
     parser.add_argument("--tp", "--true-positive", help="true positive annotation file, e.g. data/annotation_true_positive.tsv")
     parser.add_argument("--fp", "--false-positive", help="false positive annotation file, e.g. data/annotation_false_positive.tsv")
     parser.add_argument("-n", "--nomap", action="store_true", help="no id mapping for local annotation files, true if specified")
     parser.add_argument("-a", "--cache", action="store_true", help="save the data retrieved from UniProt, true if specified")
+    parser.add_argument("--stream", action="store_true", help="download each UniProt result set in one request from the /stream endpoints, falls back to pagination on error, true if specified")
+    parser.add_argument("-b", "--bundle", help="reference bundle built by peeling-bundle to read the true positive and false positive annotations from instead of UniProt, by default the bundle of the cellular compartment in the peeling cache directory is used if it exists, its path and age are logged")
+    parser.add_argument("--no-id-cache", action="store_true", help="don't keep id mapping results in the local cache (~/.cache/peeling or $PEELING_CACHE_DIR) across runs, true if specified")
+    parser.add_argument("--id-cache-ttl", type=int, default=30, help="days before an id in the local id mapping cache is mapped again, default is 30")
     parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output")
     parser.add_argument("-f", "--format", choices=list(plt.gcf().canvas.get_supported_filetypes().keys()), help="the output format of plots, default is png")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default='tsv', help="also save the results as parquet or feather files with typed columns, including the include flags of each ratio and the TPR/FPR curves, requires pyarrow, default is tsv only")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes used to render plots, default is 1")
+    parser.add_argument("-d", "--defer-plots", action="store_true", help="save the TPR/FPR and ROC curve data of each ratio to curves.npz instead of rendering their plots, true if specified")
     parser.add_argument("-p", "--panther", help="the organism from which the mass spec data is made, a required input for Panther enrichment analysis. Please refer to Panther's API page http://pantherdb.org/services/oai/pantherdb/supportedgenomes for supported organism. Choose the corresponding 'long_names', and wrap it by quotes, e.g. 'Homo sapiens'")
 
     args = parser.parse_args()
 
-    if args.cc not in cellular_compartments :
+    if len(args.cc) > 1:
+        if len(set(args.cc)) < len(args.cc):
+            parser.error("The same 'cellular compartment' is given more than once.")
+        if 'ot' in args.cc or args.tp or args.fp or args.bundle:
+            parser.error("Only the built-in cellular compartments can be analyzed together, without 'true positive', 'false positive' or 'bundle' arguments.")
+    elif args.cc[0] not in cellular_compartments :
         # Set 'tp' and 'fp' as required
         if not args.tp or not args.fp:
             parser.error("The 'true positive' and 'false positive' arguments are required when 'cellular compartment' is set to 'other'.")
 
+    try:
+        check_output_format(args.output_format)
+    except ImportError as e:
+        parser.error(str(e))
+
     if args.verbose:
         logger.setLevel(logging.DEBUG)
 
@@ -61,16 +91,20 @@ def main():
     ids_filename = args.ids 
     true_positive_filename = args.tp
     false_positive_filename = args.fp
-    cellular_compartment = args.cc
+    cellular_compartment = args.cc[0] if len(args.cc) == 1 else args.cc
     cache = args.cache
     plot_format = args.format if args.format is not None else 'png'
     no_id_mapping = args.nomap
     panther_organism = args.panther
+    jobs = args.jobs if args.jobs is not None else 1
+    defer_plots = args.defer_plots
+    tolerance_sweep = args.tolerance_sweep
 
-    if cellular_compartment in cellular_compartments:
-        logger.info(f'Running analysis for {cellular_compartments.get(cellular_compartment).get("long_name")} proteins')
-    else:
-        logger.info(f'Running analysis for custom cellular compartment')
+    for cc in args.cc:
+        if cc in cellular_compartments:
+            logger.info(f'Running analysis for {cellular_compartments.get(cc).get("long_name")} proteins')
+        else:
+            logger.info(f'Running analysis for custom cellular compartment')
 
     logger.info(f'{start_time} Analysis starts...')
     user_input_reader = CliUserInputReader(
@@ -85,15 +119,22 @@ def main():
         cache,
         plot_format,
         no_id_mapping,
-        cellular_compartment
+        cellular_compartment,
+        jobs,
+        defer_plots,
+        tolerance_sweep,
+        args.output_format
     )
-    uniprot_communicator = CliUniProtCommunicator(cache, cellular_compartment)
-    processor = CliProcessor(user_input_reader, uniprot_communicator)
+    uniprot_communicator = CliUniProtCommunicator(cache, args.cc[0], args.stream, id_cache=not args.no_id_cache, id_cache_ttl=args.id_cache_ttl, bundle=get_bundle(args.bundle, args.cc[0]))
+    # the other compartments only provide their annotations, ids are mapped once by the first one
+    compartment_communicators = {cc: CliUniProtCommunicator(cache, cc, args.stream, id_cache=False, bundle=get_bundle(None, cc)) for cc in args.cc[1:]}
+    processor = CliProcessor(user_input_reader, uniprot_communicator, compartment_communicators)
     path = processor.start()
 
     if panther_organism is not None:
-        panther_processor = CliPantherProcessor(panther_organism, path)
-        panther_processor.start()
+        for cc_path in ([path] if len(args.cc) == 1 else [os.path.join(path, cc) for cc in args.cc]):
+            panther_processor = CliPantherProcessor(panther_organism, cc_path)
+            panther_processor.start()
 
     logger.info(f'Results saved at {path}')
     end_time = datetime.now()
@@ -0,0 +1,87 @@
+import os
+import time
+import hashlib
+import logging
+from importlib import resources
+import pandas as pd
+from peeling.cachedir import get_cache_dir
+
+logger = logging.getLogger('peeling')
+
+PANTHER_SUBDIR = 'panther'
+ENRICHMENT_SUBDIR = 'enrichment'
+ORGANISMS_FILENAME = 'organisms.tsv'
+# package data, used when pantherdb.org can't be reached and nothing is cached
+BUNDLED_ORGANISMS_RESOURCE = 'data/panther_organisms.tsv'
+ORGANISMS_MAX_AGE = 30 # days before the organism catalog is retrieved again
+ENRICHMENT_TTL = 30 # days an enrichment result is reused
+
+
+def get_enrichment_key(proteins, organism_id, annot_dataset):
+    '''
+    proteins: comma separated accessions, the key doesn't depend on their order or duplicates
+    '''
+    protein_set = ','.join(sorted(set(protein for protein in proteins.split(',') if protein)))
+    digest = hashlib.sha256(protein_set.encode()).hexdigest()
+    return f'{digest}_{organism_id}_{annot_dataset}'
+
+
+class PantherCache:
+    '''
+    Local cache of the Panther organism catalog and of enrichment results, in the peeling cache directory
+    '''
+    def __init__(self, path=None, organisms_max_age=ORGANISMS_MAX_AGE, enrichment_ttl=ENRICHMENT_TTL):
+        self.__path = path if path is not None else get_cache_dir(PANTHER_SUBDIR)
+        self.__enrichment_path = os.path.join(self.__path, ENRICHMENT_SUBDIR)
+        os.makedirs(self.__enrichment_path, exist_ok=True)
+        self.__organisms_max_age = organisms_max_age * 24 * 3600
+        self.__enrichment_ttl = enrichment_ttl * 24 * 3600
+
+
+    def __is_fresh(self, path, max_age):
+        return os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age
+
+
+    def __read_organisms(self, path):
+        df = pd.read_table(path, sep='\t', header=0)
+        return dict(zip(df['long_name'], df['taxon_id'].tolist()))
+
+
+    def get_organisms(self, stale=False):
+        '''
+        return dict of organism long name -> taxon id, None if the catalog isn't cached or is older than
+        the max age. With stale, an old catalog is returned as well, and the bundled one if nothing is cached
+        '''
+        path = os.path.join(self.__path, ORGANISMS_FILENAME)
+        if self.__is_fresh(path, self.__organisms_max_age) or (stale and os.path.exists(path)):
+            return self.__read_organisms(path)
+        bundled = resources.files('peeling').joinpath(BUNDLED_ORGANISMS_RESOURCE)
+        if stale and bundled.is_file():
+            with bundled.open('r') as f:
+                return self.__read_organisms(f)
+        return None
+
+
+    def save_organisms(self, organism_dict):
+        path = os.path.join(self.__path, ORGANISMS_FILENAME)
+        df = pd.DataFrame({'long_name': list(organism_dict.keys()), 'taxon_id': list(organism_dict.values())})
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        df.to_csv(temp_path, sep='\t', index=False)
+        os.replace(temp_path, path)
+
+
+    def get_enrichment(self, proteins, organism_id, annot_dataset):
+        '''
+        return the cached enrichment df, None if it isn't cached or has expired
+        '''
+        path = os.path.join(self.__enrichment_path, get_enrichment_key(proteins, organism_id, annot_dataset) + '.tsv')
+        if not self.__is_fresh(path, self.__enrichment_ttl):
+            return None
+        return pd.read_table(path, sep='\t', header=0)
+
+
+    def save_enrichment(self, proteins, organism_id, annot_dataset, df):
+        path = os.path.join(self.__enrichment_path, get_enrichment_key(proteins, organism_id, annot_dataset) + '.tsv')
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        df.to_csv(temp_path, sep='\t', index=False)
+        os.replace(temp_path, path)
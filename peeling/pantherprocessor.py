@@ -3,73 +3,134 @@ import logging
 from datetime import datetime
 import httpx
 import asyncio
-from urllib.parse import urlparse, parse_qs, urlencode
+import random
+from urllib.parse import urlencode, quote_plus
 import pandas as pd
+from peeling.panthercache import PantherCache
+from peeling.httpclientregistry import get_client_registry, PANTHER_CLIENT
 
 logger = logging.getLogger('peeling')
 
+API_URL = 'https://pantherdb.org/services/oai/pantherdb'
 CONNECT_RETRY=5
-API_RETRY = 3
+API_RETRY = 4 # attempts of a request failing with a transient error
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+INITIAL_BACKOFF = 1 # seconds before the first retry, doubled for each following one
+MAX_BACKOFF = 30
+FORM_CHUNK_SIZE = 1000 # accessions per chunk of the streamed request body
 TIME_OUT = 20
+MAX_KEEPALIVE_CONNECTIONS = 5
+MAX_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 60 # seconds an idle connection is kept open for the next request
 
 #corresponding to "PANTHER GO Slim Cellular Location", "PANTHER GO Slim Biological Process", "ANNOT_TYPE_REACTOME_PATHWAY"
 ENRICH_CATEGORIES = {'ANNOT_TYPE_ID_PANTHER_GO_SLIM_CC':'Panther_GO_Slim_Cellular_Component', 'ANNOT_TYPE_ID_PANTHER_GO_SLIM_BP':'Panther_GO_Slim_Biological_Process', "ANNOT_TYPE_ID_REACTOME_PATHWAY":'Reactome_Pathway'}
 
 
+async def _check_response(response):
+    try:
+        await response.aread()
+        if response.status_code >= 300 and response.status_code < 400:
+            logger.debug(response.headers)
+            return
+        response.raise_for_status()
+    except httpx.HTTPStatusError:
+        logger.info(response.text)
+        raise
+
+
+def _is_transient(error):
+    '''
+    Network errors, timeouts, rate limits and server errors are worth retrying, other errors (e.g. a rejected request) are not
+    '''
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(error, httpx.TransportError)
+
+
+def _get_backoff(attempt, error):
+    '''
+    Exponential backoff with jitter, or the delay asked for by the server
+    '''
+    if isinstance(error, httpx.HTTPStatusError) and error.response.headers.get('Retry-After', '').isdigit():
+        return min(int(error.response.headers['Retry-After']), MAX_BACKOFF)
+    return min(INITIAL_BACKOFF * 2 ** (attempt - 1), MAX_BACKOFF) * random.uniform(0.5, 1)
+
+
+def _encode_form(fields, list_field, values):
+    '''
+    Encode a form as application/x-www-form-urlencoded chunks, the values of list_field are joined by ','
+    and split over chunks of FORM_CHUNK_SIZE values
+    return list of bytes
+    '''
+    chunks = [(urlencode(fields) + f'&{list_field}=').encode()]
+    for start in range(0, len(values), FORM_CHUNK_SIZE):
+        separator = quote_plus(',') if start > 0 else ''
+        chunks.append((separator + quote_plus(','.join(values[start:start + FORM_CHUNK_SIZE]))).encode())
+    return chunks
+
+
+async def _stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _create_client():
+    limits = httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS, max_connections=MAX_CONNECTIONS, keepalive_expiry=KEEPALIVE_EXPIRY)
+    transport = httpx.AsyncHTTPTransport(retries=CONNECT_RETRY)
+    return httpx.AsyncClient(http2=True, timeout=TIME_OUT, limits=limits, transport=transport, event_hooks={'response': [_check_response]})
+
+
 class PantherProcessor(ABC):
-    def __init__(self, path):
+    def __init__(self, path, panther_cache=None, api_url=API_URL):
+        '''
+        panther_cache: PantherCache of organisms and enrichment results, the one in the peeling cache directory if None
+        api_url: base url of the Panther API, e.g. a local stand-in server
+        '''
         self.__path = path
+        self.__api_url = api_url
+        self.__panther_cache = panther_cache if panther_cache is not None else PantherCache()
         self.__client = None
         self.__proteins = None
         self.__organism_id = None
     
 
     def _create_client(self):
+        # the client is shared by all processors and communicators of the event loop
         if self.__client is None:
-            transport = httpx.AsyncHTTPTransport(retries=CONNECT_RETRY)
-            self.__client = httpx.AsyncClient(http2=True, timeout=TIME_OUT, transport=transport, event_hooks={'response': [self.__check_response]})
-
-        
-    async def __check_response(self, response):
-        try:
-            await response.aread()
-            if response.status_code >= 300 and response.status_code < 400:
-                logger.debug(response.headers)
-                return
-            response.raise_for_status()
-        except httpx.HTTPStatusError:
-            logger.info(response.json())
-            raise
+            self.__client = get_client_registry().get_client(PANTHER_CLIENT, _create_client)
     
 
-    def __make_url_enrich(self, annot_dataset):
-        base_url = "https://pantherdb.org/services/oai/pantherdb/enrich/overrep?"
-        parsed = urlparse(base_url) 
-        query = parse_qs(parsed.query)
-        query['geneInputList'] = self.__proteins
-        query['organism'] = self.__organism_id
-        query['annotDataSet'] = annot_dataset
-        query['enrichmentTestType'] = 'FISHER'
-        query['correction'] = 'FDR'
-        parsed = parsed._replace(query=urlencode(query, doseq=True))
-        url = parsed.geturl()
-        return url
-    
+    def __make_form_enrich(self, annot_dataset):
+        '''
+        The protein list is sent in the body of a POST, a GET url holding it gets too long for large proteomes
+        '''
+        fields = {'organism': self.__organism_id, 'annotDataSet': annot_dataset, 'enrichmentTestType': 'FISHER', 'correction': 'FDR'}
+        proteins = [protein for protein in self.__proteins.split(',') if protein]
+        return _encode_form(fields, 'geneInputList', proteins)
+
 
-    async def __submit(self, url):
-        retry = 0
-        while retry < API_RETRY:
-            if retry >= 1:
-                logger.info('Retry')
+    async def __submit(self, url, form=None):
+        '''
+        GET url, or POST the form chunks to it as a streamed body. Transient errors are retried with backoff
+        '''
+        attempt = 0
+        while True:
             try:
-                response = await self.__client.get(url, follow_redirects=True)
-                return response
+                if form is None:
+                    return await self.__client.get(url, follow_redirects=True)
+                headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Content-Length': str(sum(len(chunk) for chunk in form))}
+                return await self.__client.post(url, content=_stream(form), headers=headers)
             except Exception as e:
-                logger.error('Something wrong with Panther')
-                logger.error(e)
-            retry += 1
-        raise Exception('Reached maximal Panther API trail')
-    
+                attempt += 1
+                if not _is_transient(e) or attempt >= API_RETRY:
+                    logger.error('Something wrong with Panther')
+                    logger.error(e)
+                    raise
+                delay = _get_backoff(attempt, e)
+                logger.info(f'Panther request failed ({e}), retry {attempt} in {delay:.1f} seconds')
+                await asyncio.sleep(delay)
+
 
     def __format_enrich(self, response):
         try:
@@ -105,14 +166,23 @@ class PantherProcessor(ABC):
     async def _retrieve_organisms(self):
         start_time = datetime.now()
         #logger.debug('Communicating with Panther for supported organisms ...')
+        organism_dict = self.__panther_cache.get_organisms()
+        if organism_dict is not None:
+            logger.info(f'Read in {len(organism_dict)} organisms from the local Panther cache')
+            return organism_dict
         try:
-            url = 'https://pantherdb.org/services/oai/pantherdb/supportedgenomes'
-            response = await self.__submit(url)
+            response = await self.__submit(f'{self.__api_url}/supportedgenomes')
             organism_dict = self.__format_organism(response)
+            self.__panther_cache.save_organisms(organism_dict)
             logger.info(f'Retriving organisms is done. Time: {datetime.now()-start_time}')
             return organism_dict
         except Exception:
-            raise
+            # an outdated catalog, or the one shipped with peeling, is better than none
+            organism_dict = self.__panther_cache.get_organisms(stale=True)
+            if organism_dict is None:
+                raise
+            logger.warning(f'Retrieving organisms failed, using {len(organism_dict)} organisms from the local Panther cache')
+            return organism_dict
     
 
     def __format_organism(self, response):
@@ -143,9 +213,13 @@ class PantherProcessor(ABC):
         start_time = datetime.now()
         logger.info(f'Communicating with Panther for {annot_dataset}...')
         try:
-            url = self.__make_url_enrich(annot_dataset)
-            response = await self.__submit(url)
-            results_df = self.__format_enrich(response)
+            results_df = self.__panther_cache.get_enrichment(self.__proteins, self.__organism_id, annot_dataset)
+            if results_df is not None:
+                logger.info(f'{annot_dataset} is read from the local Panther cache')
+            else:
+                response = await self.__submit(f'{self.__api_url}/enrich/overrep', self.__make_form_enrich(annot_dataset))
+                results_df = self.__format_enrich(response)
+                self.__panther_cache.save_enrichment(self.__proteins, self.__organism_id, annot_dataset, results_df)
             results_df.to_csv(f'{self.__path}/post-cutoff-proteome_{self.__organism_id}_{ENRICH_CATEGORIES[annot_dataset]}.tsv', sep='\t', index=False)
             logger.info(f'{annot_dataset} is done. Time: {datetime.now()-start_time}')
             return (ENRICH_CATEGORIES[annot_dataset], results_df)
@@ -178,7 +252,6 @@ class PantherProcessor(ABC):
     
 
     async def _close_client(self):
-        if self.__client is not None:
-            await self.__client.aclose()
-            self.__client = None
+        # the shared client stays open for other requests, it is closed by close_clients()
+        self.__client = None
         
\ No newline at end of file
@@ -0,0 +1,158 @@
+import os
+import uuid
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib.figure import Figure
+from sklearn.metrics import auc
+
+logger = logging.getLogger('peeling')
+
+DPI = 130
+
+
+# A plot spec is a plain dict that can be pickled and sent to a worker process:
+# {'kind': 'heatmap' | 'line' | 'roc' | 'scatter', 'fig_name': str, 'outputs': [(file path, savefig kwargs), ...], ...plot data}
+
+def make_heatmap_spec(corr, fig_name, outputs):
+    return {'kind': 'heatmap', 'fig_name': fig_name, 'outputs': outputs, 'corr': corr}
+
+
+def make_line_spec(tpr, fpr, fig_name, outputs):
+    return {'kind': 'line', 'fig_name': fig_name, 'outputs': outputs, 'tpr': np.ascontiguousarray(tpr), 'fpr': np.ascontiguousarray(fpr)}
+
+
+def make_roc_spec(tpr, fpr, cut_off_pos, cutoff_protein_id, fig_name, outputs):
+    return {'kind': 'roc', 'fig_name': fig_name, 'outputs': outputs, 'tpr': np.ascontiguousarray(tpr), 'fpr': np.ascontiguousarray(fpr),
+            'cut_off_pos': cut_off_pos, 'cutoff_protein_id': cutoff_protein_id}
+
+
+def make_scatter_spec(x_values, y_values, x_name, y_name, fig_name, outputs):
+    return {'kind': 'scatter', 'fig_name': fig_name, 'outputs': outputs, 'x': np.ascontiguousarray(x_values), 'y': np.ascontiguousarray(y_values),
+            'x_name': x_name, 'y_name': y_name}
+
+
+def _draw_heatmap(fig, spec):
+    ax = fig.subplots()
+    sns.heatmap(spec['corr'], linewidth=0.5, annot=True, cmap="coolwarm", vmin=-1, vmax=1, square=True, ax=ax)
+    ax.tick_params(left=False, bottom=False)
+    ax.set_xticklabels(ax.get_xticklabels(), rotation=50, ha='right')
+    ax.set_title('Pairwise Pearson Correlation Coefficient')
+
+
+def _draw_line(fig, spec):
+    '''
+    Line plot of TPR, FPR, TPR-FPR in the sorted order of a column
+    '''
+    ax = fig.subplots()
+    curves = pd.DataFrame({'TPR': spec['tpr'], 'FPR': spec['fpr'], 'TPR-FPR': spec['tpr'] - spec['fpr']})
+    curves.plot(use_index=False, ax=ax)
+    ax.set_xlabel('Rank')
+    ax.set_title('TPR, FPR, TPR-FPR')
+
+
+def _draw_roc(fig, spec):
+    '''
+    ROC with AUC, the cut off point is labelled
+    '''
+    tpr = spec['tpr']
+    fpr = spec['fpr']
+    cut_off_pos = spec['cut_off_pos']
+    cutoff_fpr = fpr[cut_off_pos]
+    cutoff_tpr = tpr[cut_off_pos]
+    ax = fig.subplots()
+    ax.plot(fpr, tpr)
+    ax.set_aspect('equal')
+    ax.set_title('ROC')
+    ax.set_xlabel('FPR')
+    ax.set_ylabel('TPR')
+    ax.text(0, 0.9, 'AUC = ' + str(round(auc(fpr, tpr), 2)))
+    ax.plot(cutoff_fpr, cutoff_tpr, marker='o', color='r')
+    ax.annotate('Cut-off Rank: '+str(cut_off_pos)+'\nUniprot ID: '+spec['cutoff_protein_id'] +'\nTPR='+str(round(cutoff_tpr,3))+', FPR='+str(round(cutoff_fpr,3)), (cutoff_fpr+0.05, cutoff_tpr-0.15))
+
+
+def _draw_scatter(fig, spec):
+    '''
+    Scatter plot of two ratio columns with their Pearson correlation coefficient
+    '''
+    corr = np.corrcoef(spec['x'], spec['y'])[0, 1]
+    ax = fig.subplots()
+    ax.scatter(spec['x'], spec['y'], linewidths=0.5, edgecolors='white')
+    ax.set_aspect('equal')
+    ax.annotate('Pearson r='+str(round(corr,3)), (ax.get_xlim()[0]+0.5, ax.get_ylim()[1]-1))
+    ax.spines[['right', 'top']].set_visible(False)
+    ax.set_xlabel(spec['x_name'])
+    ax.set_ylabel(spec['y_name'])
+    ax.set_title(f'Correlation {spec["x_name"]} vs {spec["y_name"]}')
+
+
+_DRAW = {'heatmap': _draw_heatmap, 'line': _draw_line, 'roc': _draw_roc, 'scatter': _draw_scatter}
+
+
+def render_plot(spec):
+    '''
+    Render one plot spec and save it to all of its outputs. Uses a standalone Figure instead of pyplot,
+    so it is safe to call from worker threads and processes. Each output is written to a temporary file and
+    moved in place, so a plot being rendered again is never read half-written
+    return fig_name
+    '''
+    fig = Figure()
+    _DRAW[spec['kind']](fig, spec)
+    for path, kwargs in spec['outputs']:
+        root, extension = os.path.splitext(str(path))
+        temp_path = f'{root}.{uuid.uuid4().hex}.tmp{extension}'
+        try:
+            fig.savefig(temp_path, **kwargs)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return spec['fig_name']
+
+
+class PlotRenderer:
+    '''
+    Render plot specs either in the calling process (jobs=1) or in a pool of worker processes
+    '''
+    def __init__(self, jobs=1):
+        self.__jobs = jobs
+        self.__executor = None
+
+
+    def __get_executor(self):
+        if self.__executor is None:
+            self.__executor = ProcessPoolExecutor(max_workers=self.__jobs)
+        return self.__executor
+
+
+    async def render(self, specs, on_ready=None):
+        '''
+        Render all specs without blocking the event loop, on_ready(fig_name) is called as soon as each figure is saved
+        '''
+        loop = asyncio.get_running_loop()
+        if self.__jobs > 1:
+            executor = self.__get_executor()
+            futures = [loop.run_in_executor(executor, render_plot, spec) for spec in specs]
+            for future in asyncio.as_completed(futures):
+                fig_name = await future
+                self.__ready(fig_name, on_ready)
+        else:
+            # a single background thread, so that the event loop stays responsive
+            for spec in specs:
+                fig_name = await loop.run_in_executor(None, render_plot, spec)
+                self.__ready(fig_name, on_ready)
+
+
+    def __ready(self, fig_name, on_ready):
+        logger.debug(f'{fig_name} is ready')
+        if on_ready is not None:
+            on_ready(fig_name)
+
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
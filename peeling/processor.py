@@ -1,52 +1,92 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.metrics import auc
 import os
 from abc import ABC, abstractmethod
 import logging
 import re
+from peeling.cutoffengine import CutoffEngine
+from peeling.idresolver import IdResolver
+from peeling.curvedata import save_curves, CURVES_FILENAME
+from peeling.tablewriter import write_table, write_columnar, COLUMNAR_EXTENSIONS
+from peeling.plotrenderer import PlotRenderer, make_heatmap_spec, make_line_spec, make_roc_spec, DPI
 
 logger = logging.getLogger('peeling')
 
+TOLERANCE_SWEEP_DIR = 'tolerance_sweep'
+
 
 class Processor(ABC):
-    def __init__(self, user_input_reader, uniprot_communicator):
+    def __init__(self, user_input_reader, uniprot_communicator, compartment_communicators=None):
+        '''
+        compartment_communicators: dict of cellular compartment -> communicator providing its annotations,
+        for the compartments other than the one of uniprot_communicator
+        '''
         self.__user_input_reader = user_input_reader
         self.__uniprot_communicator = uniprot_communicator
+        self.__compartment_communicators = compartment_communicators if compartment_communicators is not None else {}
+        self.__plot_specs = []
 
 
     def _mass_data_clean(self, data):
         try:
             id_col = data.columns[0]
             data.rename(columns={id_col: 'From'}, inplace=True)
-            data.replace('', np.nan, inplace=True) #for web, missing value is taken as '', won't be dropped
+            # for web, missing value is taken as '', won't be dropped. Only text columns can hold ''
+            text_cols = data.columns[data.dtypes == object]
+            if len(text_cols) > 0:
+                data[text_cols] = data[text_cols].replace('', np.nan)
             data = data.dropna(axis=0, how='any')
             logger.info(f'After dropping rows with missing value: {len(data)}')
             assert(len(data) >= 1), 'Empty data after dropping missing values'
 
-            data.columns = [re.sub('[^a-zA-Z0-9_]', '_', name) for name in data.columns]
-            data[data.columns[1:]] = data[data.columns[1:]].astype('float')
+            data.columns = [re.sub('[^a-zA-Z0-9_]', '_', str(name)) for name in data.columns]
+            # ratio columns read with numeric types are used as they are, float32 included
+            ratio_dtypes = data.dtypes[1:]
+            if not all(pd.api.types.is_float_dtype(dtype) for dtype in ratio_dtypes):
+                data[data.columns[1:]] = data[data.columns[1:]].astype('float')
             return data
         except Exception as e:
             raise
 
 
     def __make_heatmap(self, data, plot_path):
-        data.set_index('From', inplace=True)
-        corr = data.corr()
+        corr = data.set_index('From').corr()
         #r2 = corr**2
-        fig, ax = plt.subplots()
-        ax = sns.heatmap(corr, linewidth=0.5, annot=True, cmap="coolwarm", vmin=-1, vmax=1, square=True)
-        ax.tick_params(left=False, bottom=False)
-        ax.set_xticklabels(ax.get_xticklabels(), rotation=50, ha='right')
         title = 'Pairwise Pearson Correlation Coefficient'
-        plt.title(title)
         fig_name = title.replace(' ', '_')
-        plt.savefig(f'{plot_path}/{fig_name}.{self.__user_input_reader.get_plot_format()}', bbox_inches='tight', dpi=130)
-        data.reset_index(inplace=True)
-        return fig_name
+        self.__add_plot(make_heatmap_spec(corr, fig_name, self.__get_plot_outputs(plot_path, fig_name, bbox_inches='tight')))
+
+
+    def __get_plot_outputs(self, plot_path, fig_name, **kwargs):
+        outputs = [(f'{plot_path}/{fig_name}.{self.__user_input_reader.get_plot_format()}', dict(dpi=DPI, **kwargs))]
+        return outputs + self._get_supplemental_outputs(fig_name)
+
+
+    def __add_plot(self, spec):
+        self.__plot_specs.append(spec)
+
+
+    async def __render_plots(self):
+        '''
+        Render all plot specs emitted by the analysis, in parallel if more than one job is configured
+        '''
+        renderer = PlotRenderer(self.__user_input_reader.get_jobs())
+        try:
+            await renderer.render(self.__plot_specs, self._on_plot_ready)
+        finally:
+            renderer.close()
+            self.__plot_specs = []
+
+
+    def _on_plot_ready(self, fig_name):
+        return
+
+
+    async def _run_blocking(self, function, *args):
+        '''
+        Run a CPU-bound step of the analysis, in the calling thread by default
+        '''
+        return function(*args)
 
 
     @abstractmethod
@@ -56,147 +96,96 @@ class Processor(ABC):
 
     def _merge_id(self, mass_data, id_mapping_data):
         # logger.debug(f'\n{id_mapping_data.head()}')
-        id_mapping_data.drop_duplicates(subset=['From'], keep='first', inplace=True)
-        id_mapping_data.set_index('From', inplace=True)
-
-        mass_data = mass_data.merge(id_mapping_data, how='left', left_on = mass_data.columns[0], right_index=True)
-        id_mapping_data.reset_index(inplace=True)
-        # logger.debug(f'len(data): {len(mass_data)}')
-        # logger.debug(f'\n{mass_data.head()}')
-        # logger.debug(f"No Id mapping data: {np.sum(np.sum(mass_data[['From', 'Entry']].isnull()))}")
-        mass_data[['From', 'Entry']]=mass_data[['From', 'Entry']].fillna(axis=1, method='ffill')
-        # logger.debug(f"After fillna: {np.sum(np.sum(mass_data[['From', 'Entry']].isnull()))}")
-        updated_ids=np.sum(mass_data['From']!=mass_data['Entry'])
-        logger.info(f'Mapped ids: {updated_ids}')
-        mass_data.drop([mass_data.columns[0]], axis=1, inplace=True)
-        mass_data.set_index('Entry', inplace=True)
+        resolver = IdResolver(id_mapping_data)
+        mass_data = resolver.resolve(mass_data)
+        counts = resolver.get_counts()
+        logger.info(f'Mapped ids: {counts["updated"]}')
+        logger.info(f'Ids without mapping data: {counts["no_mapping"]}, mapped to several entries: {counts["one_to_many"]}, '
+                    f'sharing an entry with other ids: {counts["merged"]}')
         logger.info('Id mapping is done')
         return mass_data
 
 
     @abstractmethod
-    def _get_annotation_data(self, type):
+    def _get_annotation_data(self, type, cellular_compartment=None):
         raise NotImplementedError()
 
 
-    def __merge_annotation(self, mass_data, annotation, type):
+    async def _get_reference_index(self, type, cellular_compartment=None):
         '''
         type: 'true_positive' or 'false_positive'
+        return ReferenceIndex of the annotation, cached by the communicator so that it is built once for all runs
         '''
-        logger.debug(f'Adding annotation_{type} started.')
-        logger.debug(f'\n{annotation.head()}')
-        annotation['Add'] = 1
-        annotation.drop_duplicates(keep='first', inplace=True)
-        annotation.dropna(axis=0, how='any', inplace=True)
-        annotation.set_index('Entry', inplace=True)
-
-        mass_data = mass_data.merge(annotation, how='left', left_index=True, right_index=True)
-        new_col_name = 'TP' if type=='true_positive' else 'FP'
-        mass_data.rename(columns={'Add': new_col_name}, inplace=True)
-
-        mass_data[new_col_name] = mass_data[new_col_name].fillna(0)
-        logger.info(f'Adding annotation_{type} is done.')
-        return mass_data
+        return await self._get_uniprot_communicator(cellular_compartment).get_reference_index(type)
 
 
-    def __calculate_TPR_FPR_diff(self, data, col_to_sort):
+    async def __get_annotation_flags(self, mass_data, type, cellular_compartment):
         '''
-        Sort data on col_to_sort in descending order, calculate accumulative TPR, FPR and TPR-FPR.
-        Input
-        data: df
-        col_to_sort: int, the index of the column to sort
-        return df
+        type: 'true_positive' or 'false_positive'
+        return boolean array, True for the proteins in the annotation
         '''
-        col_name = data.columns[col_to_sort]
-        data.sort_values(by=[col_name], ascending=False, inplace=True)
-
-        TPR_col_name = "TPR"
-        FPR_col_name = "FPR"
-        data[[TPR_col_name, FPR_col_name]] = data[['TP', 'FP']].cumsum()
-        data[TPR_col_name] = data[TPR_col_name] / data['TP'].sum()
-        data[FPR_col_name] = data[FPR_col_name] / data['FP'].sum()
-        data['TPR-FPR'] = data[TPR_col_name] - data[FPR_col_name]
-        return data
+        logger.debug(f'Adding annotation_{type} started.')
+        reference_index = await self._get_reference_index(type, cellular_compartment)
+        flags = reference_index.contains(mass_data.index)
+        logger.info(f'Adding annotation_{type} is done, {flags.sum()} proteins found in {len(reference_index)} annotated entries.')
+        return flags
 
 
-    def __plot_line(self, data, output_dir, col_index):
+    def __plot_line(self, result, output_dir, col_index, col_name):
         '''
-        Make line plot of the last three columns (TPR, FPR, TPR-FPR)
+        Line plot of TPR, FPR, TPR-FPR in the sorted order of the column
         '''
-        col_list = data.columns[-3:]
-        plt.figure()
-        data[col_list].plot(use_index=False)
-
-        plt.xlabel('Rank')
-        plt.title('TPR, FPR, TPR-FPR')
-        fig_name = f'TPR_FPR_{data.columns[col_index]}'
-        plt.savefig(f'{output_dir}/{fig_name}.{self.__user_input_reader.get_plot_format()}', dpi=130)
-        return fig_name
+        fig_name = f'TPR_FPR_{col_name}'
+        self.__add_plot(make_line_spec(result.get_tpr(col_index), result.get_fpr(col_index), fig_name, self.__get_plot_outputs(output_dir, fig_name)))
 
 
     @abstractmethod
-    def _plot_supplemental(self, fig_name):
-        raise NotImplemented()
-
-
-    def __filter_by_max_TPR_FPR_diff(self, data, col_index):
+    def _get_supplemental_outputs(self, fig_name):
         '''
-        Set cut-off point to be the point with the maximal TPR-FPR; Set include = True if before or at this pos, False otherwise
-        Return FPR, TPR of the cut-off point
+        Extra (file path, savefig kwargs) outputs of a plot besides the one in the plots directory
         '''
-        cut_off_pos = data.iloc[:, -1].argmax()
-
-        col_name = 'include_' + data.columns[col_index]
-        data[col_name] = True
-        data.iloc[cut_off_pos + 1:, -1] = False
-        return cut_off_pos
+        raise NotImplementedError()
 
 
-    def __plot_roc(self, data, cut_off_pos, output_dir, col_index):
+    def __plot_roc(self, result, cutoff_protein_id, output_dir, col_index, col_name):
         '''
         Make ROC, calculate AUC, label the cut off point
         '''
-        cutoff_fpr = data.iloc[cut_off_pos, -3]
-        cutoff_tpr = data.iloc[cut_off_pos, -4]
-        cutoff_protein_id = data.index[cut_off_pos]
-        fig, ax = plt.subplots()
-        ax.plot(data.iloc[:, -3], data.iloc[:, -4])
-        ax.set_aspect('equal')
-        plt.title('ROC')
-        plt.xlabel('FPR')
-        plt.ylabel('TPR')
-        plt.text(0, 0.9, 'AUC = ' + str(round(auc(data.iloc[:, -3], data.iloc[:, -4]), 2)))
-        plt.plot(cutoff_fpr, cutoff_tpr, marker='o', color='r')
-        ax.annotate('Cut-off Rank: '+str(cut_off_pos)+'\nUniprot ID: '+cutoff_protein_id +'\nTPR='+str(round(cutoff_tpr,3))+', FPR='+str(round(cutoff_fpr,3)), (cutoff_fpr+0.05, cutoff_tpr-0.15))
-        fig_name = f'ROC_{data.columns[col_index]}'
-        plt.savefig(f'{output_dir}/{fig_name}.{self.__user_input_reader.get_plot_format()}', dpi=130)
-        return fig_name
-
-
-    def __get_true_positive_proteins(self, data, path, plots_path):
+        fig_name = f'ROC_{col_name}'
+        self.__add_plot(make_roc_spec(result.get_tpr(col_index), result.get_fpr(col_index), result.get_cut_off_pos(col_index),
+                                      cutoff_protein_id, fig_name, self.__get_plot_outputs(output_dir, fig_name)))
+
+
+    def __get_true_positive_proteins(self, data, engine, tp, fp, path, plots_path):
         '''
         If a protein is included in at least num_ctrl * num_rep - tolerance columns, output it as true_positive protein
+        engine: CutoffEngine of the ratio columns of data
+        tp, fp: boolean arrays of the annotations of the rows of data
 
         Output
         Accession ids of the true_positive proteins
         '''
         total_col = self.__user_input_reader.get_num_controls() * self.__user_input_reader.get_num_replicates()
-        start_col = 0
         threshold = total_col - self.__user_input_reader.get_tolerance()
+        ratio_cols = data.columns[:total_col]
+
+        result = engine.evaluate(tp, fp)
+        order = engine.get_order()
 
-        for i in range(start_col, start_col + total_col):
-            self.__calculate_TPR_FPR_diff(data, i)
-            fig_name = self.__plot_line(data, plots_path, i)
-            self._plot_supplemental(fig_name)
-            cut_off_pos = self.__filter_by_max_TPR_FPR_diff(data, i)
-            fig_name = self.__plot_roc(data, cut_off_pos, plots_path, i)
-            self._plot_supplemental(fig_name)
-            data.drop(data.columns[-4:-1], axis=1, inplace=True)
+        cutoff_protein_ids = [data.index[order[result.get_cut_off_pos(i), i]] for i in range(total_col)]
+        if self.__user_input_reader.get_defer_plots():
+            # per-column plots are rendered later from the curve data, on demand
+            save_curves(os.path.join(path, CURVES_FILENAME), list(ratio_cols), result, cutoff_protein_ids)
+        else:
+            for i, col_name in enumerate(ratio_cols):
+                self.__plot_line(result, plots_path, i, col_name)
+                self.__plot_roc(result, cutoff_protein_ids[i], plots_path, i, col_name)
 
-        col_name = 'include_sum'
-        data[col_name] = data.iloc[:, -total_col:].sum(axis=1)
+        include_sum = result.get_include().sum(axis=1)
 
-        true_positive_proteins = data[data[col_name] >= threshold].iloc[:, :total_col+4]
+        # output in the sorted order of the last ratio column
+        last_order = order[:, -1]
+        true_positive_proteins = data.iloc[last_order][include_sum[last_order] >= threshold].iloc[:, :total_col+4]
         true_positive_proteins.reset_index(inplace=True)
         true_positive_proteins.dropna(subset='Entry', axis=0, how='any')
         true_positive_proteins.drop_duplicates(subset='Entry', keep='first', inplace=True)
@@ -205,18 +194,85 @@ class Processor(ABC):
         true_positive_proteins = true_positive_proteins[['Entry', 'Gene Names', 'Protein names', 'Organism', 'Length']]
 
         logger.info(f'{len(true_positive_proteins)} true_positive proteins found')
-        true_positive_proteins.to_csv(f'{path}/post-cutoff-proteome.tsv', sep='\t', index=False)
+        output_format = self.__user_input_reader.get_output_format()
+        write_table(true_positive_proteins, f'{path}/post-cutoff-proteome.tsv', output_format)
         # save a txt file containing just true_positive protein ids separated by ',', so that easily copy to put in other web
         proteins_str = ','.join(list(true_positive_proteins['Entry']))
         with open(f'{path}/post-cutoff-proteome.txt', 'w') as f:
             f.write(proteins_str)
 
+        if self.__user_input_reader.get_tolerance_sweep():
+            self.__save_tolerance_sweep(data, tp, fp, include_sum, last_order, total_col, path)
+
+        if output_format in COLUMNAR_EXTENSIONS:
+            self.__save_columnar_results(data, tp, fp, ratio_cols, result, path, output_format)
+
+
+    def __save_columnar_results(self, data, tp, fp, ratio_cols, result, path, output_format):
+        '''
+        Per-column include flags of every protein, and TPR/FPR curves in the sorted order of every column
+        '''
+        include = pd.DataFrame(result.get_include(), columns=list(ratio_cols))
+        include.insert(0, 'Entry', data.index.to_numpy())
+        include['TP'] = tp
+        include['FP'] = fp
+        include['Included'] = result.get_include().sum(axis=1)
+        write_columnar(include, f'{path}/include_flags', output_format)
+
+        curves = []
+        for i, col_name in enumerate(ratio_cols):
+            tpr = result.get_tpr(i)
+            curves.append(pd.DataFrame({'Column': col_name, 'Rank': np.arange(len(tpr)), 'TPR': tpr, 'FPR': result.get_fpr(i),
+                                        'Cut_off': np.arange(len(tpr)) == result.get_cut_off_pos(i)}))
+        curves = pd.concat(curves, ignore_index=True)
+        curves['Column'] = pd.Categorical(curves['Column'], categories=list(ratio_cols))
+        write_columnar(curves, f'{path}/tpr_fpr_curves', output_format)
+
+
+    def __save_tolerance_sweep(self, data, tp, fp, include_sum, last_order, total_col, path):
+        '''
+        Post-cutoff proteome of every tolerance, all selected from the same include_sum
+        '''
+        sweep_path = os.path.join(path, TOLERANCE_SWEEP_DIR)
+        os.makedirs(sweep_path, exist_ok=True)
+        sorted_data = data.iloc[last_order].reset_index()
+        sorted_include_sum = include_sum[last_order]
+        entries = sorted_data['Entry']
+        tp = tp[last_order]
+        fp = fp[last_order]
+        summary = []
+        for tolerance in range(total_col + 1):
+            # as in the main output, a protein is counted once, at its first selected row in the output order
+            selected = sorted_include_sum >= total_col - tolerance
+            selected[selected] = ~entries[selected].duplicated(keep='first').to_numpy()
+            proteins = sorted_data.loc[selected, ['Entry', 'Gene Names', 'Protein names', 'Organism', 'Length']]
+            write_table(proteins, os.path.join(sweep_path, f'post-cutoff-proteome_tolerance_{tolerance}.tsv'), self.__user_input_reader.get_output_format())
+            summary.append([tolerance, int(selected.sum()), int((selected & tp).sum()), int((selected & fp).sum())])
+        summary = pd.DataFrame(summary, columns=['Tolerance', 'Proteins', 'TP', 'FP'])
+        write_table(summary, os.path.join(sweep_path, 'tolerance_sweep_summary.tsv'), self.__user_input_reader.get_output_format())
+        logger.info(f'Tolerance sweep saved at {sweep_path}')
+
 
     @abstractmethod
     def _construct_path(self):
         raise NotImplemented()
 
 
+    def __prepare_cutoff(self, data, id_mapping_data):
+        '''
+        return data indexed by the latest ids, and the CutoffEngine of its ratio columns
+        '''
+        data = self._merge_id(data, id_mapping_data)
+
+        # rows with the same Entry are grouped in Entry order, ties in the ratios are broken by this row order
+        if not data.index.is_unique:
+            data = data.sort_index(kind='mergesort')
+
+        # the sort orders of the ratio columns are computed once, each compartment only has its own TP/FP flags
+        total_col = self.__user_input_reader.get_num_controls() * self.__user_input_reader.get_num_replicates()
+        return data, CutoffEngine(data[data.columns[:total_col]].to_numpy(dtype=float))
+
+
     async def _analyze(self, data, parent_path):
         plots_path = os.path.join(parent_path, "plots")
         try:
@@ -224,28 +280,38 @@ class Processor(ABC):
         except OSError as error:
             logger.debug(error)
 
-        fig_name = self.__make_heatmap(data, plots_path)
-        self._plot_supplemental(fig_name)
+        await self._run_blocking(self.__make_heatmap, data, plots_path)
         id_mapping_data = await self._get_id_mapping_data(data)
-        data = self._merge_id(data, id_mapping_data)
-        annotation_true_positive = await self._get_annotation_data('true_positive')
-        data = self.__merge_annotation(data, annotation_true_positive, 'true_positive')
-        annotation_false_positive = await self._get_annotation_data('false_positive')
-        data = self.__merge_annotation(data, annotation_false_positive, 'false_positive')
-
-        self.__get_true_positive_proteins(data, parent_path, plots_path)
+        data, engine = await self._run_blocking(self.__prepare_cutoff, data, id_mapping_data)
+        cellular_compartments = self.__user_input_reader.get_cellular_compartments()
+        for cellular_compartment in cellular_compartments:
+            path, cc_plots_path = parent_path, plots_path
+            if len(cellular_compartments) > 1:
+                logger.info(f'Cut-off analysis for cellular compartment {cellular_compartment}')
+                path = os.path.join(parent_path, cellular_compartment)
+                cc_plots_path = os.path.join(path, 'plots')
+                os.makedirs(cc_plots_path, exist_ok=True)
+            tp = await self.__get_annotation_flags(data, 'true_positive', cellular_compartment)
+            fp = await self.__get_annotation_flags(data, 'false_positive', cellular_compartment)
+            await self._run_blocking(self.__get_true_positive_proteins, data, engine, tp, fp, path, cc_plots_path)
+
+        await self.__render_plots()
 
 
     def _write_args(self, path):
         with open(os.path.join(path, 'log.txt'), 'w') as f:
             f.write('Mass spec file: ' + str(self.__user_input_reader.get_mass_spec_filename()) + '\n')
-            cellular_compartment = self._get_user_input_reader().get_cellular_compartment()
-            if cellular_compartment is not None:
-                f.write(f'Cellular compartment: {cellular_compartment}\n')
+            f.write(f'Cellular compartment: {", ".join(self.__user_input_reader.get_cellular_compartments())}\n')
             f.write(f'Number of controls: {self.__user_input_reader.get_num_controls()}\n')
             f.write(f'Number of replicates: {self.__user_input_reader.get_num_replicates()}\n')
             f.write(f'Tolerance: {self.__user_input_reader.get_tolerance()}\n')
             f.write(f'Plot format: {self.__user_input_reader.get_plot_format()}\n')
+            if self.__user_input_reader.get_defer_plots():
+                f.write('Deferred plots: True\n')
+            if self.__user_input_reader.get_tolerance_sweep():
+                f.write('Tolerance sweep: True\n')
+            if self.__user_input_reader.get_output_format() != 'tsv':
+                f.write(f'Output format: {self.__user_input_reader.get_output_format()}\n')
 
 
 
@@ -258,7 +324,10 @@ class Processor(ABC):
         return self.__user_input_reader
 
 
-    def _get_uniprot_communicator(self):
-        return self.__uniprot_communicator
+    def _get_uniprot_communicator(self, cellular_compartment=None):
+        '''
+        return the communicator providing the annotations of cellular_compartment, the main one by default
+        '''
+        return self.__compartment_communicators.get(cellular_compartment, self.__uniprot_communicator)
 
 
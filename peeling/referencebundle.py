@@ -0,0 +1,108 @@
+import os
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from peeling.cachedir import get_cache_dir
+
+logger = logging.getLogger('peeling')
+
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_SUBDIR = 'bundles'
+
+
+def get_default_bundle_path(cc_code, create=False):
+    '''
+    Location of the bundle of a built-in cellular compartment in the peeling cache directory
+    create: create the bundles directory, for writing the bundle
+    '''
+    return os.path.join(get_cache_dir(BUNDLE_SUBDIR, create=create), f'{cc_code}_reference.npz')
+
+
+def find_default_bundle(cc_code):
+    '''
+    return path of the bundle of a built-in cellular compartment in the peeling cache directory, None if there is none
+    '''
+    path = get_default_bundle_path(cc_code)
+    if not os.path.exists(path):
+        return None
+    logger.info(f'Using the {cc_code} bundle {path} from the peeling cache directory, pass --bundle to use another one')
+    return path
+
+
+def save_bundle(path, cc_code, annotation_true_positive, annotation_false_positive, source):
+    '''
+    Save the true positive and false positive accessions of a cellular compartment to one compressed .npz file.
+    Both sets are stored as positions into a sorted index of all their accessions
+    annotation_*: df with the accessions in the 'Entry' column
+    source: where the annotations come from, e.g. the UniProt url or the local file names
+    '''
+    true_positive = np.array(annotation_true_positive['Entry'].dropna(), dtype=str)
+    false_positive = np.array(annotation_false_positive['Entry'].dropna(), dtype=str)
+    accessions = np.unique(np.concatenate([true_positive, false_positive]))
+    np.savez_compressed(
+        path,
+        format_version=np.array(BUNDLE_FORMAT_VERSION),
+        cc=np.array(cc_code),
+        created=np.array(datetime.now().isoformat(timespec='seconds')),
+        source=np.array(source),
+        accessions=accessions,
+        true_positive=np.searchsorted(accessions, true_positive).astype(np.int32),
+        false_positive=np.searchsorted(accessions, false_positive).astype(np.int32),
+    )
+    logger.info(f'Saved {len(true_positive)} true positive and {len(false_positive)} false positive entries for {cc_code} at {path}')
+
+
+class ReferenceBundle:
+    '''
+    Read-only access to a bundle written by save_bundle
+    '''
+    def __init__(self, path):
+        with np.load(path) as bundle:
+            format_version = int(bundle['format_version'])
+            if format_version != BUNDLE_FORMAT_VERSION:
+                raise Exception(f'{path}: bundle format version {format_version} is not supported, please rebuild it with peeling-bundle')
+            self.__cc_code = str(bundle['cc'])
+            self.__created = str(bundle['created'])
+            self.__source = str(bundle['source'])
+            self.__accessions = bundle['accessions']
+            self.__positions = {'true_positive': bundle['true_positive'], 'false_positive': bundle['false_positive']}
+        self.__path = path
+
+
+    def get_path(self):
+        return self.__path
+
+
+    def get_cc_code(self):
+        return self.__cc_code
+
+
+    def get_created(self):
+        return self.__created
+
+
+    def get_age(self):
+        '''
+        return timedelta since the bundle was built
+        '''
+        return datetime.now() - datetime.fromisoformat(self.__created)
+
+
+    def get_source(self):
+        return self.__source
+
+
+    def get_accessions(self):
+        '''
+        return sorted array of all accessions in the bundle
+        '''
+        return self.__accessions
+
+
+    def get_annotation(self, type):
+        '''
+        type: 'true_positive' or 'false_positive'
+        return df with the 'Entry' column
+        '''
+        return pd.DataFrame({'Entry': self.__accessions[self.__positions[type]]})
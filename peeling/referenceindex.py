@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from peeling.accessioncodec import encode_accessions, decode_accessions, INVALID_CODE
+
+
+class ReferenceIndex:
+    '''
+    Index of the accessions of one reference set (true positive or false positive annotation),
+    built once and reused for the membership tests of every run
+    Accessions are held as a sorted array of int codes and looked up by binary search, which takes 8 bytes
+    per entry instead of a string object and a hash table slot. Entries that are not UniProt accessions
+    are kept in a hash index of strings
+    '''
+    def __init__(self, annotation):
+        '''
+        annotation: df with the accessions in the 'Entry' column
+        '''
+        entries = annotation['Entry'].dropna().unique()
+        codes = encode_accessions(entries)
+        is_code = codes != INVALID_CODE
+        self.__codes = np.unique(codes[is_code])
+        self.__other = pd.Index(entries[~is_code])
+        # the hash table of the index is built on the first lookup and kept with it
+        self.__other.get_indexer(self.__other[:1])
+
+
+    def __len__(self):
+        return len(self.__codes) + len(self.__other)
+
+
+    def contains(self, ids):
+        '''
+        return boolean array, True for the ids found in the reference set
+        '''
+        found = np.zeros(len(ids), dtype=bool)
+        if len(self) == 0:
+            return found
+        codes = encode_accessions(ids)
+        is_code = codes != INVALID_CODE
+        if len(self.__codes) > 0:
+            codes = codes[is_code]
+            positions = np.minimum(np.searchsorted(self.__codes, codes), len(self.__codes) - 1)
+            found[is_code] = self.__codes[positions] == codes
+        if len(self.__other) > 0 and not is_code.all():
+            found[~is_code] = self.__other.get_indexer(np.asarray(ids, dtype=object)[~is_code]) >= 0
+        return found
+
+
+    def get_entries(self):
+        '''
+        return df with the unique entries in the 'Entry' column, decoded from the int codes on each call
+        '''
+        entries = np.concatenate([decode_accessions(self.__codes), self.__other.to_numpy(dtype=object)])
+        return pd.DataFrame({'Entry': entries})
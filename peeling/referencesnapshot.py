@@ -0,0 +1,43 @@
+from datetime import datetime
+from peeling.referenceindex import ReferenceIndex
+
+
+class ReferenceSnapshot:
+    '''
+    One published version of the reference data of a cellular compartment, shared by all requests of the web service.
+    A snapshot is never modified after it is built: an update builds the next snapshot and replaces the reference to it,
+    so a request pinning a snapshot reads the same data until it finishes, without copying it.
+    Only the int coded ReferenceIndexes are kept, the annotation frames are decoded from them when asked for
+    '''
+    def __init__(self, version, annotation_true_positive, annotation_false_positive):
+        '''
+        annotation_*: df with the accessions in the 'Entry' column, not referenced after this
+        '''
+        self.__version = version
+        self.__created = datetime.now()
+        # the indexes are built here, off the request path
+        self.__reference_indexes = {'true_positive': ReferenceIndex(annotation_true_positive),
+                                    'false_positive': ReferenceIndex(annotation_false_positive)}
+
+
+    def get_version(self):
+        return self.__version
+
+
+    def get_created(self):
+        return self.__created
+
+
+    def get_annotation(self, type):
+        '''
+        type: 'true_positive' or 'false_positive'
+        return df with the unique entries in the 'Entry' column, decoded on each call
+        '''
+        return self.__reference_indexes[type].get_entries()
+
+
+    def get_reference_index(self, type):
+        '''
+        type: 'true_positive' or 'false_positive'
+        '''
+        return self.__reference_indexes[type]
@@ -0,0 +1,182 @@
+import os
+import sqlite3
+import threading
+import time
+import logging
+import pandas as pd
+
+logger = logging.getLogger('peeling')
+
+SCHEMA_VERSION = 2
+SQL_VARIABLE_LIMIT = 900
+
+# id mapping columns as returned by UniProt -> columns of the ids table
+ID_COLUMNS = {'From': 'from_id', 'Entry': 'entry', 'Protein names': 'protein_names', 'Gene Names': 'gene_names', 'Organism': 'organism', 'Length': 'length'}
+
+
+class ReferenceStore:
+    '''
+    Indexed local store (SQLite) of the reference data retrieved from UniProt: the annotation
+    entries of each cellular compartment and the latest ids (id mapping results)
+    '''
+    def __init__(self, path):
+        self.__path = path
+        self.__lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__init_schema()
+
+
+    def __init_schema(self):
+        with self.__lock, self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            row = self.__connection.execute("SELECT value FROM meta WHERE key='schema_version'").fetchone()
+            if row is not None and int(row[0]) > SCHEMA_VERSION:
+                raise Exception(f'Reference store {self.__path} has schema version {row[0]}, this version of peeling supports up to {SCHEMA_VERSION}')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS annotations (cc TEXT, type TEXT, entry TEXT, PRIMARY KEY (cc, type, entry)) WITHOUT ROWID')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS ids (from_id TEXT PRIMARY KEY, entry TEXT, protein_names TEXT, gene_names TEXT, organism TEXT, length INTEGER, updated REAL, accessed REAL)')
+            if row is not None and int(row[0]) < 2:
+                # version 2 tracks the last access of each id for eviction
+                self.__connection.execute('ALTER TABLE ids ADD COLUMN accessed REAL')
+                self.__connection.execute('UPDATE ids SET accessed=updated')
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS ids_accessed ON ids (accessed)')
+            self.__connection.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+
+
+    def get_path(self):
+        return self.__path
+
+
+    def has_annotation(self, cc, type):
+        with self.__lock:
+            row = self.__connection.execute('SELECT 1 FROM annotations WHERE cc=? AND type=? LIMIT 1', (cc, type)).fetchone()
+        return row is not None
+
+
+    def get_annotation(self, cc, type):
+        '''
+        type: 'true_positive' or 'false_positive'
+        return df with one column Entry
+        '''
+        with self.__lock:
+            rows = self.__connection.execute('SELECT entry FROM annotations WHERE cc=? AND type=?', (cc, type)).fetchall()
+        return pd.DataFrame(rows, columns=['Entry'])
+
+
+    def replace_annotation(self, cc, type, annotation):
+        '''
+        Replace the annotation entries of cc and type in one transaction
+        annotation: df with an Entry column
+        '''
+        self.replace_annotations(cc, {type: annotation})
+
+
+    def replace_annotations(self, cc, annotations):
+        '''
+        Replace the annotation entries of several types of cc in one transaction, so that e.g. the true positive
+        and false positive sets are never left from different updates
+        annotations: dict of type -> df with an Entry column
+        '''
+        entries = {type: annotation['Entry'].dropna().unique() for type, annotation in annotations.items()}
+        with self.__lock, self.__connection:
+            for type, type_entries in entries.items():
+                self.__connection.execute('DELETE FROM annotations WHERE cc=? AND type=?', (cc, type))
+                self.__connection.executemany('INSERT INTO annotations VALUES (?, ?, ?)', ((cc, type, entry) for entry in type_entries))
+        for type, type_entries in entries.items():
+            logger.debug(f'{len(type_entries)} entries saved for {cc}_annotation_{type}')
+
+
+    def __rows_from_df(self, df):
+        updated = time.time()
+        df = df.reindex(columns=list(ID_COLUMNS.keys()))
+        df['Length'] = pd.to_numeric(df['Length'], errors='coerce').astype('Int64')
+        df = df.astype(object).where(df.notnull(), None)
+        for row in df.itertuples(index=False, name=None):
+            yield tuple(value if value is None or isinstance(value, int) else str(value) for value in row) + (updated, updated)
+
+
+    def __df_from_rows(self, rows):
+        df = pd.DataFrame(rows, columns=list(ID_COLUMNS.keys()))
+        df['Length'] = pd.to_numeric(df['Length']).astype('Int64')
+        return df
+
+
+    def upsert_ids(self, ids):
+        '''
+        Insert or update id mapping rows, ids: df with columns From, Entry, Protein names, Gene Names, Organism, Length
+        ids without mapping data are stored with Entry NaN
+        '''
+        placeholders = ', '.join(['?'] * (len(ID_COLUMNS) + 2))
+        with self.__lock, self.__connection:
+            self.__connection.executemany(f'INSERT OR REPLACE INTO ids VALUES ({placeholders})', self.__rows_from_df(ids))
+
+
+    def replace_ids(self, ids):
+        '''
+        Replace all id mapping rows in one transaction
+        '''
+        placeholders = ', '.join(['?'] * (len(ID_COLUMNS) + 2))
+        with self.__lock, self.__connection:
+            self.__connection.execute('DELETE FROM ids')
+            self.__connection.executemany(f'INSERT OR REPLACE INTO ids VALUES ({placeholders})', self.__rows_from_df(ids))
+
+
+    def __select_ids(self, columns, old_ids, max_age=None, touch=False):
+        old_ids = list(dict.fromkeys(old_ids))
+        now = time.time()
+        min_updated = now - max_age if max_age is not None else 0
+        rows = []
+        with self.__lock, self.__connection:
+            for i in range(0, len(old_ids), SQL_VARIABLE_LIMIT):
+                chunk = old_ids[i:i+SQL_VARIABLE_LIMIT]
+                placeholders = ', '.join(['?'] * len(chunk))
+                condition = f'from_id IN ({placeholders}) AND updated >= ?'
+                rows += self.__connection.execute(f'SELECT {columns} FROM ids WHERE {condition}', chunk + [min_updated]).fetchall()
+                if touch:
+                    self.__connection.execute(f'UPDATE ids SET accessed=? WHERE {condition}', [now] + chunk + [min_updated])
+        return rows
+
+
+    def lookup_ids(self, old_ids, max_age=None):
+        '''
+        return df of the stored id mapping rows of old_ids, rows older than max_age seconds are ignored
+        '''
+        return self.__df_from_rows(self.__select_ids(', '.join(ID_COLUMNS.values()), old_ids, max_age, touch=True))
+
+
+    def get_missing_ids(self, old_ids, max_age=None):
+        '''
+        return list of ids in old_ids which are not in the store, or only stored longer than max_age seconds ago
+        '''
+        found = set(row[0] for row in self.__select_ids('from_id', old_ids, max_age))
+        return [id for id in dict.fromkeys(old_ids) if id not in found]
+
+
+    def evict_ids(self, max_entries):
+        '''
+        Delete the least recently accessed ids so that at most max_entries are kept
+        return number of deleted ids
+        '''
+        with self.__lock, self.__connection:
+            cursor = self.__connection.execute('DELETE FROM ids WHERE from_id IN (SELECT from_id FROM ids ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (max_entries,))
+            return cursor.rowcount
+
+
+    def get_ids(self):
+        columns = ', '.join(ID_COLUMNS.values())
+        with self.__lock:
+            rows = self.__connection.execute(f'SELECT {columns} FROM ids').fetchall()
+        return self.__df_from_rows(rows)
+
+
+    def count_ids(self):
+        with self.__lock:
+            return self.__connection.execute('SELECT COUNT(*) FROM ids').fetchone()[0]
+
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
@@ -0,0 +1,213 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+import logging
+
+logger = logging.getLogger('peeling')
+
+RESULTS_PATH = '../results'
+INDEX_FILENAME = 'results_index.sqlite'
+ARCHIVE_EXTENSION = '.zip'
+DEFAULT_BUDGET = 20 * 1024**3 # bytes
+COLD_AGE = 7 * 24 * 3600 # seconds without access before a job is archived
+MIN_AGE = 3600 # seconds since the last access before a job may be evicted, so running jobs are kept
+
+
+def _get_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(directory, name))
+    return size
+
+
+class ResultsStore:
+    '''
+    Bounded store of the web job directories: tracks the size and last access of each job in a SQLite index,
+    archives jobs that haven't been accessed for a while into one zip file each, extracts them again when
+    they are opened, and evicts the least recently used jobs when the store is over its disk budget
+    '''
+    def __init__(self, root=RESULTS_PATH, budget=DEFAULT_BUDGET, cold_age=COLD_AGE, min_age=MIN_AGE):
+        self.__root = root
+        self.__budget = budget
+        self.__cold_age = cold_age
+        self.__min_age = min_age
+        self.__lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.__connection = sqlite3.connect(os.path.join(root, INDEX_FILENAME), check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        with self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, size INTEGER, archived INTEGER, created REAL, accessed REAL)')
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS jobs_accessed ON jobs (accessed)')
+
+
+    def get_root(self):
+        return self.__root
+
+
+    def __get_job_path(self, job_id):
+        return os.path.join(self.__root, job_id)
+
+
+    def __get_archive_path(self, job_id):
+        return os.path.join(self.__root, job_id + ARCHIVE_EXTENSION)
+
+
+    def add_job(self, job_id):
+        '''
+        Record a finished job, then evict old jobs if the store is over its budget
+        '''
+        size = _get_size(self.__get_job_path(job_id))
+        now = time.time()
+        with self.__lock, self.__connection:
+            self.__connection.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, 0, ?, ?)', (job_id, size, now, now))
+        logger.debug(f'Job {job_id} added to the results store, {size} bytes')
+        self.evict()
+
+
+    def open_job(self, job_id):
+        '''
+        Mark a job as accessed, extracting it first if it is archived. Jobs missing from the index,
+        e.g. created before the store was used, are added to it. The lock only guards the index and renames,
+        the extraction runs outside of it; call it in an executor from the event loop
+        return path of the job directory
+        '''
+        path = self.__get_job_path(job_id)
+        archive_path = self.__get_archive_path(job_id)
+        with self.__lock:
+            row = self.__connection.execute('SELECT archived FROM jobs WHERE job_id=?', (job_id,)).fetchone()
+        if (row is None or row[0]) and os.path.exists(archive_path):
+            self.__extract(job_id)
+        if not os.path.isdir(path):
+            raise Exception(f'Job {job_id} is not found, it may have expired')
+        with self.__lock, self.__connection:
+            if row is None or row[0]:
+                now = time.time()
+                self.__connection.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, 0, COALESCE((SELECT created FROM jobs WHERE job_id=?), ?), ?)',
+                                          (job_id, _get_size(path), job_id, now, now))
+            else:
+                self.__connection.execute('UPDATE jobs SET accessed=? WHERE job_id=?', (time.time(), job_id))
+        return path
+
+
+    def __extract(self, job_id):
+        '''
+        Extract an archived job aside and rename it in place, concurrent requests for the same job extract it once
+        '''
+        path = self.__get_job_path(job_id)
+        archive_path = self.__get_archive_path(job_id)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                archive.extractall(temp_path)
+        except FileNotFoundError: # extracted by another request meanwhile
+            return
+        with self.__lock:
+            extracted = not os.path.exists(path)
+            if extracted:
+                os.rename(temp_path, path)
+                os.remove(archive_path)
+        if extracted:
+            logger.info(f'Job {job_id} extracted from its archive')
+        else:
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+
+    def compact(self):
+        '''
+        Archive the jobs not accessed for cold_age seconds into one zip file each
+        return number of archived jobs
+        '''
+        with self.__lock:
+            rows = self.__connection.execute('SELECT job_id, accessed FROM jobs WHERE archived=0 AND accessed<?',
+                                             (time.time() - self.__cold_age,)).fetchall()
+        archived = 0
+        for job_id, accessed in rows:
+            path = self.__get_job_path(job_id)
+            if not os.path.isdir(path):
+                continue
+            # the archive is written aside, the job stays readable until it is replaced
+            temp_path = self.__get_archive_path(job_id) + '.tmp'
+            shutil.make_archive(temp_path, 'zip', path)
+            temp_path += ARCHIVE_EXTENSION
+            with self.__lock:
+                row = self.__connection.execute('SELECT accessed FROM jobs WHERE job_id=?', (job_id,)).fetchone()
+                opened = row is None or row[0] != accessed
+                if not opened:
+                    os.replace(temp_path, self.__get_archive_path(job_id))
+                    removed_path = self.__move_aside(path)
+                    with self.__connection:
+                        self.__connection.execute('UPDATE jobs SET archived=1, size=? WHERE job_id=?', (_get_size(self.__get_archive_path(job_id)), job_id))
+            if opened:
+                os.remove(temp_path)
+                continue
+            shutil.rmtree(removed_path, ignore_errors=True)
+            archived += 1
+        if archived > 0:
+            logger.info(f'Archived {archived} jobs in the results store')
+        return archived
+
+
+    def __move_aside(self, path):
+        '''
+        Rename a job directory to be removed outside of the lock, so the job can be extracted again meanwhile
+        return the new path
+        '''
+        removed_path = f'{path}.{uuid.uuid4().hex}.removed'
+        try:
+            os.rename(path, removed_path)
+        except FileNotFoundError:
+            pass
+        return removed_path
+
+
+    def evict(self):
+        '''
+        Remove the least recently used jobs until the store is within its budget, jobs accessed in the last
+        min_age seconds are kept. The files are deleted outside of the lock
+        return number of removed jobs
+        '''
+        removed_paths = []
+        with self.__lock:
+            total = self.__get_total_size()
+            if total <= self.__budget:
+                return 0
+            rows = self.__connection.execute('SELECT job_id, size FROM jobs WHERE accessed<? ORDER BY accessed',
+                                             (time.time() - self.__min_age,)).fetchall()
+            for job_id, size in rows:
+                if total <= self.__budget:
+                    break
+                removed_paths.append(self.__move_aside(self.__get_job_path(job_id)))
+                if os.path.exists(self.__get_archive_path(job_id)):
+                    os.remove(self.__get_archive_path(job_id))
+                with self.__connection:
+                    self.__connection.execute('DELETE FROM jobs WHERE job_id=?', (job_id,))
+                total -= size
+        for path in removed_paths:
+            shutil.rmtree(path, ignore_errors=True)
+        if len(removed_paths) > 0:
+            logger.info(f'Evicted {len(removed_paths)} jobs from the results store, {total} bytes in use')
+        return len(removed_paths)
+
+
+    def maintain(self):
+        '''
+        Archive cold jobs and enforce the budget, to be called periodically by the web service
+        '''
+        self.compact()
+        self.evict()
+
+
+    def __get_total_size(self):
+        return self.__connection.execute('SELECT COALESCE(SUM(size), 0) FROM jobs').fetchone()[0]
+
+
+    def get_total_size(self):
+        with self.__lock:
+            return self.__get_total_size()
@@ -0,0 +1,92 @@
+import os
+import io
+import logging
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.csv as pyarrow_csv
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger('peeling')
+
+TABLE_FORMATS = {
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.feather': 'feather',
+    '.arrow': 'feather',
+}
+
+
+def get_table_format(filename):
+    '''
+    return 'parquet' or 'feather' by the file extension, 'tsv' otherwise
+    '''
+    return TABLE_FORMATS.get(os.path.splitext(str(filename))[1].lower(), 'tsv')
+
+
+def read_table(source, table_format=None, numeric=False):
+    '''
+    Read a tab delimited, Parquet or Feather table with a header line
+    source: file path or binary file-like object
+    table_format: 'tsv', 'parquet' or 'feather', by the file extension of source if None
+    numeric: the first column holds ids and all others are numbers, e.g. mass spec data. The types are given
+    to the parser up front, so the data doesn't need to be converted after reading
+    '''
+    if table_format is None:
+        table_format = get_table_format(source)
+    if table_format in ('parquet', 'feather'):
+        if pyarrow is None:
+            raise ImportError(f'pyarrow is required to read {table_format} files, install it with: pip install peeling[arrow]')
+        df = pd.read_parquet(source) if table_format == 'parquet' else pd.read_feather(source)
+        if numeric and len(df.columns) > 0:
+            # ids as strings, nulls are kept so that they are dropped by the data check
+            ids = df[df.columns[0]]
+            df[df.columns[0]] = ids.astype(str).where(ids.notna())
+        return df
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    if numeric and pyarrow is not None:
+        return _read_tsv_pyarrow(source)
+    return _read_tsv_pandas(source, numeric)
+
+
+def _read_header(source):
+    if hasattr(source, 'seek'):
+        position = source.tell()
+        header = pd.read_table(source, sep='\t', header=0, nrows=0).columns
+        source.seek(position)
+        return header
+    return pd.read_table(source, sep='\t', header=0, nrows=0).columns
+
+
+def _read_tsv_pandas(source, numeric):
+    if not numeric:
+        return pd.read_table(source, sep='\t', header=0)
+    header = _read_header(source)
+    dtype = {col: 'float64' for col in header[1:]}
+    dtype[header[0]] = str
+    position = source.tell() if hasattr(source, 'seek') else None
+    try:
+        return pd.read_table(source, sep='\t', header=0, dtype=dtype)
+    except ValueError as e:
+        # non-numeric values are reported by the data check after reading
+        logger.debug(f'Reading with numeric types failed ({e}), types are inferred')
+        if position is not None:
+            source.seek(position)
+        return pd.read_table(source, sep='\t', header=0)
+
+
+def _read_tsv_pyarrow(source):
+    '''
+    Multithreaded parsing with pyarrow, ids are kept as strings and the other column types are inferred
+    '''
+    header = _read_header(source)
+    column_types = {header[0]: pyarrow.string()}
+    table = pyarrow_csv.read_csv(
+        source,
+        parse_options=pyarrow_csv.ParseOptions(delimiter='\t'),
+        convert_options=pyarrow_csv.ConvertOptions(column_types=column_types),
+    )
+    return table.to_pandas()
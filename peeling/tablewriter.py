@@ -0,0 +1,45 @@
+import os
+import logging
+import pandas as pd
+from peeling.tablereader import pyarrow
+
+logger = logging.getLogger('peeling')
+
+OUTPUT_FORMATS = ['tsv', 'parquet', 'feather']
+COLUMNAR_EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather'}
+INTEGER_COLUMNS = ['Length']
+
+
+def check_output_format(output_format):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Output format should be one of {", ".join(OUTPUT_FORMATS)}')
+    if output_format in COLUMNAR_EXTENSIONS and pyarrow is None:
+        raise ImportError(f'pyarrow is required to write {output_format} files, install it with: pip install peeling[arrow]')
+
+
+def write_columnar(df, path, output_format):
+    '''
+    Write df as a Parquet or Feather file, path is without the file extension
+    Integer columns holding missing values are stored as nullable integers instead of floats
+    return the path of the file
+    '''
+    df = df.reset_index(drop=True)
+    for col in INTEGER_COLUMNS:
+        if col in df.columns and pd.api.types.is_float_dtype(df[col]):
+            df[col] = df[col].astype('Int64')
+    path = path + COLUMNAR_EXTENSIONS[output_format]
+    if output_format == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_feather(path)
+    logger.debug(f'Saved {path}')
+    return path
+
+
+def write_table(df, tsv_path, output_format='tsv'):
+    '''
+    Write df as a tab delimited file, and a Parquet or Feather version next to it if output_format is one of them
+    '''
+    df.to_csv(tsv_path, sep='\t', index=False)
+    if output_format in COLUMNAR_EXTENSIONS:
+        write_columnar(df, os.path.splitext(tsv_path)[0], output_format)
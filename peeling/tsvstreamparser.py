@@ -0,0 +1,70 @@
+import zlib
+import csv
+import logging
+import pandas as pd
+
+logger = logging.getLogger('peeling')
+
+
+class TsvStreamParser:
+    '''
+    Parse paginated TSV results chunk by chunk into column buffers. Every page starts with the
+    header line and may be gzip compressed on its own, only the current page's partial line is
+    held besides the columns parsed so far
+    '''
+    def __init__(self, compressed=True):
+        self.__compressed = compressed
+        self.__columns = None
+        self.__buffers = None
+        self.__decompressor = None
+        self.__partial = b''
+        self.__header_pending = False
+
+
+    def start_page(self):
+        if self.__compressed:
+            self.__decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.__partial = b''
+        self.__header_pending = True
+
+
+    def feed(self, chunk):
+        if self.__compressed:
+            chunk = self.__decompressor.decompress(chunk)
+        lines = (self.__partial + chunk).split(b'\n')
+        self.__partial = lines.pop()
+        self.__parse_lines(lines)
+
+
+    def end_page(self):
+        if self.__compressed:
+            lines = (self.__partial + self.__decompressor.flush()).split(b'\n')
+        else:
+            lines = [self.__partial]
+        self.__partial = b''
+        self.__parse_lines(lines)
+
+
+    def __parse_lines(self, lines):
+        lines = [line.decode('utf-8') for line in lines if line]
+        if len(lines) == 0:
+            return
+        reader = csv.reader(lines, delimiter='\t', quotechar='"')
+        if self.__header_pending:
+            header = next(reader)
+            self.__header_pending = False
+            if self.__columns is None:
+                self.__columns = header
+                self.__buffers = [[] for _ in header]
+        num_columns = len(self.__columns)
+        for row in reader:
+            if len(row) < num_columns:
+                row = row + [None] * (num_columns - len(row))
+            for buffer, value in zip(self.__buffers, row):
+                buffer.append(value)
+
+
+    def to_data_frame(self):
+        if self.__columns is None:
+            return pd.DataFrame()
+        return pd.DataFrame(dict(zip(self.__columns, self.__buffers)), columns=self.__columns)
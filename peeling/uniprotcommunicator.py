@@ -1,14 +1,19 @@
 import re
 from datetime import datetime
-import zlib
 from urllib.parse import urlparse, parse_qs, urlencode
 import httpx
 import asyncio
-import csv
 import pandas as pd
+import numpy as np
 from abc import ABC, abstractmethod
 import logging
 from peeling.cellular_compartments import cellular_compartments
+from peeling.tsvstreamparser import TsvStreamParser
+from peeling.idmappingscheduler import IdMappingScheduler
+from peeling.jobpoller import JobPoller
+from peeling.referencebundle import ReferenceBundle
+from peeling.referenceindex import ReferenceIndex
+from peeling.httpclientregistry import get_client_registry, UNIPROT_CLIENT
 
 logger = logging.getLogger('peeling')
 
@@ -19,43 +24,54 @@ logger = logging.getLogger('peeling')
 TIME_OUT = 600
 MAX_KEEPALIVE_CONNECTIONS=10
 MAX_CONNECTIONS=15
+KEEPALIVE_EXPIRY = 60 # seconds an idle connection is kept open for the next stage or request
 CONNECT_RETRY = 5
-MAX_CHECK_RETRY = 10
-POLLING_INTERVAL = 5
 API_URL = "https://rest.uniprot.org"
 
-CHUNK_SIZE = 2000 #TODO: tune CHUNK_SIZE
+
+async def _check_response(response):
+    # the body is only read here for errors, so that result pages can be streamed
+    try:
+        if response.status_code == 303:
+            return
+        response.raise_for_status()
+    except httpx.HTTPStatusError:
+        await response.aread()
+        logger.info(response.text)
+        raise
+
+
+def _create_client():
+    limits = httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS, max_connections=MAX_CONNECTIONS, keepalive_expiry=KEEPALIVE_EXPIRY)
+    transport = httpx.AsyncHTTPTransport(retries=CONNECT_RETRY)
+    return httpx.AsyncClient(http2=True, timeout=TIME_OUT, limits=limits, transport=transport, event_hooks={'response': [_check_response]})
+
 
 class UniProtCommunicator(ABC):
-    def __init__(self, cache=False, cellular_compartment='cs'):
+    def __init__(self, cache=False, cellular_compartment='cs', stream=False, api_url=API_URL, bundle=None):
+        '''
+        bundle: path of a reference bundle built by peeling-bundle, annotations are read from it instead of UniProt
+        '''
         self.__save = cache
-        self.__client = None
+        self.__bundle = bundle
+        self.__stream = stream
+        self.__api_url = api_url
+        self.__poller = JobPoller(self.__check_id_mapping_job)
         self._annotation_true_positive = None
         self._annotation_false_positive = None
+        self.__reference_indexes = {}
         self.__cellular_compartment = cellular_compartments.get(cellular_compartment, None)
         self._cc_code = cellular_compartment
 
 
-    def __create_client(self):
-        limits = httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS, max_connections=MAX_CONNECTIONS)
-        transport = httpx.AsyncHTTPTransport(retries=CONNECT_RETRY)
-        self.__client = httpx.AsyncClient(http2=True, timeout=TIME_OUT, limits=limits, transport=transport, event_hooks={'response': [self.__check_response]})
-
-
-    async def __check_response(self, response):
-        try:
-            await response.aread()
-            if response.status_code == 303:
-                return
-            response.raise_for_status()
-        except httpx.HTTPStatusError:
-            logger.info(response.json())
-            raise
+    def __get_client(self):
+        # shared by all communicators of the event loop, and kept open between stages
+        return get_client_registry().get_client(UNIPROT_CLIENT, _create_client)
 
 
     async def __submit_id_mapping(self, ids):
-        response = await self.__client.post(
-            f"{API_URL}/idmapping/run",
+        response = await self.__get_client().post(
+            f"{self.__api_url}/idmapping/run",
             data={"from": 'UniProtKB_AC-ID', "to": 'UniProtKB', "ids": ",".join(ids)},
         )
         return response.json()["jobId"]
@@ -69,35 +85,25 @@ class UniProtCommunicator(ABC):
                 return match.group(1)
 
 
-    async def __check_id_mapping_results_ready(self, job_id):
-        trial = 0
-        while trial < MAX_CHECK_RETRY:
-            trial += 1
-            response = await self.__client.get(f"{API_URL}/idmapping/status/{job_id}")
-            if response.status_code == 303:
-                return response.headers.get('location')
-            j = response.json()
-            if "jobStatus" in j:
-                if j["jobStatus"] == "RUNNING":
-                    logger.debug(f"{job_id}: Retrying in {POLLING_INTERVAL}s")
-                    await asyncio.sleep(POLLING_INTERVAL)
-                else:
-                    raise Exception(j["jobStatus"])
-            else:
-                return bool(j["results"] or j["failedIds"])
-        raise Exception('Reach max trials for check job status')
-
-
-    async def __get_batch(self, batch_response, compressed):
-        batch_url = self.__get_next_link(batch_response.headers)
-        while batch_url:
-            batch_response = await self.__client.get(batch_url)
-            yield self.__decode_results(batch_response, compressed)
-            batch_url = self.__get_next_link(batch_response.headers)
+    async def __check_id_mapping_job(self, job_id):
+        '''
+        return the results link of a finished job, None if the job is still running
+        '''
+        response = await self.__get_client().get(f"{self.__api_url}/idmapping/status/{job_id}")
+        if response.status_code == 303:
+            return response.headers.get('location')
+        j = response.json()
+        if "jobStatus" in j:
+            if j["jobStatus"] in ("NEW", "RUNNING"):
+                return None
+            raise Exception(j["jobStatus"])
+        # finished, but the status is returned without redirect
+        return f"{self.__api_url}/idmapping/uniprotkb/results/{job_id}"
 
 
-    def __combine_batches(self, all_results, batch_results):
-        return all_results + batch_results[1:]
+    async def __check_id_mapping_results_ready(self, job_id):
+        # all jobs of this communicator share one polling loop
+        return await self.__poller.wait(job_id)
 
 
     # async def __get_id_mapping_results_link(self, job_id):
@@ -106,12 +112,20 @@ class UniProtCommunicator(ABC):
     #     return response.json()["redirectURL"]
 
 
-    def __decode_results(self, response, compressed):
-        if compressed:
-            decompressed = zlib.decompress(response.content, 16 + zlib.MAX_WBITS)
-            return [line for line in decompressed.decode("utf-8").split("\n") if line]
-        else:
-            return [line for line in response.text.split("\n") if line]
+    async def __get_results_search(self, url, compressed):
+        '''
+        Follow the pagination links from url, each page is decompressed and parsed as it streams in
+        return df
+        '''
+        parser = TsvStreamParser(compressed)
+        while url:
+            async with self.__get_client().stream('GET', url) as response:
+                parser.start_page()
+                async for chunk in response.aiter_bytes():
+                    parser.feed(chunk)
+                parser.end_page()
+                url = self.__get_next_link(response.headers)
+        return parser.to_data_frame()
 
 
     async def __get_id_mapping_results_search(self, url):
@@ -125,59 +139,76 @@ class UniProtCommunicator(ABC):
         query['compressed'] = compressed
         parsed = parsed._replace(query=urlencode(query, doseq=True))
         url = parsed.geturl()
-        response = await self.__client.get(url)
-        results = self.__decode_results(response, compressed)
-        async for batch in self.__get_batch(response, compressed):
-            results = self.__combine_batches(results, batch)
-        return results
+        return await self.__get_results(url, compressed)
 
 
     async def __get_annotation_results_search(self, url):
         logger.debug(f'fetching data from: {url}')
-        response = await self.__client.get(url)
-        results = self.__decode_results(response, True)
-        async for batch in self.__get_batch(response, True):
-            results = self.__combine_batches(results, batch)
-        return results
+        return await self.__get_results(url, True)
 
 
-    def __get_data_frame_from_tsv_results(self, tsv_results):
-        reader = csv.DictReader(tsv_results, delimiter="\t", quotechar='"')
-        return pd.DataFrame(list(reader))
+    def __rebase_url(self, url):
+        '''
+        Point url to the configured api_url, e.g. a local stand-in server
+        '''
+        parsed = urlparse(url)
+        api = urlparse(self.__api_url)
+        return parsed._replace(scheme=api.scheme, netloc=api.netloc).geturl()
 
 
-    async def _retrieve_latest_id(self, old_ids, meta):
-        start_time = datetime.now()
+    def __get_stream_url(self, url):
+        '''
+        Turn a paginated search or id mapping results url into the corresponding /stream url
+        .../uniprotkb/search?... -> .../uniprotkb/stream?...
+        .../idmapping/uniprotkb/results/{job_id}?... -> .../idmapping/uniprotkb/results/stream/{job_id}?...
+        '''
+        parsed = urlparse(url)
+        path = parsed.path
+        if path.endswith('/search'):
+            path = path[:-len('/search')] + '/stream'
+        elif '/results/' in path and '/results/stream/' not in path:
+            path = path.replace('/results/', '/results/stream/', 1)
+        query = parse_qs(parsed.query)
+        query.pop('size', None)
+        query.pop('cursor', None)
+        return parsed._replace(path=path, query=urlencode(query, doseq=True)).geturl()
+
+
+    async def __get_results(self, url, compressed):
+        '''
+        In stream mode the whole result set is pulled in one request, with pagination as fallback
+        '''
+        url = self.__rebase_url(url)
+        if self.__stream:
+            stream_url = self.__get_stream_url(url)
+            try:
+                logger.debug(f'streaming data from: {stream_url}')
+                return await self.__get_results_search(stream_url, compressed)
+            except Exception as e:
+                logger.info(f'Streaming failed ({e}), falling back to pagination')
+        return await self.__get_results_search(url, compressed)
 
-        if self.__client is None:
-            self.__create_client()
 
+    async def _retrieve_latest_id(self, old_ids, meta):
+        start_time = datetime.now()
         try:
-            # divide old_ids into chunks
-            num_chunks = len(old_ids) // CHUNK_SIZE
-            residual = len(old_ids) % CHUNK_SIZE
-            num_chunks += 1 if residual>0 else 0
-            chunks = [old_ids[CHUNK_SIZE*i:CHUNK_SIZE*(i+1)] if i<(num_chunks-1) else old_ids[CHUNK_SIZE*i:] for i in range(num_chunks)]
-            logger.info(f'{len(old_ids)} ids are divided into {num_chunks} chunks with size {CHUNK_SIZE}')
             logger.info('Communicating with UniProt for id mapping...')
+            # chunk size and concurrency are decided by the scheduler, failed chunks are retried in halves
+            scheduler = IdMappingScheduler(self.__retrieve_latest_id_chunk)
+            results_list, failed_id_list = await scheduler.run(old_ids)
 
-            results_list = await asyncio.gather(*map(self.__retrieve_latest_id_chunk, chunks))
-
-            failed_ids = 0
+            failed_ids = len(failed_id_list)
             no_mapping_ids_set = set()
             retrieved_ids = 0
             results_list_filtered = []
-            for i, item in enumerate(results_list): #item may be list df or integer (len(chunk)) if mapping failed
-                if isinstance(item, int):
-                    failed_ids += item
-                else:
-                    retrieved_ids += len(item)
-                    results_list_filtered.append(item)
-                    if len(chunks[i]) > len(item): # there are ids that didn't find mapping data
-                        if len(item)>0:
-                            no_mapping_ids_set = no_mapping_ids_set.union(set(chunks[i]).difference(set(item.iloc[:, 0])))
-                        else: #all ids in this chunk didn't find mapping data
-                            no_mapping_ids_set = no_mapping_ids_set.union(set(chunks[i]))
+            for chunk, item in results_list:
+                retrieved_ids += len(item)
+                results_list_filtered.append(item)
+                if len(chunk) > len(item): # there are ids that didn't find mapping data
+                    if len(item)>0:
+                        no_mapping_ids_set = no_mapping_ids_set.union(set(chunk).difference(set(item.iloc[:, 0])))
+                    else: #all ids in this chunk didn't find mapping data
+                        no_mapping_ids_set = no_mapping_ids_set.union(set(chunk))
 
             meta['failed_id_mapping'] = failed_ids
             meta['no_id_mapping'] = no_mapping_ids_set
@@ -187,10 +218,18 @@ class UniProtCommunicator(ABC):
             return pd.concat(results_list_filtered)
         except Exception:
             raise
-        finally:
-            if self.__client is not None:
-                await self.__client.aclose()
-                self.__client = None
+
+
+    def _add_no_mapping_ids(self, retrieved_data, meta):
+        # add ids that didn't find mapping data to the retrieved data, all fields are NaN
+        no_mapping_ids = meta['no_id_mapping']
+        if len(no_mapping_ids) > 0:
+            no_mapping_ids = pd.DataFrame(list(no_mapping_ids), columns = ['From'])
+            for col in retrieved_data.columns[1:]:
+                no_mapping_ids[col] = np.NaN
+            retrieved_data = pd.concat([retrieved_data, no_mapping_ids])
+            logger.debug(f'\n{no_mapping_ids.head()}')
+        return retrieved_data
 
 
     async def __retrieve_latest_id_chunk(self, chunk):
@@ -200,17 +239,16 @@ class UniProtCommunicator(ABC):
             #     link = await self.__get_id_mapping_results_link(job_id)
                 # print(f'slow link: {link}')
             link = await self.__check_id_mapping_results_ready(job_id)
-            results = await self.__get_id_mapping_results_search(link)
-            results_df = self.__get_data_frame_from_tsv_results(results)
-            if len(results_df)>0:
-                results_df.drop(['Entry Name', 'Reviewed'], axis=1, inplace=True)
+            results_df = await self.__get_id_mapping_results_search(link)
+            # also for a header-only page, so that all chunks have the same columns
+            results_df = results_df.drop(columns=['Entry Name', 'Reviewed'], errors='ignore')
             logger.debug(f'retrieved: {len(results_df)}')
             # if not self.__save and len(results_df)>0:
             #     results_df = results_df[['From', 'Entry']]
             return results_df
         except Exception as e:
             logger.error(e)
-            return len(chunk)
+            raise
 
 
     @abstractmethod
@@ -243,7 +281,6 @@ class UniProtCommunicator(ABC):
             logger.info('Retrieving annotation_true_positive file from UniProt...')
             url = self.__get_uniprot_url('true_positive')
             results = await self.__get_annotation_results_search(url)
-            results = self.__get_data_frame_from_tsv_results(results)
             logger.info(f'Retrieved {len(results)} entries for annotation_true_positive')
             self._annotation_true_positive = results
         except Exception as e:
@@ -257,7 +294,6 @@ class UniProtCommunicator(ABC):
             logger.info('Retrieving annotation_false_positive file from UniProt...')
             url = self.__get_uniprot_url('false_positive')
             results = await self.__get_annotation_results_search(url)
-            results = self.__get_data_frame_from_tsv_results(results)
             logger.info(f'Retrieved {len(results)} entries for annotation_false_positive')
             self._annotation_false_positive = results
         except Exception as e:
@@ -268,9 +304,6 @@ class UniProtCommunicator(ABC):
 
     async def _retrieve_annotation(self):
         start_time = datetime.now()
-
-        if self.__client is None:
-            self.__create_client()
         try:
             await asyncio.gather(self.__retrieve_annotation_true_positive(), self.__retrieve_annotation_false_positive())
             if not self.__save:
@@ -278,14 +311,24 @@ class UniProtCommunicator(ABC):
             logger.info(f'{datetime.now()-start_time} for retrieving annotations')
         except Exception:
             raise
-        finally:
-            if self.__client is not None:
-                await self.__client.aclose()
-                self.__client = None
+
+
+    def __load_bundle(self):
+        start_time = datetime.now()
+        bundle = ReferenceBundle(self.__bundle)
+        if bundle.get_cc_code() != self._cc_code:
+            raise Exception(f'{self.__bundle} is built for {bundle.get_cc_code()}, not {self._cc_code}')
+        self._annotation_true_positive = bundle.get_annotation('true_positive')
+        self._annotation_false_positive = bundle.get_annotation('false_positive')
+        logger.info(f'Read in {len(self._annotation_true_positive)} true positive and {len(self._annotation_false_positive)} false positive entries from {self.__bundle} (created {bundle.get_created()}, {bundle.get_age().days} days ago, from {bundle.get_source()})')
+        logger.debug(f'{datetime.now()-start_time} for loading the bundle')
 
 
     async def get_annotation(self, type):
         if self._annotation_true_positive is None or self._annotation_false_positive is None:
+            if self.__bundle is not None:
+                self.__load_bundle()
+            else:
                 await self._retrieve_annotation()
         if type=='true_positive':
             return self._annotation_true_positive
@@ -293,6 +336,18 @@ class UniProtCommunicator(ABC):
             return self._annotation_false_positive
 
 
+    async def get_reference_index(self, type):
+        '''
+        return ReferenceIndex of the annotation, rebuilt only when the annotation is replaced
+        '''
+        annotation = await self.get_annotation(type)
+        cached = self.__reference_indexes.get(type)
+        if cached is None or cached[0] is not annotation:
+            cached = (annotation, ReferenceIndex(annotation))
+            self.__reference_indexes[type] = cached
+        return cached[1]
+
+
     def __shorten_annotation(self):
         self._annotation_true_positive = self._annotation_true_positive[['Entry']]
         self._annotation_false_positive = self._annotation_false_positive[['Entry']]
@@ -1,17 +1,25 @@
 from abc import ABC, abstractmethod
 import logging
 import matplotlib.pyplot as plt
+from peeling.tablewriter import OUTPUT_FORMATS
 
 logger = logging.getLogger('peeling')
 
 
 class UserInputReader(ABC):
-    def __init__(self, num_controls, num_replicates, tolerance, plot_format, cellular_compartment):
+    def __init__(self, num_controls, num_replicates, tolerance, plot_format, cellular_compartment, jobs=1, defer_plots=False, tolerance_sweep=False, output_format='tsv'):
         self.__num_controls = num_controls
         self.__num_replicates = num_replicates
         self.__tolerance = tolerance
         self.__plot_format = plot_format
-        self.__cellular_compartment = 'cs' if cellular_compartment is None else cellular_compartment
+        # several compartments can be analyzed in one run, sharing the id mapping and the sort orders
+        if cellular_compartment is None:
+            cellular_compartment = 'cs'
+        self.__cellular_compartments = [cellular_compartment] if isinstance(cellular_compartment, str) else list(cellular_compartment)
+        self.__jobs = jobs
+        self.__defer_plots = defer_plots
+        self.__tolerance_sweep = tolerance_sweep
+        self.__output_format = output_format
         self.__check_init()
 
 
@@ -21,6 +29,10 @@ class UserInputReader(ABC):
             assert(self.__num_replicates >= 1), '# Replicates should be a positive integer'
             assert(self.__tolerance >= 0 and self.__tolerance <= self.__num_controls*self.__num_replicates), 'Tolerance should be an integer in [0, #controls * #replicates)'
             assert(self.__plot_format in set(plt.gcf().canvas.get_supported_filetypes().keys())), 'The plot format is invalid'
+            assert(self.__jobs >= 1), '# Jobs should be a positive integer'
+            assert(self.__output_format in OUTPUT_FORMATS), f'The output format should be one of {", ".join(OUTPUT_FORMATS)}'
+            assert(len(self.__cellular_compartments) >= 1), 'At least one cellular compartment should be given'
+            assert(len(set(self.__cellular_compartments)) == len(self.__cellular_compartments)), 'Cellular compartments should be unique'
         except AssertionError as e:
             logger.error(e)
             raise
@@ -69,4 +81,24 @@ class UserInputReader(ABC):
         return self.__plot_format
 
     def get_cellular_compartment(self):
-        return self.__cellular_compartment
+        return self.__cellular_compartments[0]
+
+
+    def get_cellular_compartments(self):
+        return self.__cellular_compartments
+
+
+    def get_jobs(self):
+        return self.__jobs
+
+
+    def get_defer_plots(self):
+        return self.__defer_plots
+
+
+    def get_tolerance_sweep(self):
+        return self.__tolerance_sweep
+
+
+    def get_output_format(self):
+        return self.__output_format
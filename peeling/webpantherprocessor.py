@@ -1,18 +1,26 @@
+import asyncio
 import logging
 from peeling.pantherprocessor import PantherProcessor
+from peeling.resultsstore import RESULTS_PATH
 
 logger = logging.getLogger('peeling')
 
 
 class WebPantherProcessor(PantherProcessor):
     # overide superclass method
-    def __init__(self, organism_id, unique_id):
+    def __init__(self, organism_id, unique_id, results_store=None, panther_cache=None):
+        '''
+        results_store: ResultsStore of the web jobs, the job is extracted from its archive in start if it is compacted
+        panther_cache: PantherCache shared by the requests, enrichment results of a re-opened job are read from it
+        '''
+        self.__unique_id = unique_id
+        self.__results_store = results_store
         if unique_id is not None and organism_id is not None:
-            path = '../results/' + unique_id + '/results'
-            super().__init__(path)
+            root = results_store.get_root() if results_store is not None else RESULTS_PATH
+            super().__init__(f'{root}/{unique_id}/results', panther_cache)
             self._set_organism_id(organism_id)
         else:
-            super().__init__(None)
+            super().__init__(None, panther_cache)
 
 
     async def retrieve_organisms(self):
@@ -42,6 +50,8 @@ class WebPantherProcessor(PantherProcessor):
     # implement abstract method
     async def start(self):
         try:
+            if self.__results_store is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.__results_store.open_job, self.__unique_id)
             self._write_args()
             self._create_client()
             results_dict = await self._run_enrichment()
@@ -1,24 +1,41 @@
 import os
 #import shutil
 import uuid
+import asyncio
 import logging
-import matplotlib.pyplot as plt
+from itertools import combinations
 import pandas as pd
 from peeling.processor import Processor
+from peeling.curvedata import CurveData, CURVES_FILENAME
+from peeling.tablewriter import write_table
+from peeling.plotrenderer import render_plot, make_line_spec, make_roc_spec, make_scatter_spec, DPI
+from peeling.jobmanifest import JobManifest, save_manifest, save_matrix, MANIFEST_FILENAME
+from peeling.resultsstore import RESULTS_PATH
 
 
 logger = logging.getLogger('peeling')
 
 
 class WebProcessor(Processor):
-    def __init__(self, *args):
+    def __init__(self, *args, job_queue=None, results_store=None, precompute_scatter=False):
+        '''
+        job_queue: JobQueue running the CPU-bound steps of the analysis in its worker threads,
+        the steps run in the event loop if None
+        results_store: ResultsStore tracking the job directories, jobs are kept forever if None
+        precompute_scatter: render the scatter plots of all column pairs in the background once the analysis is done
+        '''
+        self.__results_store = results_store
         if len(args) == 2:
             user_input_reader, uniprot_communicator = args
             super().__init__(user_input_reader, uniprot_communicator)
+            self.__job_queue = job_queue
+            self.__precompute_scatter = precompute_scatter
             self.__uuid = None
             self.__web_plots_path = None
             self.__failed_id_mapping = 0
             self.__true_positive_proteins_raw_data = None
+            self.__snapshots = {}
+            self.__precompute_task = None
         elif len(args) == 3:
             unique_id, x, y = args
             self.__uuid = unique_id
@@ -28,13 +45,31 @@ class WebProcessor(Processor):
             self.__uuid = args[0]
 
 
+    def __get_root(self):
+        '''
+        return directory of the job directories, the root of the results store if there is one
+        '''
+        if self.__results_store is not None:
+            return self.__results_store.get_root()
+        return RESULTS_PATH
+
+
     #override superclass method
     def _mass_data_clean(self, data):
         data = super()._mass_data_clean(data)
-        data.to_csv(f'../results/{self.__uuid}/mass_spec_data.tsv', sep='\t', index=False)
+        data.to_csv(f'{self.__get_root()}/{self.__uuid}/mass_spec_data.tsv', sep='\t', index=False)
+        # binary copy of the ratio columns for the scatter plots
+        save_matrix(f'{self.__get_root()}/{self.__uuid}', data)
         return data
 
 
+    #override superclass method
+    async def _run_blocking(self, function, *args):
+        if self.__job_queue is None:
+            return function(*args)
+        return await self.__job_queue.run_blocking(function, *args)
+
+
     # implement abstract method
     async def _get_id_mapping_data(self, mass_data):
         old_ids = list(mass_data.iloc[:, 0])
@@ -42,31 +77,45 @@ class WebProcessor(Processor):
         new_ids_df = await self._get_uniprot_communicator().get_latest_id(old_ids, meta)
         if 'failed_id_mapping' in meta.keys(): # false if no id needs mapping
             self.__failed_id_mapping = meta['failed_id_mapping']
-        return new_ids_df.copy()
+        return new_ids_df
+
+
+    async def __get_snapshot(self, cellular_compartment=None):
+        '''
+        The reference data snapshot is pinned at its first use, so that the whole job reads one version of it
+        '''
+        if cellular_compartment not in self.__snapshots:
+            self.__snapshots[cellular_compartment] = await self._get_uniprot_communicator(cellular_compartment).get_snapshot()
+        return self.__snapshots[cellular_compartment]
 
 
     # implement abstract method
-    async def _get_annotation_data(self, type):
+    async def _get_annotation_data(self, type, cellular_compartment=None):
         '''
         type: 'true_positive' or 'false_positive'
+        return the annotation of the pinned snapshot, decoded from its int codes
         '''
-        annotation = await self._get_uniprot_communicator().get_annotation(type)
-        annotation.columns = ['Entry']
+        annotation = (await self.__get_snapshot(cellular_compartment)).get_annotation(type)
         logger.debug(f'\n{annotation.head()}')
-        return annotation.copy()
+        return annotation
+
+
+    #override superclass method
+    async def _get_reference_index(self, type, cellular_compartment=None):
+        # the index of the pinned snapshot, the one WebUniProtCommunicator.get_reference_index returns for that version
+        return (await self.__get_snapshot(cellular_compartment)).get_reference_index(type)
 
 
     # implement abstract method
-    def _plot_supplemental(self, fig_name): #plt,
-        plt.savefig(f'{self.__web_plots_path}/{fig_name}.jpeg', dpi=130, bbox_inches='tight')
-        plt.close()
+    def _get_supplemental_outputs(self, fig_name):
+        return [(f'{self.__web_plots_path}/{fig_name}.jpeg', {'dpi': 130, 'bbox_inches': 'tight'})]
 
 
     # implement abstract method
     def _construct_path(self):
         unique_id = str(uuid.uuid4())
         self.__uuid = unique_id
-        parent_path = os.path.join('../results/', unique_id)
+        parent_path = os.path.join(self.__get_root(), unique_id)
         results_path = os.path.join(parent_path, 'results')
         web_plots_path = os.path.join(parent_path, "web_plots")
         self.__web_plots_path = web_plots_path
@@ -82,52 +131,131 @@ class WebProcessor(Processor):
         super()._write_args(path)
         with open(os.path.join(path, 'log.txt'), 'a') as f:
             f.write('Failed id mapping: ' + str(self.__failed_id_mapping) + '\n')
+            for snapshot in self.__snapshots.values():
+                f.write(f'Reference data version: {snapshot.get_version()} ({snapshot.get_created().isoformat(timespec="seconds")})\n')
 
 
     # implement abstract method
     async def start(self):
         data = await self._get_user_input_reader().get_mass_data()
         results_path = self._construct_path()
-        data = self._mass_data_clean(data)
+        data = await self._run_blocking(self._mass_data_clean, data)
         columns = list(data.columns[1:])
         await self._analyze(data, results_path)
-        self.__true_positive_proteins_raw_data.to_csv(f'../results/{self.__uuid}/post-cutoff-proteome_with_raw_data.tsv', sep='\t', index=False)
+        write_table(self.__true_positive_proteins_raw_data, f'{self.__get_root()}/{self.__uuid}/post-cutoff-proteome_with_raw_data.tsv', self._get_user_input_reader().get_output_format())
         self._write_args(results_path)
+        reference_versions = {str(cc): snapshot.get_version() for cc, snapshot in self.__snapshots.items()}
+        save_manifest(f'{self.__get_root()}/{self.__uuid}', self.__uuid, self._get_user_input_reader(), columns, reference_versions)
+        if self.__results_store is not None:
+            # eviction deletes files, off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.__results_store.add_job, self.__uuid)
         logger.info(f'Results saved at {self.__uuid}')
+        if self.__precompute_scatter:
+            self.__precompute_task = asyncio.create_task(self.__precompute_scatter_plots())
         return  self.__uuid, self.__failed_id_mapping, columns
 
 
+    async def __precompute_scatter_plots(self):
+        # in a worker of the job queue, so the rendering counts against its workers like the analyses do
+        try:
+            if self.__job_queue is not None:
+                await self.__job_queue.run_blocking(self.precompute_scatter_plots)
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, self.precompute_scatter_plots)
+        except Exception as e:
+            logger.error(f'Precomputing the scatter plots of {self.__uuid} failed: {e}')
+
+
+    def get_precompute_task(self):
+        '''
+        return the asyncio task rendering the scatter plots in the background, None if they are not precomputed
+        '''
+        return self.__precompute_task
+
+
+    def __open_job(self):
+        '''
+        return path of the job directory, extracted from its archive if the results store has compacted it.
+        Blocking, the *_async variants of the public methods run it in an executor
+        '''
+        if self.__results_store is not None:
+            return self.__results_store.open_job(self.__uuid)
+        return f'{self.__get_root()}/{self.__uuid}'
+
+
+    def __get_manifest(self, parent_path):
+        '''
+        return JobManifest of the job, None for jobs run before manifests were written
+        '''
+        if os.path.exists(f'{parent_path}/{MANIFEST_FILENAME}'):
+            return JobManifest(parent_path)
+        return None
+
+
+    def __get_plot_format(self, parent_path, manifest):
+        if manifest is not None:
+            return manifest.get_plot_format()
+        return self.__get_format_from_log(f'{parent_path}/results')
+
+
+    def __render_scatter(self, parent_path, manifest, x, y, legacy_data=None):
+        '''
+        Render the scatter plot of columns x and y unless it is already rendered
+        return path of the web plot
+        '''
+        fig_name = f'Correlation {x} vs {y}'.replace(' ', '_')
+        web_plot = f'{parent_path}/web_plots/{fig_name}.jpeg'
+        results_plot = f'{parent_path}/results/plots/{fig_name}.{self.__get_plot_format(parent_path, manifest)}'
+        if os.path.exists(web_plot) and os.path.exists(results_plot):
+            return web_plot
+        if manifest is not None:
+            x_values, y_values = manifest.get_column(x), manifest.get_column(y)
+        else:
+            if legacy_data is None:
+                legacy_data = pd.read_table(f'{parent_path}/mass_spec_data.tsv', sep='\t', header=0)
+            x_values, y_values = legacy_data[x].to_numpy(), legacy_data[y].to_numpy()
+        outputs = [(results_plot, {'dpi': DPI}), (web_plot, {'dpi': DPI})]
+        render_plot(make_scatter_spec(x_values, y_values, x, y, fig_name, outputs))
+        return web_plot
+
+
     def plot_scatter(self):
+        '''
+        Scatter plot of the columns x and y, rendered once and served from the web plots afterwards.
+        Blocking, may extract the job archive and render the plot
+        return path of the web plot
+        '''
         try:
-            parent_path = f'../results/{self.__uuid}'
-            results_path = f'{parent_path}/results'
-            results_plot_path = f'{parent_path}/results/plots'
-            data_path = f'{parent_path}/mass_spec_data.tsv'
-            web_plot_path = f'{parent_path}/web_plots'
-            plot_format = self.__get_format_from_log(results_path)
-
-            data = pd.read_table(data_path, sep='\t', header=0)
-
-            corr = data[self.__x].corr(data[self.__y])
-            # lower_bound = min(data[self.__x].min(), data[self.__y].min())-0.5
-            # upper_bound = max(data[self.__x].max(), data[self.__y].max())+0.5
-            # print(lower_bound, upper_bound)
-
-            fig, ax = plt.subplots()
-            ax.scatter(data[self.__x], data[self.__y], linewidths=0.5, edgecolors='white') #
-            # ax.set_xlim(lower_bound, upper_bound)
-            # ax.set_ylim(lower_bound, upper_bound)
-            ax.set_aspect('equal')
-            ax.annotate('Pearson r='+str(round(corr,3)), (ax.get_xlim()[0]+0.5, ax.get_ylim()[1]-1))
-            ax.spines[['right', 'top']].set_visible(False)
-            plt.xlabel(self.__x)
-            plt.ylabel(self.__y)
-            title = f'Correlation {self.__x} vs {self.__y}'
-            plt.title(title)
-            title = title.replace(" ", "_")
-            plt.savefig(f'{results_plot_path}/{title}.{plot_format}', dpi=130)
-            plt.savefig(f'{web_plot_path}/{title}.jpeg', dpi=130)
-            plt.close()
+            parent_path = self.__open_job()
+            return self.__render_scatter(parent_path, self.__get_manifest(parent_path), self.__x, self.__y)
+        except Exception as e:
+            logger.error(e)
+            raise
+
+
+    async def plot_scatter_async(self):
+        '''
+        plot_scatter in an executor, for callers running in the event loop
+        '''
+        return await asyncio.get_running_loop().run_in_executor(None, self.plot_scatter)
+
+
+    def precompute_scatter_plots(self):
+        '''
+        Render the scatter plots of all column pairs (x before y in the column order) that are not rendered yet
+        '''
+        try:
+            parent_path = self.__open_job()
+            manifest = self.__get_manifest(parent_path)
+            legacy_data = None
+            if manifest is not None:
+                columns = manifest.get_columns()
+            else:
+                legacy_data = pd.read_table(f'{parent_path}/mass_spec_data.tsv', sep='\t', header=0)
+                columns = list(legacy_data.columns[1:])
+            for x, y in combinations(columns, 2):
+                self.__render_scatter(parent_path, manifest, x, y, legacy_data)
+            logger.info(f'Scatter plots of {self.__uuid} are rendered')
         except Exception as e:
             logger.error(e)
             raise
@@ -136,14 +264,77 @@ class WebProcessor(Processor):
     def __get_format_from_log(self, results_path):
         try:
             with open(f'{results_path}/log.txt', 'r') as f:
-                format_line = f.readlines()[4]
-                if format_line.find('Plot format') != -1:
-                    format_line = format_line.strip()
-                return format_line[13:]
+                for line in f:
+                    if line.startswith('Plot format: '):
+                        return line.strip()[13:]
+            raise Exception('Plot format is not found in log.txt')
+        except Exception as e:
+            logger.error(e)
+            raise
+
+
+    def __get_curve_data(self):
+        return CurveData(f'{self.__open_job()}/results/{CURVES_FILENAME}')
+
+
+    def get_curve_data(self, column, max_points=1000):
+        '''
+        TPR/FPR curve, cut-off point and AUC of a ratio column, for client-side charts of jobs run with deferred plots.
+        Blocking, may extract the job archive
+        '''
+        try:
+            return self.__get_curve_data().to_dict(column, max_points)
+        except Exception as e:
+            logger.error(e)
+            raise
+
+
+    async def get_curve_data_async(self, column, max_points=1000):
+        '''
+        get_curve_data in an executor, for callers running in the event loop
+        '''
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_curve_data, column, max_points)
+
+
+    def get_plot(self, fig_name):
+        '''
+        Return the path of the web plot fig_name (TPR_FPR_<column> or ROC_<column>), rendering it from the
+        curve data the first time it is requested. Blocking, may extract the job archive and render the plot
+        '''
+        try:
+            parent_path = self.__open_job()
+            web_plot = f'{parent_path}/web_plots/{fig_name}.jpeg'
+            if os.path.exists(web_plot):
+                return web_plot
+
+            results_path = f'{parent_path}/results'
+            plot_format = self.__get_plot_format(parent_path, self.__get_manifest(parent_path))
+            outputs = [
+                (f'{results_path}/plots/{fig_name}.{plot_format}', {'dpi': 130}),
+                (web_plot, {'dpi': 130, 'bbox_inches': 'tight'})
+            ]
+            if fig_name.startswith('TPR_FPR_'):
+                curve = self.__get_curve_data().get_curve(fig_name[len('TPR_FPR_'):])
+                spec = make_line_spec(curve['tpr'], curve['fpr'], fig_name, outputs)
+            elif fig_name.startswith('ROC_'):
+                curve = self.__get_curve_data().get_curve(fig_name[len('ROC_'):])
+                spec = make_roc_spec(curve['tpr'], curve['fpr'], curve['cut_off_pos'], curve['cutoff_protein_id'], fig_name, outputs)
+            else:
+                raise Exception(f'{fig_name} can not be rendered on demand')
+            render_plot(spec)
+            logger.info(f'{fig_name} rendered on demand')
+            return web_plot
         except Exception as e:
             logger.error(e)
             raise
 
 
+    async def get_plot_async(self, fig_name):
+        '''
+        get_plot in an executor, for callers running in the event loop
+        '''
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_plot, fig_name)
+
+
     def _set_true_positive_proteins_raw_data(self, df):
         self.__true_positive_proteins_raw_data = df
@@ -1,70 +1,124 @@
 import pandas as pd
-import numpy as np
 from datetime import datetime
 import logging
 import os
-from peeling.uniprotcommunicator import UniProtCommunicator
+from peeling.uniprotcommunicator import UniProtCommunicator, API_URL
+from peeling.referencestore import ReferenceStore
+from peeling.referencesnapshot import ReferenceSnapshot
 
 logger = logging.getLogger('peeling')
 
 
+RETRIEVED_DATA_PATH = '../retrieved_data'
+REFERENCE_STORE_PATH = f'{RETRIEVED_DATA_PATH}/reference.sqlite'
+
+
 class WebUniProtCommunicator(UniProtCommunicator):
-    def __init__(self, cache, cellular_compartment, track_update, tp_data=None, fp_data=None):
-        super().__init__(cache, cellular_compartment)
-        self.__ids = None
+    def __init__(self, cache, cellular_compartment, track_update, tp_data=None, fp_data=None, store=None, stream=False, api_url=API_URL):
+        '''
+        api_url: base url of the UniProt REST API, e.g. a local stand-in server
+        '''
+        super().__init__(cache, cellular_compartment, stream, api_url)
+        self.__store = store if store is not None else ReferenceStore(REFERENCE_STORE_PATH)
         self.__track_update = track_update
+        self.__snapshot = None
         if isinstance(tp_data, pd.DataFrame) and isinstance(fp_data, pd.DataFrame):
-            self._annotation_true_positive = tp_data
-            self._annotation_false_positive = fp_data
+            self.__publish_snapshot(self.__as_entries(tp_data), self.__as_entries(fp_data))
         else:
             self.__init_annotations()
 
 
     # implement abstract method
     async def get_latest_id(self, old_ids, meta):
-        if self.__ids is None:
-            to_retrieve = old_ids
-            logger.info('before retrieve, cached ids: 0')
-
-        else:
-            old_ids_set = set(old_ids)
-            saved_ids_set = set(self.__ids['From'])
-            to_retrieve = old_ids_set.difference(saved_ids_set)
-            logger.info(f'before retrieve, cached ids: {len(self.__ids)}')
-
+        to_retrieve = self.__store.get_missing_ids(old_ids)
         logger.info(f'to retrieve: {len(to_retrieve)}')
         if len(to_retrieve) > 0:
-            retrieved_data = await self._retrieve_latest_id(list(to_retrieve), meta)
-            retrieved_data = self.__add_no_mapping_ids(retrieved_data, meta)
+            retrieved_data = await self._retrieve_latest_id(to_retrieve, meta)
+            retrieved_data = self._add_no_mapping_ids(retrieved_data, meta)
             logger.debug(f'\n{retrieved_data.head()}')
 
-            self.__ids = pd.concat([self.__ids, retrieved_data])
-            logger.info(f'after retrieve, cached ids: {len(self.__ids)}')
-        return self.__ids[self.__ids['From'].isin(old_ids)]
-
-
-    def __add_no_mapping_ids(self, retrieved_data, meta):
-        # add ids that didn't find mapping data to cached ids, all fields are NaN
-        no_mapping_ids = meta['no_id_mapping']
-        if len(no_mapping_ids) > 0:
-            no_mapping_ids = pd.DataFrame(list(no_mapping_ids), columns = ['From'])
-            for col in retrieved_data.columns[1:]:
-                no_mapping_ids[col] = np.NaN
-            retrieved_data = pd.concat([retrieved_data, no_mapping_ids])
-            logger.debug(f'\n{no_mapping_ids.head()}')
-        return retrieved_data
+            self.__store.upsert_ids(retrieved_data)
+            logger.info(f'after retrieve, cached ids: {self.__store.count_ids()}')
+        return self.__store.lookup_ids(old_ids)
+
+
+    def __load_annotation(self, annotation_type):
+        '''
+        Load an annotation from the reference store, the legacy tsv file is imported into the store once
+        return True if the annotation is found
+        '''
+        if not self.__store.has_annotation(self._cc_code, annotation_type):
+            annotation_path = f'{RETRIEVED_DATA_PATH}/{self._cc_code}_annotation_{annotation_type}.tsv'
+            if not os.path.exists(annotation_path):
+                logger.debug(f"*** didn't find cache of {self._cc_code}_annotation_{annotation_type} in {self.__store.get_path()}")
+                return False
+            self.__store.replace_annotation(self._cc_code, annotation_type, pd.read_table(annotation_path, sep='\t', header=0))
+            logger.info(f'Imported {annotation_path} into {self.__store.get_path()}')
+        annotation_data = self.__store.get_annotation(self._cc_code, annotation_type)
+        logger.info(f'Read in {len(annotation_data)} entries from cached {self._cc_code}_annotation_{annotation_type}')
+        self._set_annotation(annotation_data, annotation_type)
+        return True
+
+
+    def __load_ids(self):
+        '''
+        Import the legacy latest_ids file into the reference store once
+        '''
+        id_path = f'{RETRIEVED_DATA_PATH}/latest_ids.tsv'
+        if self.__store.count_ids() == 0 and os.path.exists(id_path):
+            self.__store.replace_ids(pd.read_table(id_path, sep='\t', header=0))
+            logger.info(f'Imported {id_path} into {self.__store.get_path()}')
+        logger.info(f'{self.__store.count_ids()} entries in cached latest_ids')
 
 
     def __init_annotations(self):
         annotation_types = ['true_positive', 'false_positive']
+        has_data = True
         for annotation_type in annotation_types:
-            annotation_path = f'../retrieved_data/{self._cc_code}_annotation_{annotation_type}.tsv'
-            if os.path.exists(annotation_path):
-                annotation_data = pd.read_table(annotation_path, sep='\t', header=0)
-                logger.info(f'Read in {len(annotation_data)} entries from cached {self._cc_code}_annotation_{annotation_type} file')
-                self._set_annotation(annotation_data, annotation_type)
-            else:
-                logger.debug(f"*** didn't find cache in {annotation_path}")
+            if not self.__load_annotation(annotation_type):
+                has_data = False
+        if has_data:
+            self.__publish_snapshot(self._annotation_true_positive, self._annotation_false_positive)
+
+
+    def __as_entries(self, annotation):
+        '''
+        Copy of an annotation given by the caller with its single column named 'Entry', whatever its name was
+        '''
+        annotation = annotation.copy()
+        annotation.columns = ['Entry']
+        return annotation
+
+
+    def __publish_snapshot(self, annotation_true_positive, annotation_false_positive):
+        '''
+        Build the next snapshot aside and swap it in with one assignment, requests holding the previous one keep using it
+        '''
+        version = 1 if self.__snapshot is None else self.__snapshot.get_version() + 1
+        self.__snapshot = ReferenceSnapshot(version, annotation_true_positive, annotation_false_positive)
+        # the snapshot holds the reference sets as int codes, the string frames are not kept
+        self._set_annotation(None, 'true_positive')
+        self._set_annotation(None, 'false_positive')
+        logger.info(f'Published reference data version {version} for {self._cc_code}')
+
+
+    async def get_snapshot(self):
+        '''
+        return the current ReferenceSnapshot, a request pins it for its whole analysis
+        '''
+        if self.__snapshot is None:
+            self.__publish_snapshot(await super().get_annotation('true_positive'), await super().get_annotation('false_positive'))
+        return self.__snapshot
+
+
+    # overriding method of super class
+    async def get_annotation(self, type):
+        return (await self.get_snapshot()).get_annotation(type)
+
+
+    # overriding method of super class
+    async def get_reference_index(self, type):
+        return (await self.get_snapshot()).get_reference_index(type)
 
 
     async def __initialize(self):
@@ -74,26 +128,17 @@ class WebUniProtCommunicator(UniProtCommunicator):
         try:
             has_data = True
             for annotation_type in annotation_types:
-                annotation_path = f'../retrieved_data/{self._cc_code}_annotation_{annotation_type}.tsv'
-                if os.path.exists(annotation_path):
-                    annotation_data = pd.read_table(annotation_path, sep='\t', header=0)
-                    logger.info(f'Read in {len(annotation_data)} entries from cached {self._cc_code}_annotation_{annotation_type} file')
-                    self._set_annotation(annotation_data, annotation_type)
-                else:
-                    logger.debug(f"*** didn't find cache in {annotation_path}")
+                if not self.__load_annotation(annotation_type):
                     has_data = False
 
             if not has_data:
                 await self._retrieve_annotation()
-                for annotation_type in annotation_types:
-                    annotation_data = await self.get_annotation(annotation_type)
-                    annotation_data.to_csv(f'../retrieved_data/{self._cc_code}_annotation_{annotation_type}.tsv', sep='\t', index=False)
-                logger.info(f'Annotation files saved')
+                annotations = {annotation_type: await super().get_annotation(annotation_type) for annotation_type in annotation_types}
+                self.__store.replace_annotations(self._cc_code, annotations)
+                logger.info(f'Annotations saved')
+            self.__publish_snapshot(self._annotation_true_positive, self._annotation_false_positive)
 
-            id_path = '../retrieved_data/latest_ids.tsv'
-            if os.path.exists(id_path):
-                self.__ids = pd.read_table(id_path, sep='\t', header=0)
-                logger.info(f'Read in {len(self.__ids)} entries from archived latest_ids file')
+            self.__load_ids()
 
             end_time = datetime.now()
             logger.info(f'Initialization is done. Time: {end_time-start_time}')
@@ -117,20 +162,22 @@ class WebUniProtCommunicator(UniProtCommunicator):
             logger.info('Updating data...')
             try:
                 meta={}
-                if self.__ids is not None:
-                    updated_ids = await self._retrieve_latest_id(list(self.__ids['From']), meta)
-                    updated_ids = self.__add_no_mapping_ids(updated_ids, meta)
-                    num_diff = len(set(updated_ids['Entry']).difference(set(self.__ids['Entry'])))
+                saved_ids = self.__store.get_ids()
+                if len(saved_ids) > 0:
+                    updated_ids = await self._retrieve_latest_id(list(saved_ids['From']), meta)
+                    updated_ids = self._add_no_mapping_ids(updated_ids, meta)
+                    num_diff = len(set(updated_ids['Entry']).difference(set(saved_ids['Entry'])))
                     logger.info(f'{num_diff} ids are updated')
-                    self.__ids = updated_ids
-                    self.__ids.to_csv('../retrieved_data/latest_ids.tsv', sep='\t', index=False)
-                    logger.info('Latest_ids file saved')
+                    self.__store.replace_ids(updated_ids)
+                    logger.info('Latest_ids saved')
+                # the new annotations are retrieved aside, requests keep reading the published snapshot meanwhile
                 await self._retrieve_annotation()
-                true_positive = await self.get_annotation('true_positive')
-                true_positive.to_csv(f'../retrieved_data/{self._cc_code}_annotation_true_positive.tsv', sep='\t', index=False)
-                false_positive = await self.get_annotation('false_positive')
-                false_positive.to_csv(f'../retrieved_data/{self._cc_code}_annotation_false_positive.tsv', sep='\t', index=False)
-                logger.info(f'Annotation files saved')
+                true_positive = await super().get_annotation('true_positive')
+                false_positive = await super().get_annotation('false_positive')
+                # both sets in one transaction, a crash can't leave a new true positive set with an old false positive one
+                self.__store.replace_annotations(self._cc_code, {'true_positive': true_positive, 'false_positive': false_positive})
+                logger.info(f'Annotations saved')
+                self.__publish_snapshot(true_positive, false_positive)
                 end_time = datetime.now()
                 logger.info(f'Update is done. Time: {end_time-start_time}')
                 # self.__track_update += 1
@@ -140,4 +187,4 @@ class WebUniProtCommunicator(UniProtCommunicator):
 
     # called in main.py, to export cached ids by api instead of waiting for update
     def get_ids(self):
-        return self.__ids
+        return self.__store.get_ids()
@@ -1,22 +1,24 @@
 from fastapi import UploadFile
-import pandas as pd
 import csv
 import logging
-from io import StringIO
+import asyncio
+from io import BytesIO
 from peeling.userinputreader import UserInputReader
+from peeling.tablereader import read_table, get_table_format
 
 logger = logging.getLogger('peeling')
 
 
 class WebUserInputReader(UserInputReader):
-    def __init__(self, mass_file:UploadFile, num_controls, num_replicates, tolerance, plot_format, cellular_compartment):
-        super().__init__(num_controls, num_replicates, tolerance, plot_format, cellular_compartment)
+    def __init__(self, mass_file:UploadFile, num_controls, num_replicates, tolerance, plot_format, cellular_compartment, jobs=1, defer_plots=False, tolerance_sweep=False, output_format='tsv'):
+        super().__init__(num_controls, num_replicates, tolerance, plot_format, cellular_compartment, jobs, defer_plots, tolerance_sweep, output_format)
         self.__mass_file = mass_file
 
 
     async def __decode_uploadFile(self):
         bytes = await self.__mass_file.read()
-        df = pd.read_table(StringIO(bytes.decode("utf-8")))
+        # parsed in a thread, so that a large upload doesn't block the event loop
+        df = await asyncio.get_running_loop().run_in_executor(None, read_table, BytesIO(bytes), get_table_format(self.__mass_file.filename), True)
         logger.debug(f'\n{df.head()}')
         self._check_file(df)
         return df
@@ -0,0 +1,90 @@
+#################################################
+#   Local stand-in for the Panther REST API     #
+#################################################
+
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class PantherStandIn:
+    '''
+    Serves the supportedgenomes and enrich/overrep endpoints
+    organisms: dict of long name -> taxon id
+    transient_failures: number of enrichment requests answered with 503 before they succeed
+    reject: answer enrichment requests with 400
+    '''
+    def __init__(self, organisms, transient_failures=0, reject=False):
+        self.organisms = organisms
+        self.transient_failures = transient_failures
+        self.reject = reject
+        self.requests = Counter()
+        self.gene_input_lists = []
+        self.query_lengths = []
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), self.__make_handler())
+        self.__server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.__server.server_address[1]}'
+
+
+    def __enter__(self):
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+    def enrichment(self, proteins):
+        results = [
+            {'term': {'label': f'term {i}'}, 'fdr': 0.001 * (i + 1), 'plus_minus': '+' if i % 2 == 0 else '-', 'number_in_list': len(proteins)}
+            for i in range(30)
+        ]
+        return {'results': {'result': results}}
+
+
+    def __make_handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                return
+
+
+            def __send(self, status, body):
+                body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+
+            def do_GET(self):
+                if urlparse(self.path).path == '/supportedgenomes':
+                    standin.requests['supportedgenomes'] += 1
+                    genomes = [{'long_name': name, 'taxon_id': taxon_id} for name, taxon_id in standin.organisms.items()]
+                    return self.__send(200, {'search': {'output': {'genomes': {'genome': genomes}}}})
+                self.__send(404, {'error': 'not found'})
+
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode('utf-8'))
+                if urlparse(self.path).path != '/enrich/overrep':
+                    return self.__send(404, {'error': 'not found'})
+                standin.requests['overrep'] += 1
+                standin.query_lengths.append(len(urlparse(self.path).query))
+                if standin.reject:
+                    return self.__send(400, {'search': {'error': 'rejected'}})
+                if standin.transient_failures > 0:
+                    standin.transient_failures -= 1
+                    return self.__send(503, {'error': 'unavailable'})
+                proteins = form['geneInputList'][0].split(',')
+                standin.gene_input_lists.append(proteins)
+                self.__send(200, standin.enrichment(proteins))
+
+        return Handler
@@ -4,7 +4,42 @@
 
 import unittest
 import os, shutil
+import asyncio
+import time
+import gc
+import tracemalloc
+from io import BytesIO
+from itertools import combinations
+from unittest import mock
+from threadpoolctl import threadpool_info
+import numpy as np
 import pandas as pd
+from uniprot_standin import UniProtStandIn
+from panther_standin import PantherStandIn
+from web_standin import LocalUploadReader
+from peeling.cliuniprotcommunicator import CliUniProtCommunicator
+from peeling.cliuserinputreader import CliUserInputReader
+from peeling.cliprocessor import CliProcessor
+from peeling.referenceindex import ReferenceIndex
+from peeling.referencebundle import save_bundle, get_default_bundle_path, find_default_bundle
+from peeling.cachedir import CACHE_DIR_ENV
+from peeling.referencesnapshot import ReferenceSnapshot
+from peeling.idresolver import IdResolver
+from peeling.jobqueue import JobQueue, QueueFullError
+from peeling.resultsstore import ResultsStore, RESULTS_PATH
+from peeling.referencestore import ReferenceStore
+from peeling.webuniprotcommunicator import WebUniProtCommunicator
+from peeling.webprocessor import WebProcessor
+from peeling.panthercache import PantherCache
+from peeling.clipantherprocessor import CliPantherProcessor
+from peeling.httpclientregistry import get_client_registry, run_with_clients, UNIPROT_CLIENT
+from peeling.accessioncodec import encode_accessions, decode_accessions, INVALID_CODE
+from peeling.cutoffengine import CutoffEngine
+from peeling.curvedata import save_curves, CurveData
+from peeling.plotrenderer import render_plot, make_scatter_spec, make_line_spec, PlotRenderer
+from peeling.tablereader import read_table, pyarrow
+from peeling.tablewriter import write_table, check_output_format
+from peeling.jobmanifest import JobManifest
 
 
 EXE_DIR = '../peeling/main.py'
@@ -12,6 +47,18 @@ OUTPUT_DIR = './test_output'
 ANNO_SURFACE = '../data/annotation_surface.tsv'
 ANNO_CYTO = '../data/annotation_cyto.tsv'
 IDS = '../data/latest_ids_multiOrganisms.tsv'
+LOCAL_IDS = '../data/latest_ids.tsv'
+MASS_DATA = '../data/mass_spec_data.tsv'
+
+
+def run_local(path, communicator, cellular_compartment='cs', compartment_communicators=None, **kwargs):
+    '''
+    Run the CLI analysis of MASS_DATA in-process with the local ids, return the parent path of the results
+    '''
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    reader = CliUserInputReader(MASS_DATA, 2, 3, path, 0, LOCAL_IDS, None, None, False, 'png', False, cellular_compartment, **kwargs)
+    return CliProcessor(reader, communicator, compartment_communicators).start()
 
 
 class TestPeeling(unittest.TestCase):
@@ -255,6 +302,32 @@ class TestPeeling(unittest.TestCase):
     #         os.system(cmd)
     
 
+    def test_tolerance_sweep(self):
+        # every file of the sweep should be the post-cutoff proteome of a run with that tolerance
+        print('\n\n\n')
+        print('#########  tolerance_sweep  #########')
+        ctrl = '2'
+        rep = '3'
+        output_dir = f'{OUTPUT_DIR}/tolerance_sweep/'
+        os.makedirs(output_dir, exist_ok=True)
+        # a duplicated protein whose first row in the output order is only included in the last column
+        mass_data = f'{output_dir}mass_spec_data.tsv'
+        df = pd.read_table('../data/mass_spec_data.tsv')
+        duplicate = df[df.iloc[:, 0] == 'Q8CD54'].copy()
+        duplicate.iloc[:, 1:] = [0.001] * 5 + [1000.]
+        pd.concat([df, duplicate]).to_csv(mass_data, sep='\t', index=False)
+        cmd = f'python3 {EXE_DIR} {mass_data} {ctrl} {rep} --tolerance-sweep --tp {ANNO_SURFACE} --fp {ANNO_CYTO} --ids {IDS} -o {output_dir}sweep'
+        os.system(cmd)
+        sweep_dir = f'{output_dir}sweep/' + os.listdir(f'{output_dir}sweep')[-1] + '/tolerance_sweep'
+        for t in range(7):
+            cmd = f'python3 {EXE_DIR} {mass_data} {ctrl} {rep} -t {t} --tp {ANNO_SURFACE} --fp {ANNO_CYTO} --ids {IDS} -o {output_dir}t{t}'
+            os.system(cmd)
+            res_dir = f'{output_dir}t{t}/' + os.listdir(f'{output_dir}t{t}')[-1]
+            expected = pd.read_table(f'{res_dir}/post-cutoff-proteome.tsv')
+            swept = pd.read_table(f'{sweep_dir}/post-cutoff-proteome_tolerance_{t}.tsv')
+            self.assertEqual(list(swept['Entry']), list(expected['Entry']), f'Tolerance {t} differs from a run with -t {t}')
+
+
     # # test different formats, does not need to be run for every change
     # def test_format(self):
     #     mass_data = '../data/mass_spec_data.tsv'
@@ -324,6 +397,26 @@ class TestPeeling(unittest.TestCase):
     #         os.system(cmd)
     
 
+    def test_batch(self):
+        # two mass spec files from one manifest, analyzed in parallel with shared local anno and ids files
+        print('\n\n\n')
+        print('#########  batch  #########')
+        mass_data = os.path.abspath('../data/mass_spec_data.tsv')
+        output_dir = f'{OUTPUT_DIR}/batch'
+        os.makedirs(output_dir, exist_ok=True)
+        manifest = f'{output_dir}/manifest.tsv'
+        with open(manifest, 'w') as f:
+            f.write('mass\tcontrols\treplicates\ttolerance\toutput\n')
+            f.write(f'{mass_data}\t2\t3\t0\tt0\n')
+            f.write(f'{mass_data}\t2\t3\t1\tt1\n')
+        cmd = f'python3 -m peeling.batchmain {manifest} --tp {ANNO_SURFACE} --fp {ANNO_CYTO} --ids {IDS} -j 2 -o {output_dir}'
+        os.system(cmd)
+
+        summary = pd.read_table(f'{output_dir}/batch_summary.tsv')
+        self.assertEqual(list(summary['status']), ['done', 'done'])
+        self.assertEqual([os.path.basename(os.path.dirname(path)) for path in summary['result']], ['t0', 't1'], 'The summary should keep the manifest order')
+
+
     # def test_wrong_tolerance(self):
     #     mass_data = '../data/mass_spec_data.tsv'
     #     ctrl = '2'
@@ -349,5 +442,510 @@ class TestPeeling(unittest.TestCase):
 
 
 
+# Tests below run against a local stand-in for the UniProt API, no network access is needed
+class TestUniProtStandIn(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.annotation = list(pd.read_table(ANNO_SURFACE)['Entry'][:1234])
+        self.latest_ids = pd.read_table(IDS)
+
+
+    def test_stream_annotation(self):
+        with UniProtStandIn(self.annotation, self.latest_ids) as standin:
+            communicator = CliUniProtCommunicator(False, 'cs', stream=True, api_url=standin.url, id_cache=False)
+            annotation = run_with_clients(communicator.get_annotation('true_positive'))
+            self.assertEqual(list(annotation['Entry']), self.annotation)
+            self.assertEqual(standin.requests['search'], 0, 'Stream mode should not paginate')
+
+
+    def test_stream_fallback(self):
+        with UniProtStandIn(self.annotation, self.latest_ids, fail_stream=True) as standin:
+            communicator = CliUniProtCommunicator(False, 'cs', stream=True, api_url=standin.url, id_cache=False)
+            annotation = run_with_clients(communicator.get_annotation('true_positive'))
+            self.assertEqual(list(annotation['Entry']), self.annotation)
+            self.assertEqual(standin.requests['search'], 6, 'Annotations of two types should be fetched in 3 pages each')
+
+
+    def test_stream_id_mapping(self):
+        old_ids = list(self.latest_ids['From'][:300]) + ['NOT_AN_ID']
+        with UniProtStandIn(self.annotation, self.latest_ids) as standin:
+            communicator = CliUniProtCommunicator(False, 'cs', stream=True, api_url=standin.url, id_cache=False)
+            ids = run_with_clients(communicator.get_latest_id(old_ids))
+            self.assertEqual(set(ids['From']), set(old_ids[:-1]))
+            self.assertEqual(standin.requests['results'], 0, 'Stream mode should not paginate')
+
+
+    def test_id_mapping_split_failed_chunk(self):
+        old_ids = list(self.latest_ids['From'].drop_duplicates())
+        with UniProtStandIn(self.annotation, self.latest_ids, fail_ids=[old_ids[1000]]) as standin:
+            communicator = CliUniProtCommunicator(False, 'cs', api_url=standin.url, id_cache=False)
+            ids = run_with_clients(communicator.get_latest_id(old_ids))
+            # only the smallest chunk holding the failing id is lost
+            self.assertNotIn(old_ids[1000], set(ids['From']))
+            self.assertGreater(len(set(ids['From'])), len(old_ids) - 200)
+
+
+    def test_id_mapping_unmapped_chunk(self):
+        # the first chunk has no mapping data, its header-only page should not bring back the dropped columns
+        old_ids = [f'NOT_AN_ID{i}' for i in range(2000)] + list(self.latest_ids['From'].drop_duplicates()[:300])
+        with UniProtStandIn(self.annotation, self.latest_ids) as standin:
+            communicator = CliUniProtCommunicator(False, 'cs', api_url=standin.url, id_cache=False)
+            ids = run_with_clients(communicator.get_latest_id(old_ids))
+            self.assertEqual(list(ids.columns), ['From', 'Entry', 'Protein names', 'Gene Names', 'Organism', 'Length'])
+            self.assertEqual(set(ids['From']), set(old_ids[2000:]))
+
+
+    def test_id_mapping_polling(self):
+        old_ids = list(self.latest_ids['From'][:300])
+        with UniProtStandIn(self.annotation, self.latest_ids, running_polls=3) as standin:
+            communicator = CliUniProtCommunicator(False, 'cs', api_url=standin.url, id_cache=False)
+            start_time = time.time()
+            ids = run_with_clients(communicator.get_latest_id(old_ids))
+            self.assertEqual(set(ids['From']), set(old_ids))
+            self.assertLess(time.time() - start_time, 5, 'Small jobs should not wait for long polling intervals')
+
+
+    def test_id_mapping_cache(self):
+        old_ids = list(self.latest_ids['From'][:300]) + ['NOT_AN_ID']
+        cache_file = f'{OUTPUT_DIR}/id_mapping_cache.sqlite'
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        with UniProtStandIn(self.annotation, self.latest_ids) as standin:
+            communicator = CliUniProtCommunicator(False, 'cs', api_url=standin.url, id_cache=cache_file)
+            first = run_with_clients(communicator.get_latest_id(old_ids))
+            submitted = standin.requests['run']
+            communicator = CliUniProtCommunicator(False, 'cs', api_url=standin.url, id_cache=cache_file)
+            second = run_with_clients(communicator.get_latest_id(old_ids))
+            self.assertEqual(standin.requests['run'], submitted, 'Cached and negatively cached ids should not be mapped again')
+            self.assertEqual(set(first['From']), set(second['From']))
+
+
+    def test_shared_http_client(self):
+        with UniProtStandIn(self.annotation, self.latest_ids) as standin:
+            communicators = [CliUniProtCommunicator(False, 'cs', api_url=standin.url, id_cache=False) for i in range(2)]
+            async def run():
+                await communicators[0].get_latest_id(list(self.latest_ids['From'][:100]))
+                client = get_client_registry().get_client(UNIPROT_CLIENT, None)
+                await communicators[1].get_annotation('true_positive')
+                self.assertIs(get_client_registry().get_client(UNIPROT_CLIENT, None), client, 'Stages should share one client')
+                return client
+            client = run_with_clients(run())
+            self.assertTrue(client.is_closed)
+
+
+    def test_reference_bundle(self):
+        bundle_file = f'{OUTPUT_DIR}/cs_reference.npz'
+        save_bundle(bundle_file, 'cs', pd.read_table(ANNO_SURFACE), pd.read_table(ANNO_CYTO), 'test')
+        with UniProtStandIn(self.annotation, self.latest_ids) as standin:
+            communicator = CliUniProtCommunicator(False, 'cs', api_url=standin.url, id_cache=False, bundle=bundle_file)
+            annotation = run_with_clients(communicator.get_annotation('false_positive'))
+            self.assertEqual(list(annotation['Entry']), list(pd.read_table(ANNO_CYTO)['Entry'].dropna()))
+            self.assertEqual(sum(standin.requests.values()), 0, 'Annotations should be read from the bundle only')
+            reference_index = run_with_clients(communicator.get_reference_index('false_positive'))
+            self.assertIs(run_with_clients(communicator.get_reference_index('false_positive')), reference_index, 'The index should be built once')
+            self.assertEqual(list(reference_index.contains(['NOT_AN_ID', annotation['Entry'][0]])), [False, True])
+
+
+    def test_reference_index_two_runs(self):
+        bundle_file = f'{OUTPUT_DIR}/cs_reference.npz'
+        save_bundle(bundle_file, 'cs', pd.read_table(ANNO_SURFACE), pd.read_table(ANNO_CYTO), 'test')
+        communicator = CliUniProtCommunicator(False, 'cs', id_cache=False, bundle=bundle_file)
+        with mock.patch('peeling.uniprotcommunicator.ReferenceIndex', wraps=ReferenceIndex) as built:
+            for run in ['run1', 'run2']:
+                parent_path = run_local(f'{OUTPUT_DIR}/reference_index_{run}', communicator)
+                proteins = pd.read_table(f'{parent_path}/post-cutoff-proteome.tsv')
+                self.assertEqual(len(proteins), 564)
+                # in 5 of the 6 columns only, with the ties broken by the input row order
+                self.assertNotIn('Q8BXN9', set(proteins['Entry']))
+        self.assertEqual(built.call_count, 2, 'The true and false positive indexes should be built once for both runs')
+
+
+    def test_multi_compartment(self):
+        bundles = {'cs': (ANNO_SURFACE, ANNO_CYTO), 'nu': (ANNO_CYTO, ANNO_SURFACE)}
+        communicators = {}
+        for cc, (tp, fp) in bundles.items():
+            save_bundle(f'{OUTPUT_DIR}/{cc}_reference.npz', cc, pd.read_table(tp), pd.read_table(fp), 'test')
+            communicators[cc] = CliUniProtCommunicator(False, cc, id_cache=False, bundle=f'{OUTPUT_DIR}/{cc}_reference.npz')
+        parent_path = run_local(f'{OUTPUT_DIR}/multi_compartment', communicators['cs'], ['cs', 'nu'], {'nu': communicators['nu']}, defer_plots=True)
+        # one heatmap for the shared data, the results of each compartment in its own directory
+        self.assertTrue(os.path.exists(f'{parent_path}/plots'))
+        cs = pd.read_table(f'{parent_path}/cs/post-cutoff-proteome.tsv')
+        nu = pd.read_table(f'{parent_path}/nu/post-cutoff-proteome.tsv')
+        self.assertEqual(len(cs), 564)
+        self.assertNotEqual(set(cs['Entry']), set(nu['Entry']))
+        single_path = run_local(f'{OUTPUT_DIR}/single_compartment', CliUniProtCommunicator(False, 'nu', id_cache=False, bundle=f'{OUTPUT_DIR}/nu_reference.npz'), 'nu', defer_plots=True)
+        self.assertEqual(list(nu['Entry']), list(pd.read_table(f'{single_path}/post-cutoff-proteome.tsv')['Entry']), 'Each compartment should match its own run')
+        with open(f'{parent_path}/log.txt') as f:
+            self.assertIn('Cellular compartment: cs, nu', f.read())
+
+
+    def test_accession_codec(self):
+        ids = list(pd.read_table(ANNO_SURFACE)['Entry'].dropna()) + ['P12345-2', 'A0A024R161-123']
+        codes = encode_accessions(ids)
+        self.assertTrue((codes != INVALID_CODE).all())
+        self.assertEqual(list(decode_accessions(codes)), ids)
+        self.assertEqual(list(encode_accessions(['CON__P02768', 'P12345-01', None])), [INVALID_CODE] * 3)
+
+
+    def test_id_resolver(self):
+        id_mapping_data = pd.DataFrame({'From': ['A', 'B', 'B', 'C', 'D'], 'Entry': ['A', 'E1', 'E2', 'A', None],
+                                        'Length': [1, 2, 3, 4, None]})
+        resolver = IdResolver(id_mapping_data)
+        data = resolver.resolve(pd.DataFrame({'From': ['A', 'B', 'C', 'D', 'X'], 'ratio': [1., 2., 3., 4., 5.]}))
+        self.assertEqual(list(data.index), ['A', 'E1', 'A', 'D', 'X'])
+        self.assertEqual(list(data['Length'].fillna(0)), [1, 2, 4, 0, 0])
+        self.assertEqual(resolver.get_counts(), {'updated': 2, 'unchanged': 1, 'no_mapping': 2, 'one_to_many': 1, 'merged': 2})
+        # no id maps, e.g. get_latest_id dropped every row
+        resolver = IdResolver(id_mapping_data.iloc[:0])
+        data = resolver.resolve(pd.DataFrame({'From': ['A', 'X'], 'ratio': [1., 2.]}))
+        self.assertEqual(list(data.index), ['A', 'X'])
+        self.assertEqual(list(data['ratio']), [1., 2.])
+        self.assertEqual(resolver.get_counts()['no_mapping'], 2)
+
+
+    def test_panther_post(self):
+        path = f'{OUTPUT_DIR}/panther_post'
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        proteins = list(pd.read_table(IDS)['From'].drop_duplicates()[:5000])
+        with open(f'{path}/post-cutoff-proteome.txt', 'w') as f:
+            f.write(','.join(proteins))
+        with PantherStandIn({'Mus musculus': 10090}, transient_failures=2) as standin:
+            CliPantherProcessor('Mus musculus', path, PantherCache(f'{path}/cache'), standin.url).start()
+            self.assertEqual(standin.requests['overrep'], 5, 'Transient errors should be retried')
+            self.assertEqual(standin.query_lengths, [0] * 5, 'Proteins should be sent in the body')
+            self.assertTrue(all(gene_input_list == proteins for gene_input_list in standin.gene_input_lists))
+            self.assertEqual(len(pd.read_table(f'{path}/post-cutoff-proteome_10090_Reactome_Pathway.tsv')), 10)
+        with PantherStandIn({'Mus musculus': 10090}, reject=True) as standin:
+            CliPantherProcessor('Mus musculus', path, PantherCache(f'{path}/cache_rejected'), standin.url).start()
+            self.assertEqual(standin.requests['overrep'], 3, 'Rejected requests should not be retried')
+
+
+
+# Tests below check local building blocks of the web service and caches, no network access is needed
+class TestLocal(unittest.TestCase):
+    def test_job_queue(self):
+        async def run():
+            queue = JobQueue(workers=1, max_depth=4)
+            started = []
+            async def job(name):
+                started.append(name)
+                return await queue.run_blocking(sum, [1, 2])
+            job_ids = [queue.submit('a', job, 'a1'), queue.submit('a', job, 'a2'), queue.submit('a', job, 'a3'), queue.submit('b', job, 'b1')]
+            self.assertEqual(queue.get_status(job_ids[3])['position'], 2)
+            with self.assertRaises(QueueFullError):
+                queue.submit('b', job, 'b2')
+            while queue.get_status(job_ids[2])['status'] != 'done':
+                await asyncio.sleep(0.01)
+            await queue.shutdown()
+            return started, queue.get_status(job_ids[0])['result']
+        started, result = asyncio.run(run())
+        self.assertEqual(started, ['a1', 'b1', 'a2', 'a3'], 'Clients should be served round-robin')
+        self.assertEqual(result, 3)
+
+
+    def test_job_queue_blas_limits(self):
+        def get_threads():
+            return [pool['num_threads'] for pool in threadpool_info()]
+        original = get_threads()
+        limit = max(original + [1]) + 2 # differs from every current limit
+        async def run():
+            queue = JobQueue(workers=2, blas_threads=limit)
+            self.assertEqual(get_threads(), original, 'Creating the queue should not change the limits')
+            during = await asyncio.gather(queue.run_blocking(get_threads), queue.run_blocking(get_threads))
+            await queue.shutdown()
+            return during
+        during = asyncio.run(run())
+        self.assertEqual(during, [[limit] * len(original)] * 2)
+        self.assertEqual(get_threads(), original, 'The limits should be restored once no job runs')
+
+
+    def test_results_store(self):
+        root = f'{OUTPUT_DIR}/results_store'
+        shutil.rmtree(root, ignore_errors=True)
+        store = ResultsStore(root, budget=1500, cold_age=0, min_age=0)
+        for job_id in ['job1', 'job2']:
+            os.makedirs(f'{root}/{job_id}/results')
+            with open(f'{root}/{job_id}/results/log.txt', 'w') as f:
+                f.write(job_id * 100)
+            store.add_job(job_id)
+        self.assertEqual(store.compact(), 2)
+        self.assertFalse(os.path.exists(f'{root}/job1'))
+        with open(f'{store.open_job("job1")}/results/log.txt') as f:
+            self.assertEqual(f.read(), 'job1' * 100, 'Archived jobs should be extracted when opened')
+        os.makedirs(f'{root}/job3')
+        with open(f'{root}/job3/data', 'w') as f:
+            f.write('x' * 1000)
+        store.add_job('job3')
+        self.assertFalse(os.path.exists(f'{root}/job2.zip'), 'The least recently used job should be evicted')
+        self.assertTrue(os.path.isdir(f'{root}/job1'))
+        jobs = sorted(name for name in os.listdir(root) if not name.startswith('results_index'))
+        self.assertEqual(jobs, ['job1', 'job3'], 'Files moved aside should be removed')
+
+
+    def test_panther_cache(self):
+        path = f'{OUTPUT_DIR}/panther_cache'
+        shutil.rmtree(path, ignore_errors=True)
+        cache = PantherCache(path)
+        self.assertIsNone(cache.get_organisms())
+        self.assertEqual(cache.get_organisms(stale=True)['Mus musculus'], 10090, 'The bundled catalog should be the fallback')
+        results = pd.DataFrame({'Term': ['a', 'b'], 'FDR': [0.01, 0.02]})
+        cache.save_enrichment('P1,P2,P2', 10090, 'ANNOT_TYPE_ID_PANTHER_GO_SLIM_CC', results)
+        pd.testing.assert_frame_equal(cache.get_enrichment('P2,P1', 10090, 'ANNOT_TYPE_ID_PANTHER_GO_SLIM_CC'), results)
+        self.assertIsNone(cache.get_enrichment('P2,P1', 9606, 'ANNOT_TYPE_ID_PANTHER_GO_SLIM_CC'))
+        self.assertIsNone(PantherCache(path, enrichment_ttl=0).get_enrichment('P1,P2', 10090, 'ANNOT_TYPE_ID_PANTHER_GO_SLIM_CC'))
+
+
+    def test_default_bundle(self):
+        path = f'{OUTPUT_DIR}/default_bundle_cache'
+        shutil.rmtree(path, ignore_errors=True)
+        with mock.patch.dict(os.environ, {CACHE_DIR_ENV: path}):
+            self.assertIsNone(find_default_bundle('cs'))
+            self.assertFalse(os.path.exists(path), 'Looking up the default bundle should not create the cache directory')
+            save_bundle(get_default_bundle_path('cs', create=True), 'cs', pd.read_table(ANNO_SURFACE), pd.read_table(ANNO_CYTO), 'test')
+            with self.assertLogs('peeling', level='INFO') as logs:
+                self.assertEqual(find_default_bundle('cs'), get_default_bundle_path('cs'))
+            self.assertIn(get_default_bundle_path('cs'), logs.output[0], 'The default bundle in use should be logged')
+
+
+    def test_cutoff_engine(self):
+        rng = np.random.default_rng(0)
+        ratios = rng.integers(0, 5, size=(200, 4)).astype(float) # many ties
+        tp = rng.random(200) < 0.3
+        fp = ~tp & (rng.random(200) < 0.5)
+        engine = CutoffEngine(ratios)
+        result = engine.evaluate(tp, fp)
+        for i in range(ratios.shape[1]):
+            # the per-column computation the engine replaces, pandas sorts stably with mergesort
+            sorted_df = pd.DataFrame({'ratio': ratios[:, i], 'tp': tp, 'fp': fp}).sort_values('ratio', ascending=False, kind='mergesort')
+            tpr = sorted_df['tp'].cumsum().to_numpy() / tp.sum()
+            fpr = sorted_df['fp'].cumsum().to_numpy() / fp.sum()
+            self.assertEqual(list(engine.get_order()[:, i]), list(sorted_df.index), 'Ties should keep the row order')
+            np.testing.assert_allclose(result.get_tpr(i), tpr)
+            np.testing.assert_allclose(result.get_fpr(i), fpr)
+            self.assertEqual(result.get_cut_off_pos(i), int(np.argmax(tpr - fpr)))
+            self.assertEqual(list(engine.get_ranks()[engine.get_order()[:, i], i]), list(range(200)))
+            self.assertEqual(set(np.flatnonzero(result.get_include()[:, i])), set(sorted_df.index[:result.get_cut_off_pos(i) + 1]))
+        with self.assertRaises(ValueError):
+            CutoffEngine(ratios[:, 0])
+
+
+    def test_cutoff_tie_break(self):
+        # N1 and T2 have the same ratios, the cut-off point is at T2 if N1 comes first in the input and
+        # N1 is selected with it, at T2 before N1 otherwise. The filler rows rank below the cut-off, they make
+        # the data large enough for an unstable sort to swap N1 and T2
+        path = f'{OUTPUT_DIR}/tie_break'
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        pd.DataFrame({'Entry': ['T1', 'T2']}).to_csv(f'{path}/tp.tsv', sep='\t', index=False)
+        pd.DataFrame({'Entry': ['F1', 'F2']}).to_csv(f'{path}/fp.tsv', sep='\t', index=False)
+        ratios = {'T1': 9., 'N1': 5., 'T2': 5., 'F1': 1., 'F2': .5}
+        fillers = {f'X{i}': ratio for i, ratio in enumerate(np.random.default_rng(0).uniform(0, 0.4, 40).round(3))}
+        ratios.update(fillers)
+        ids = list(ratios.keys())
+        pd.DataFrame({'From': ids, 'Entry': ids, 'Protein names': ids, 'Gene Names': ids, 'Organism': 'test', 'Length': 100}).to_csv(f'{path}/ids.tsv', sep='\t', index=False)
+        fillers = list(fillers.keys())
+        selected = {}
+        for name, core in [('n1_first', ['T1', 'N1', 'T2', 'F1', 'F2']), ('t2_first', ['T1', 'T2', 'N1', 'F1', 'F2'])]:
+            order = fillers[:20] + core + fillers[20:]
+            pd.DataFrame({'id': order, 'r1': [ratios[i] for i in order], 'r2': [ratios[i] for i in order]}).to_csv(f'{path}/{name}.tsv', sep='\t', index=False)
+            os.makedirs(f'{path}/{name}')
+            reader = CliUserInputReader(f'{path}/{name}.tsv', 1, 2, f'{path}/{name}', 0, f'{path}/ids.tsv', f'{path}/tp.tsv', f'{path}/fp.tsv', False, 'png', True, 'cs', defer_plots=True)
+            parent_path = CliProcessor(reader, CliUniProtCommunicator(False, 'cs', id_cache=False)).start()
+            selected[name] = list(pd.read_table(f'{parent_path}/post-cutoff-proteome.tsv')['Entry'])
+        self.assertEqual(selected, {'n1_first': ['T1', 'N1', 'T2'], 't2_first': ['T1', 'T2']}, 'Ties should be broken by the input row order')
+
+
+    def test_render_plot(self):
+        path = f'{OUTPUT_DIR}/render_plot'
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        x, y = np.arange(10.), np.arange(10.)[::-1]
+        spec = make_scatter_spec(x, y, 'x', 'y', 'scatter', [(f'{path}/scatter.png', {'dpi': 50}), (f'{path}/scatter.jpeg', {'dpi': 50})])
+        self.assertEqual(render_plot(spec), 'scatter')
+        self.assertEqual(sorted(os.listdir(path)), ['scatter.jpeg', 'scatter.png'], 'No temporary files should be left')
+        specs = [make_line_spec(y / 10, x / 10, f'line{i}', [(f'{path}/line{i}.png', {'dpi': 50})]) for i in range(3)]
+        for jobs in [1, 2]:
+            renderer = PlotRenderer(jobs)
+            ready = []
+            try:
+                asyncio.run(renderer.render(specs, ready.append))
+            finally:
+                renderer.close()
+            self.assertEqual(sorted(ready), ['line0', 'line1', 'line2'])
+            self.assertTrue(all(os.path.exists(f'{path}/{fig_name}.png') for fig_name in ready))
+
+
+    def test_curve_data(self):
+        path = f'{OUTPUT_DIR}/curve_data'
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        rng = np.random.default_rng(1)
+        ratios = rng.random((3000, 2))
+        tp = ratios[:, 0] > 0.7
+        fp = ratios[:, 0] < 0.4
+        result = CutoffEngine(ratios).evaluate(tp, fp)
+        save_curves(f'{path}/curves.npz', ['a', 'b'], result, ['P1', 'P2'])
+        curves = CurveData(f'{path}/curves.npz')
+        self.assertEqual(curves.get_columns(), ['a', 'b'])
+        curve = curves.get_curve('b')
+        np.testing.assert_array_equal(curve['tpr'], result.get_tpr(1))
+        self.assertEqual((curve['cut_off_pos'], curve['cutoff_protein_id']), (result.get_cut_off_pos(1), 'P2'))
+        self.assertGreater(curves.get_curve('a')['auc'], 0.99)
+        curve_dict = curves.to_dict('a', max_points=100)
+        self.assertLessEqual(len(curve_dict['rank']), 101)
+        self.assertIn(curve_dict['cut_off_pos'], curve_dict['rank'], 'The cut-off point should be kept when down-sampling')
+        with self.assertRaises(KeyError):
+            curves.get_curve('c')
+
+
+    def test_replace_annotations(self):
+        path = f'{OUTPUT_DIR}/replace_annotations.sqlite'
+        if os.path.exists(path):
+            os.remove(path)
+        store = ReferenceStore(path)
+        store.replace_annotations('cs', {'true_positive': pd.DataFrame({'Entry': ['P1', 'P2', None]}), 'false_positive': pd.DataFrame({'Entry': ['P3']})})
+        # the false positive set can't be written, so the true positive set of the same update should not be either
+        with self.assertRaises(Exception):
+            store.replace_annotations('cs', {'true_positive': pd.DataFrame({'Entry': ['P4']}), 'false_positive': pd.DataFrame({'Entry': [object()]})})
+        self.assertEqual(list(store.get_annotation('cs', 'true_positive')['Entry']), ['P1', 'P2'])
+        self.assertEqual(list(store.get_annotation('cs', 'false_positive')['Entry']), ['P3'])
+        store.close()
+
+
+    def test_read_table(self):
+        content = b'id\tr1\tr2\n0001\t1.5\t\nP2\t2\t3\n'
+        for source in [BytesIO(content), content]:
+            df = read_table(source, 'tsv', numeric=True)
+            self.assertEqual(list(df['id']), ['0001', 'P2'], 'Ids should be read as strings')
+            self.assertTrue(all(df[col].dtype == 'float64' for col in ['r1', 'r2']))
+            self.assertTrue(np.isnan(df['r2'][0]))
+        # non-numeric values are left for the data check
+        df = read_table(BytesIO(b'id\tr1\nP1\tabc\n'), 'tsv', numeric=True)
+        self.assertEqual(df['r1'][0], 'abc')
+        if pyarrow is None:
+            with self.assertRaises(ImportError):
+                read_table('mass.parquet', numeric=True)
+
+
+    def test_write_table(self):
+        path = f'{OUTPUT_DIR}/write_table'
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        df = pd.DataFrame({'Entry': ['P1', 'P2'], 'Length': [10, None]})
+        with self.assertRaises(ValueError):
+            check_output_format('xlsx')
+        if pyarrow is None:
+            with self.assertRaises(ImportError):
+                check_output_format('parquet')
+            write_table(df, f'{path}/proteins.tsv')
+            self.assertEqual(os.listdir(path), ['proteins.tsv'])
+        else:
+            write_table(df, f'{path}/proteins.tsv', 'parquet')
+            columnar = pd.read_parquet(f'{path}/proteins.parquet')
+            self.assertEqual(str(columnar['Length'].dtype), 'Int64', 'Lengths should stay integers')
+        pd.testing.assert_frame_equal(pd.read_table(f'{path}/proteins.tsv'), df)
+
+
+    def test_reference_snapshot_memory(self):
+        # the snapshot keeps int codes only, the string frames it is built from are released
+        def read():
+            return pd.read_table(ANNO_SURFACE), pd.read_table(ANNO_CYTO)
+        tracemalloc.start()
+        try:
+            frames = read()
+            gc.collect()
+            frames_size = tracemalloc.get_traced_memory()[0]
+            del frames
+            gc.collect()
+            base = tracemalloc.get_traced_memory()[0]
+            snapshot = ReferenceSnapshot(1, *read())
+            gc.collect()
+            snapshot_size = tracemalloc.get_traced_memory()[0] - base
+        finally:
+            tracemalloc.stop()
+        self.assertLess(snapshot_size, frames_size / 4, f'Snapshot {snapshot_size} bytes, frames {frames_size} bytes')
+        self.assertEqual(set(snapshot.get_annotation('true_positive')['Entry']), set(pd.read_table(ANNO_SURFACE)['Entry']))
+        flags = snapshot.get_reference_index('false_positive').contains(['Q8CD54', 'P99999-2', 'NOT_AN_ID'])
+        self.assertEqual(list(flags), list(pd.Series(['Q8CD54', 'P99999-2', 'NOT_AN_ID']).isin(pd.read_table(ANNO_CYTO)['Entry'])))
+
+
+# Tests below run the web processor on local files, with the UniProt stand-in for the id mapping
+class TestWebStandIn(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.annotation = list(pd.read_table(ANNO_SURFACE)['Entry'][:1234])
+        self.latest_ids = pd.read_table(IDS)
+        self.tp = pd.read_table(ANNO_SURFACE)
+        self.fp = pd.read_table(ANNO_CYTO)
+
+
+    def __run_job(self, name, results_store=None, **kwargs):
+        reference_path = f'{OUTPUT_DIR}/{name}_reference.sqlite'
+        if os.path.exists(reference_path):
+            os.remove(reference_path)
+        with UniProtStandIn(self.annotation, self.latest_ids) as standin:
+            communicator = WebUniProtCommunicator(False, 'cs', 1, self.tp, self.fp, store=ReferenceStore(reference_path), api_url=standin.url)
+            processor = WebProcessor(LocalUploadReader(MASS_DATA, 2, 3), communicator, results_store=results_store, **kwargs)
+            async def run():
+                job = await processor.start()
+                if processor.get_precompute_task() is not None:
+                    await processor.get_precompute_task()
+                return job
+            return run_with_clients(run())
+
+
+    def test_results_store_root(self):
+        root = f'{OUTPUT_DIR}/web_results'
+        shutil.rmtree(root, ignore_errors=True)
+        store = ResultsStore(root)
+        job_id, _, _ = self.__run_job('results_store_root', store)
+        self.assertTrue(os.path.exists(f'{root}/{job_id}/manifest.json'), 'The job should be written under the store root')
+        self.assertFalse(os.path.exists(f'{RESULTS_PATH}/{job_id}'))
+        self.assertEqual(store.get_total_size(), sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(f'{root}/{job_id}') for f in files))
+        self.assertEqual(len(pd.read_table(f'{root}/{job_id}/results/post-cutoff-proteome.tsv')), 564)
+
+
+    def test_precompute_scatter(self):
+        root = f'{OUTPUT_DIR}/web_precompute'
+        shutil.rmtree(root, ignore_errors=True)
+        job_id, _, columns = self.__run_job('precompute', ResultsStore(root), precompute_scatter=True)
+        expected = sorted(f'Correlation_{x}_vs_{y}.jpeg'.replace(' ', '_') for x, y in combinations(columns, 2))
+        self.assertEqual(sorted(name for name in os.listdir(f'{root}/{job_id}/web_plots') if name.startswith('Correlation')), expected)
+        with open(f'{root}/{job_id}/results/log.txt') as f:
+            self.assertIn('Reference data version: 1 ', f.read(), 'The pinned snapshot should be logged')
+        self.assertEqual(JobManifest(f'{root}/{job_id}').get('reference_versions'), {'cs': 1})
+
+
+    def test_snapshot_update(self):
+        reference_path = f'{OUTPUT_DIR}/snapshot_update_reference.sqlite'
+        if os.path.exists(reference_path):
+            os.remove(reference_path)
+        with UniProtStandIn(self.annotation, self.latest_ids) as standin:
+            store = ReferenceStore(reference_path)
+            communicator = WebUniProtCommunicator(False, 'cs', 1, self.tp, self.fp, store=store, api_url=standin.url)
+            async def run():
+                pinned = await communicator.get_snapshot()
+                await communicator.update_data()
+                return pinned, await communicator.get_snapshot()
+            pinned, updated = run_with_clients(run())
+        self.assertEqual((pinned.get_version(), updated.get_version()), (1, 2))
+        self.assertEqual(set(pinned.get_annotation('true_positive')['Entry']), set(self.tp['Entry'].dropna()), 'A pinned snapshot should not change')
+        self.assertEqual(set(updated.get_annotation('true_positive')['Entry']), set(self.annotation))
+        self.assertEqual(set(store.get_annotation('cs', 'false_positive')['Entry']), set(self.annotation))
+
+
+    def test_plot_scatter(self):
+        root = f'{OUTPUT_DIR}/web_scatter'
+        shutil.rmtree(root, ignore_errors=True)
+        store = ResultsStore(root)
+        job_id, _, columns = self.__run_job('plot_scatter', store)
+        # the external server calls plot_scatter synchronously, from its threadpool
+        web_plot = WebProcessor(job_id, columns[0], columns[1], results_store=store).plot_scatter()
+        self.assertEqual(web_plot, f'{root}/{job_id}/web_plots/Correlation_{columns[0]}_vs_{columns[1]}.jpeg'.replace(' ', '_'))
+        self.assertTrue(os.path.exists(web_plot))
+        web_plot = asyncio.run(WebProcessor(job_id, columns[1], columns[2], results_store=store).plot_scatter_async())
+        self.assertTrue(os.path.exists(web_plot))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
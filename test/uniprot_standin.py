@@ -0,0 +1,139 @@
+#################################################
+#   Local stand-in for the UniProt REST API    #
+#################################################
+
+import gzip
+import json
+import threading
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+
+
+PAGE_SIZE = 500
+ID_MAPPING_COLUMNS = ['From', 'Entry', 'Entry Name', 'Reviewed', 'Protein names', 'Gene Names', 'Organism', 'Length']
+
+
+class UniProtStandIn:
+    '''
+    Serves uniprotkb search/stream and the id mapping run/status/results endpoints from local files
+    annotation: list of accessions returned by every uniprotkb query
+    latest_ids: df with From, Entry, Protein names, Gene Names, Organism, Length
+    fail_ids: id mapping jobs containing any of these ids are rejected
+    running_polls: number of status checks each id mapping job reports RUNNING before it finishes
+    '''
+    def __init__(self, annotation, latest_ids, fail_stream=False, fail_ids=(), running_polls=0):
+        self.annotation = list(annotation)
+        self.latest_ids = latest_ids.drop_duplicates(subset=['From']).set_index('From')
+        self.fail_stream = fail_stream
+        self.fail_ids = set(fail_ids)
+        self.running_polls = running_polls
+        self.polls = Counter()
+        self.requests = Counter()
+        self.jobs = {}
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), self.__make_handler())
+        self.__server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.__server.server_address[1]}'
+
+
+    def __enter__(self):
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+    def annotation_lines(self):
+        return ['Entry'] + self.annotation
+
+
+    def id_mapping_lines(self, job_id):
+        lines = ['\t'.join(ID_MAPPING_COLUMNS)]
+        for old_id in self.jobs[job_id]:
+            # like UniProt, ids without a mapping have no row in the results
+            if old_id in self.latest_ids.index and pd.notnull(self.latest_ids.loc[old_id, 'Entry']):
+                row = self.latest_ids.loc[old_id]
+                values = [old_id, row['Entry'], '', 'reviewed', row['Protein names'], row['Gene Names'], row['Organism'], row['Length']]
+                lines.append('\t'.join('' if pd.isnull(value) else str(value) for value in values))
+        return lines
+
+
+    def __make_handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                return
+
+
+            def __send(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+
+            def __send_lines(self, lines, query, paginated):
+                headers = {}
+                if paginated:
+                    cursor = int(query.get('cursor', ['0'])[0])
+                    rows = lines[1:]
+                    if cursor + PAGE_SIZE < len(rows):
+                        headers['Link'] = f'<{standin.url}{urlparse(self.path).path}?cursor={cursor + PAGE_SIZE}>; rel="next"'
+                    lines = lines[:1] + rows[cursor:cursor + PAGE_SIZE]
+                self.__send(200, gzip.compress(('\n'.join(lines) + '\n').encode('utf-8')), headers)
+
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                path = parsed.path
+                if path == '/uniprotkb/search':
+                    standin.requests['search'] += 1
+                    self.__send_lines(standin.annotation_lines(), query, True)
+                elif path == '/uniprotkb/stream':
+                    standin.requests['stream'] += 1
+                    if standin.fail_stream:
+                        return self.__send(500, b'{"messages": ["stream failed"]}')
+                    self.__send_lines(standin.annotation_lines(), query, False)
+                elif path.startswith('/idmapping/status/'):
+                    standin.requests['status'] += 1
+                    job_id = path.rsplit('/', 1)[-1]
+                    standin.polls[job_id] += 1
+                    if standin.polls[job_id] <= standin.running_polls:
+                        return self.__send(200, b'{"jobStatus": "RUNNING"}')
+                    self.__send(303, b'', {'Location': f'{standin.url}/idmapping/uniprotkb/results/{job_id}'})
+                elif path.startswith('/idmapping/uniprotkb/results/stream/'):
+                    standin.requests['results_stream'] += 1
+                    if standin.fail_stream:
+                        return self.__send(500, b'{"messages": ["stream failed"]}')
+                    self.__send_lines(standin.id_mapping_lines(path.rsplit('/', 1)[-1]), query, False)
+                elif path.startswith('/idmapping/uniprotkb/results/'):
+                    standin.requests['results'] += 1
+                    self.__send_lines(standin.id_mapping_lines(path.rsplit('/', 1)[-1]), query, True)
+                else:
+                    self.__send(404, b'{"messages": ["not found"]}')
+
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode('utf-8'))
+                if urlparse(self.path).path == '/idmapping/run':
+                    standin.requests['run'] += 1
+                    ids = form['ids'][0].split(',')
+                    if len(standin.fail_ids.intersection(ids)) > 0:
+                        return self.__send(500, b'{"messages": ["job failed"]}')
+                    job_id = uuid.uuid4().hex
+                    standin.jobs[job_id] = ids
+                    self.__send(200, json.dumps({'jobId': job_id}).encode('utf-8'))
+                else:
+                    self.__send(404, b'{"messages": ["not found"]}')
+
+        return Handler
@@ -0,0 +1,29 @@
+#################################################
+#   Local stand-ins for the web service inputs  #
+#################################################
+
+import asyncio
+from peeling.userinputreader import UserInputReader
+from peeling.tablereader import read_table
+
+
+class LocalUploadReader(UserInputReader):
+    '''
+    Reads the mass spec data from a local file the way WebUserInputReader reads an upload, in a thread
+    '''
+    def __init__(self, mass_filename, num_controls, num_replicates, tolerance=0, plot_format='png', cellular_compartment='cs', defer_plots=False):
+        super().__init__(num_controls, num_replicates, tolerance, plot_format, cellular_compartment, defer_plots=defer_plots)
+        self.__mass_filename = mass_filename
+
+
+    # implement abstract method
+    async def get_mass_data(self):
+        data = await asyncio.get_running_loop().run_in_executor(None, read_table, self.__mass_filename, None, True)
+        self._check_file(data)
+        self._check_mass_spec_file(data)
+        return data
+
+
+    # implement abstract method
+    def get_mass_spec_filename(self):
+        return self.__mass_filename